@@ -1,22 +1,209 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 
 from fastapi import FastAPI
 from fastapi import FastAPI
 
-from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from datetime import datetime
+import numpy as np
 import pandas as pd
-from haversine import haversine
 
-from .mymodules.csv_cleaning import clean_csv1
+from .mymodules.geo import haversine_km
+from .mymodules.geocode_cache import GeocodeCache
+from .mymodules.geocoder import AsyncGeocoder
+from .mymodules.jobs import JobRunner
+from .mymodules.merge_build import MergeBuilder
+from .mymodules.metrics import (CONTENT_TYPE, SIZE_BUCKETS, MetricsMiddleware,
+                                MetricsRegistry, span)
+from .mymodules.profiling import SamplingProfiler
+from .mymodules.response_cache import ResponseCache, cached_response
+from .mymodules.scrape import main_async
+from .mymodules.shards import ShardSet
+from .mymodules.shelter_store import ShelterStore
+from .mymodules.suggest import SUGGEST_FIELDS
+from starlette.responses import Response
 
 import uvicorn
+import asyncio
+import hmac
 import json
-import requests
 import os
-import subprocess
 
-app = FastAPI()
+# CSV file paths
+REGPIE_CSV_PATH = 'app/regpie-RifugiOpenDa_2296-all.csv'
+SHELTERS_CSV_PATH = 'app/mountain_shelters.csv'
+URLS_CACHE_PATH = 'app/urls_cache.txt'
+SCRAPE_STATE_PATH = 'app/scrape_state.sqlite3'
+REGION_INDEX_PATH = 'app/urls_regions.csv'
+MERGED_DATA_CSV_PATH = os.path.join(
+    os.path.dirname(SHELTERS_CSV_PATH), 'merged_data.csv')
+
+# Seconds between two checks of the merge inputs for changes
+MERGE_CHECK_INTERVAL = 60.0
+
+# Rows of the regpie file parsed at a time by the merge; 0 reads it whole
+REGPIE_CHUNKSIZE = int(os.environ.get('REGPIE_CHUNKSIZE', 0))
+
+# Seconds between two scheduled scrapes of the shelters; 0 disables them
+SCRAPE_REFRESH_INTERVAL = float(
+    os.environ.get('SCRAPE_REFRESH_INTERVAL', 7 * 24 * 3600))
+
+# Token expected in the X-Admin-Token header of the admin endpoints, which
+# are disabled when it is not set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Profile one request in this many with cProfile, writing the profiles to
+# PROFILE_DIR; 0 disables profiling
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+
+def ensure_merged_data():
+    """
+    Make sure merged_data.csv exists, building it from the source files.
+
+    Raises:
+    HTTPException: 503 if the shelters have not been scraped yet, or the
+                   merged data is not built yet. A scrape or merge job is
+                   started in the background instead.
+    """
+    # Check if mountain_shelters.csv exists, otherwise scrape it in the
+    # background; the merged data is built when the scrape is done
+    if not os.path.exists(SHELTERS_CSV_PATH):
+        print("Mountain shelters file not found. Starting a scrape job.")
+        scrape_job.trigger('missing data')
+        raise HTTPException(
+            status_code=503, headers={'Retry-After': '60'},
+            detail="The shelters are being scraped, please retry later.")
+
+    # Check if merged_data.csv exists, otherwise build it in the background
+    if not os.path.exists(MERGED_DATA_CSV_PATH):
+        print("Merged data file not found. Starting a merge job.")
+        merge_job.trigger('missing data')
+        raise HTTPException(
+            status_code=503, headers={'Retry-After': '5'},
+            detail="The shelters dataset is being built, please retry later.")
+
+
+# Resident copy of merged_data.csv, reloaded when the file changes
+shelter_store = ShelterStore(MERGED_DATA_CSV_PATH, prepare=ensure_merged_data)
+
+
+def parse_region_shards(spec):
+    """
+    Parse a list of region shards like "Lombardia=app/lombardia.csv;...".
+
+    Returns:
+    dict: Region name -> path of its merged data CSV file.
+    """
+    shards = {}
+    for entry in (spec or '').split(';'):
+        if '=' in entry:
+            region, path = entry.split('=', 1)
+            shards[region.strip()] = path.strip()
+    return shards
+
+
+# One dataset per region: Piemonte is merged from the files above, and more
+# regions can be served from their own merged data files through
+# REGION_SHARDS
+shard_set = ShardSet(dict(
+    {'Piemonte': shelter_store},
+    **{region: ShelterStore(path) for region, path in
+       parse_region_shards(os.environ.get('REGION_SHARDS')).items()}))
+
+# Rebuilds merged_data.csv in the background when its inputs change, and
+# swaps the new version into the store
+merge_builder = MergeBuilder(REGPIE_CSV_PATH, SHELTERS_CSV_PATH,
+                             MERGED_DATA_CSV_PATH,
+                             on_build=lambda path: shelter_store.reload(),
+                             chunksize=REGPIE_CHUNKSIZE or None)
+
+# Builds merged_data.csv in the background when it is missing
+merge_job = JobRunner('merge', lambda progress: merge_builder.rebuild())
+
+
+def scrape_shelters(progress):
+    """
+    Scrape the shelters again, then rebuild the merged data.
+
+    The scraper writes temporary files, which only replace
+    mountain_shelters.csv and the URL cache if it found shelters, so the
+    API keeps serving the last good data during the scrape and after a
+    failed one. Only the detail pages that changed since the last scrape
+    are downloaded again, and an interrupted scrape is resumed.
+
+    Parameters:
+    progress (callable): Progress callback of the job.
+    """
+    tmp_path = SHELTERS_CSV_PATH + '.tmp'
+    # Fetch the listing pages again rather than the cached URLs
+    urls_tmp_path = URLS_CACHE_PATH + '.tmp'
+    try:
+        if os.path.exists(urls_tmp_path):
+            os.remove(urls_tmp_path)
+        progress(0, message='Scraping')
+        asyncio.run(main_async(csv_file=tmp_path, cache_file=urls_tmp_path,
+                               region_index_file=REGION_INDEX_PATH,
+                               on_progress=progress,
+                               state_path=SCRAPE_STATE_PATH))
+        if pd.read_csv(tmp_path).empty:
+            raise RuntimeError(
+                "The scrape found no shelters, keeping the current file.")
+        os.replace(tmp_path, SHELTERS_CSV_PATH)
+        if os.path.exists(urls_tmp_path):
+            os.replace(urls_tmp_path, URLS_CACHE_PATH)
+    finally:
+        for path in (tmp_path, urls_tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+    progress(0, message='Merging')
+    merge_builder.rebuild()
+
+
+# Single-flight scrape job, run on demand and on a schedule
+scrape_job = JobRunner('scrape', scrape_shelters)
+
+# Serialized responses of the current dataset version
+response_cache = ResponseCache()
+
+# Metrics served in the Prometheus text format at /metrics
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    'shelters_stage_seconds',
+    'Time spent in each stage of the shelter queries.',
+    labelnames=('stage',))
+result_sizes = metrics.histogram(
+    'shelters_results', 'Number of shelters returned by the queries.',
+    buckets=SIZE_BUCKETS)
+response_cache_hits = metrics.counter(
+    'response_cache_hits_total', 'Queries answered from the response cache.')
+response_cache_misses = metrics.counter(
+    'response_cache_misses_total', 'Queries run and serialized.')
+profiler = SamplingProfiler(PROFILE_SAMPLE_EVERY, PROFILE_DIR)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Load the shelters dataset once, before serving requests."""
+    try:
+        dataset = shard_set.load()
+        # Pre-serialize the unfiltered listing
+        cached_search(dataset, offset=0)
+    except Exception as e:
+        print(f"Could not preload merged data: {e}")
+    merge_builder.start(MERGE_CHECK_INTERVAL)
+    if SCRAPE_REFRESH_INTERVAL > 0:
+        scrape_job.start_schedule(SCRAPE_REFRESH_INTERVAL)
+    yield
+    scrape_job.stop_schedule()
+    merge_builder.stop()
+    await geocoder.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, registry=metrics, profiler=profiler)
 
 
 @app.get("/")
@@ -27,179 +214,446 @@ def read_root():
 
 # Google API key
 GOOGLE_API_KEY = "XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+GEOCODING_API_URL = "https://maps.googleapis.com/maps/api/geocode/json"
 
+# Geocoding results are cached in memory, and also in SQLite when
+# GEOCODE_CACHE_DB is set to a file path, e.g. app/geocode_cache.sqlite3
+# (ignored by git)
+geocode_cache = GeocodeCache(db_path=os.environ.get('GEOCODE_CACHE_DB'))
 
-def get_coordinates(address):
+
+geocoder = AsyncGeocoder(GEOCODING_API_URL, GOOGLE_API_KEY,
+                         cache=geocode_cache, metrics=metrics)
+
+
+async def get_coordinates(address):
     """
-    Convert an address to geographic coordinates using Google's Geocoding API.
+    Convert an address to geographic coordinates using Google's Geocoding API,
+    going through the geocode cache first.
     """
-    base_url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {"address": address, "key": GOOGLE_API_KEY}
-    try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        if data['status'] != 'OK':
-            print(f"Error in Geocoding API response: {data['status']}")
-            return None, None
-        location = data['results'][0]['geometry']['location']
-        return location['lat'], location['lng']
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Geocoding API: {e}")
-        return None, None
-
-# def is_location_in_piemonte(lat, lng):
-#         """
-#         Check if given latitude and longitude are in the Piemonte
-#         region using Google's Reverse Geocoding API.
-#         """
-#         reverse_geocode_url =
-#         "https://maps.googleapis.com/maps/api/geocode/json"
-#         params = {
-#             "latlng": f"{lat},{lng}",
-#             "key": GOOGLE_API_KEY
-#         }
-#         try:
-#             response = requests.get(reverse_geocode_url, params=params)
-#             response.raise_for_status()
-#             data = response.json()
-#             if data['status'] != 'OK':
-#                 print(f"Error in Reverse Geocoding
-#                         API response: {data['status']}")
-#                 return False
-
-#             # Check if any of the returned results are in the Piemonte region
-#             for result in data['results']:
-#                 if any('Piemonte' in component['long_name']
-#                        for component in result['address_components']):
-#                     return True
-
-#             return False
-#         except requests.exceptions.RequestException as e:
-#             print(f"Error connecting to Reverse Geocoding API: {e}")
-#             return False
+    return await geocoder.get_coordinates(address)
+
+# Fields returned in summary mode, enough to draw map markers
+SUMMARY_FIELDS = ['DENOMINAZIONE', 'PROVINCIA', 'COMUNE', 'LETTI',
+                  'Latitude', 'Longitude', 'Distance', 'Distance_km']
+
+# Fields added to the records by location queries
+DISTANCE_FIELDS = ['Distance', 'Distance_km']
+
+# Field added to the records by full-text queries
+SCORE_FIELD = 'Score'
+
+
+def parse_fields(fields, summary, columns):
+    """
+    Work out which fields of the records to return.
+
+    Parameters:
+    fields (str or None): Comma-separated field names.
+    summary (bool): Whether summary mode was requested.
+    columns (list): Columns of the dataset.
+
+    Returns:
+    tuple or None: The field names, or None to return every field.
+    Raises:
+    HTTPException: If a requested field does not exist.
+    """
+    if fields:
+        names = tuple(name.strip() for name in fields.split(',')
+                      if name.strip())
+        unknown = [name for name in names
+                   if name not in columns and name not in DISTANCE_FIELDS
+                   and name != SCORE_FIELD]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown field(s): {', '.join(unknown)}")
+        return names
+    if summary:
+        return tuple(SUMMARY_FIELDS)
+    return None
+
+
+def project(items, fields=None):
+    """Keep only `fields` (when given) of each record in `items`."""
+    if fields is None:
+        return items
+    return [{name: item[name] for name in fields if name in item}
+            for item in items]
+
+
+def paginate(items, limit=None, offset=0):
+    """
+    Return the page of `items` starting at `offset`, with at most
+    `limit` entries (all of the remaining ones when `limit` is None).
+    """
+    if limit is None:
+        return items[offset:]
+    return items[offset:offset + limit]
+
+
+def match_shard(dataset, user_lat=None, user_lng=None, range_km=None,
+                nearest=None, q=None, **mask_filters):
+    """
+    Find the shelters of one shard matching a query.
+
+    Parameters:
+    dataset (ShelterDataset): The snapshot of the shard.
+    q (str, optional): Words to search in the names and descriptions.
+    mask_filters: The `equal`, `at_least`, `at_most` and `text` arguments
+                  of ShelterColumns.mask().
+
+    Returns:
+    tuple: (indices, distances, scores) of the matching shelters. They are
+           closest first with a location, best scoring first with `q` only,
+           and in dataset order otherwise. distances is None without a
+           location and scores is None without `q`.
+    """
+    # Apply the attribute filters as a single boolean mask
+    mask = dataset.columns.mask(**mask_filters)
+    scores = None
+    if q is not None:
+        scores = dataset.text.scores(q)
+        mask = mask & (scores > 0)
+
+    if user_lat is None or user_lng is None:
+        indices = np.flatnonzero(mask)
+        if scores is None:
+            return indices, None, None
+        indices = indices[np.argsort(-scores[indices], kind='stable')]
+        return indices, None, scores[indices]
+
+    # Location-based filtering through the spatial index
+    if nearest is not None:
+        indices, distances = dataset.spatial.nearest(
+            user_lat, user_lng, nearest, mask)
+        if range_km is not None:
+            keep = distances <= range_km
+            indices, distances = indices[keep], distances[keep]
+    elif range_km is not None:
+        indices, distances = dataset.spatial.within(
+            user_lat, user_lng, range_km, mask)
+    else:
+        indices = np.flatnonzero(mask)
+        distances = haversine_km(
+            user_lat, user_lng,
+            dataset.spatial.lats[indices], dataset.spatial.lngs[indices])
+    order = np.argsort(distances, kind='stable')
+    indices = indices[order]
+    return (indices, distances[order],
+            None if scores is None else scores[indices])
+
+
+def search_shelters(dataset, user_lat=None, user_lng=None, bagni=None,
+                    camere=None, letti=None, provincia=None, comune=None,
+                    range_km=None, min_letti=None, max_letti=None,
+                    min_camere=None, max_camere=None, min_bagni=None,
+                    max_bagni=None, nearest=None, limit=None, offset=0,
+                    fields=None, q=None):
+    """
+    Filter the shelters of `dataset`, returning the page selected by
+    `limit`/`offset` and only the given `fields` of each record.
+
+    Only the region shards that can match are searched: the ones with the
+    requested PROVINCIA/COMUNE, and the ones near enough to the location.
+    With `q`, only the shelters whose name or description has one of its
+    words are returned, with their BM25 `Score`, best first when there is
+    no location.
+
+    Parameters:
+    dataset (ShardedDataset): The snapshot of every region.
+
+    Returns:
+    list or dict: The matching records, or a dictionary with an error
+                  message when a PROVINCIA or COMUNE has no results.
+    """
+    # Check if any filter is set
+    range_filters = [min_letti, max_letti, min_camere, max_camere,
+                     min_bagni, max_bagni]
+    is_any_filter_set = any([
+        bagni, camere, letti, provincia, comune, q, user_lat is not None,
+        range_km is not None
+    ]) or nearest is not None or any(
+        value is not None for value in range_filters)
+
+    if not is_any_filter_set:
+        # If no filters are set, return all data
+        return project(paginate(dataset.records, limit, offset), fields)
+
+    mask_filters = dict(
+        equal={'BAGNI': bagni, 'CAMERE': camere, 'LETTI': letti},
+        at_least={'LETTI': min_letti, 'CAMERE': min_camere,
+                  'BAGNI': min_bagni},
+        at_most={'LETTI': max_letti, 'CAMERE': max_camere,
+                 'BAGNI': max_bagni},
+        text={'PROVINCIA': provincia, 'COMUNE': comune})
+
+    matches = []
+    for shard in dataset.route(provincia, comune, user_lat, user_lng,
+                               range_km):
+        indices, distances, scores = match_shard(
+            shard.dataset, user_lat, user_lng, range_km, nearest, q,
+            **mask_filters)
+        records = [shard.dataset.records[index] for index in indices.tolist()]
+        matches.extend(zip(
+            [None] * len(records) if distances is None else distances.tolist(),
+            [None] * len(records) if scores is None else scores.tolist(),
+            records))
+
+    if user_lat is not None and user_lng is not None:
+        # Merge the shards by distance; each one is already sorted
+        matches.sort(key=lambda match: match[0])
+        if nearest is not None:
+            matches = matches[:nearest]
+    elif q is not None:
+        # Merge the shards by score
+        matches.sort(key=lambda match: -match[1])
+
+    filtered_data = []
+    for distance, score, record in matches:
+        if distance is not None:
+            record = dict(record, Distance=f"{distance:.2f} km",
+                          Distance_km=round(distance, 3))
+        if score is not None:
+            record = dict(record, **{SCORE_FIELD: round(score, 3)})
+        filtered_data.append(record)
+
+    # Check if no results found for provincia or comune
+    if provincia and not filtered_data:
+        return {"error": f"No results found for the PROVINCIA '{provincia}'"}
+    if comune and not filtered_data:
+        return {"error": f"No results found for the COMUNE '{comune}'"}
+
+    return project(paginate(filtered_data, limit, offset), fields)
+
+
+def cached_search(dataset, user_lat=None, user_lng=None, **filters):
+    """
+    Run search_shelters() through the response cache, so that each query
+    is serialized and compressed only once per dataset version. The
+    'filter' and 'serialize' stages are timed when the cache is missed.
+
+    Returns:
+    CachedBody: The serialized results.
+    """
+    key = response_cache.key(dict(filters, lat=user_lat, lng=user_lng))
+    cached = response_cache.get(dataset.version, key)
+    if cached is None:
+        response_cache_misses.inc()
+        with span(stage_seconds, 'filter'):
+            content = search_shelters(dataset, user_lat, user_lng, **filters)
+        with span(stage_seconds, 'serialize'):
+            cached = response_cache.put(dataset.version, key, content)
+    else:
+        response_cache_hits.inc()
+    return cached
 
 
 @app.get('/cleaned_csv_show')
 async def read_and_return_cleaned_csv(
+    request: Request,
     bagni: str = Query(None),
     camere: str = Query(None),
     letti: str = Query(None),
     provincia: str = Query(None),
     comune: str = Query(None),
     location: str = Query(None),
-    range_km: float = Query(None)
+    range_km: float = Query(None),
+    min_letti: int = Query(None),
+    max_letti: int = Query(None),
+    min_camere: int = Query(None),
+    max_camere: int = Query(None),
+    min_bagni: int = Query(None),
+    max_bagni: int = Query(None),
+    nearest: int = Query(None, ge=1),
+    limit: int = Query(None, ge=0),
+    offset: int = Query(0, ge=0),
+    fields: str = Query(None),
+    summary: bool = Query(False),
+    q: str = Query(None)
 ):
     """
     Get the cleaned CSV file content.
-    This route accepts query parameters for filtering the CSV data,
-    reads the cleaned CSV file,
-    and returns its content. If the file does not exist, it will
-    trigger a scrape and create it.
+    This route accepts query parameters for filtering the CSV data
+    and returns the matching rows from the in-memory dataset. If the
+    shelters have not been scraped yet, a scrape job is started in the
+    background and an HTTP 503 error is returned.
     Query Parameters:
     - bagno: str (optional)
     - camera: str (optional)
     ...
+    - min_letti, max_letti, min_camere, max_camere, min_bagni,
+      max_bagni: int (optional), inclusive capacity ranges
+    - nearest: int (optional), with location: the k closest shelters
+    - limit, offset: int (optional), page of the results to return
+    - fields: str (optional), comma-separated fields to return
+    - summary: bool (optional), return only the fields needed for map
+      markers, without descriptions
+    - q: str (optional), words to search in the shelter names and
+      descriptions; matches get a BM25 `Score` and, without a location,
+      are sorted by it
+    With a location, results are sorted by the numeric `Distance_km`.
+    Locations outside the covered regions get an error message, checked
+    offline against their outlines or bounding boxes.
+    Responses are served from a pre-serialized cache, with ETag and
+    `If-None-Match` support. The time spent loading, geocoding, filtering
+    and serializing is sent in the `Server-Timing` header and exported
+    at /metrics.
     Returns:
     - JSON response containing the CSV data or an error message.
     Raises:
     - HTTPException: If the file can't be loaded, an HTTP 500 error
-    is returned with the exception message.
-    """
-    # CSV file paths
-    regpie_csv_path = 'app/regpie-RifugiOpenDa_2296-all.csv'
-    shelters_csv_path = 'app/mountain_shelters.csv'
-    scrape_script_path = 'app/mymodules/scrape.py'
-
-    # Check if mountain_shelters.csv exists,
-    # otherwise run scrape.py
-    if not os.path.exists(shelters_csv_path):
-        print("""Mountain shelters file not found.
-              Running scrape.py to generate it.""")
-        subprocess.run(['python', scrape_script_path], check=True)
-
-    # Define the path for merged_data.csv
-    merged_data_csv_path = os.path.join(
-        os.path.dirname(shelters_csv_path), 'merged_data.csv')
-    print(f"merged_data_csv_path: {merged_data_csv_path}")
-    # Check if merged_data.csv exists, otherwise run clean_csv1
-    if not os.path.exists(merged_data_csv_path):
-        print("Merged data file not found. Running clean_csv1 to generate it.")
-        clean_csv1(regpie_csv_path, shelters_csv_path)
-
-    # After ensuring merged_data.csv exists, load and return its contents
+    is returned with the exception message. Unknown `fields` give
+    an HTTP 400 error.
+    """
+    # Serve the resident dataset, generating or reloading it if needed.
+    # Anything that may touch the disk runs off the event loop.
     try:
-        cleaned_df = pd.read_csv(merged_data_csv_path)
+        with span(stage_seconds, 'load'):
+            if shard_set.needs_check():
+                dataset = await run_in_threadpool(shard_set.get)
+            else:
+                dataset = shard_set.get()
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error loading merged data: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error loading merged data: {str(e)}")
+    selected_fields = parse_fields(fields, summary, dataset.columns)
     # Get user coordinates
     user_lat, user_lng = None, None
     if location:
-        user_lat, user_lng = get_coordinates(location)
+        with span(stage_seconds, 'geocode'):
+            user_lat, user_lng = await get_coordinates(location)
         if user_lat is None or user_lng is None:
             print("Invalid location or unable to get coordinates.")
-            return {"error": """💀 Invalid location. Please re-enter a valid location."""}
-        # if not is_location_in_piemonte(user_lat, user_lng):
-        #     print("Location is not in Piemonte.")
-        #     raise HTTPException(status_code=400,
-        #       detail="Location is not in Piemonte")
+            return {"error": "💀 Invalid location. "
+                             "Please re-enter a valid location."}
+        # Checked offline against the outlines and boxes of the regions
+        if not dataset.regions_at(user_lat, user_lng):
+            print("Location is outside the covered regions.")
+            regions = ', '.join(shard.region for shard in dataset.shards)
+            return {"error": "📍 This location is outside the covered "
+                             f"regions ({regions})."}
         print(f"""User coordinates:
               Latitude = {user_lat}, Longitude = {user_lng}""")
     else:
         user_lat, user_lng = None, None
-    # Convert the DataFrame to a dictionary for processing
-    cleaned_data = cleaned_df.to_dict(orient='records')
 
-    # Check if any filter is set
-    is_any_filter_set = any([
-        bagni, camere, letti, provincia, comune, location, range_km is not None
-    ])
+    cached = cached_search(
+        dataset, user_lat, user_lng, bagni=bagni, camere=camere,
+        letti=letti, provincia=provincia, comune=comune, range_km=range_km,
+        min_letti=min_letti, max_letti=max_letti, min_camere=min_camere,
+        max_camere=max_camere, min_bagni=min_bagni, max_bagni=max_bagni,
+        nearest=nearest, limit=limit, offset=offset, fields=selected_fields,
+        q=(q.strip() or None) if q else None)
+    if cached.size is not None:
+        result_sizes.observe(cached.size)
+    return cached_response(request, cached)
 
-    if not is_any_filter_set:
-        # If no filters are set, return all data
-        return JSONResponse(content=cleaned_data)
 
-        # Apply filters
-    filtered_data = []
-    for item in cleaned_data:
-        if bagni and str(item.get('BAGNI', '')) != bagni:
-            continue
-        if camere and str(item.get('CAMERE', '')) != camere:
-            continue
-        if letti and str(item.get('LETTI', '')) != letti:
-            continue
-        if (provincia
-                and item.get('PROVINCIA', '').lower() != provincia.lower()):
-            continue
-        if comune and item.get('COMUNE', '').lower() != comune.lower():
-            continue
-
-        # Location-based filtering
-        if (
-            user_lat is not None and
-            user_lng is not None and
-            range_km is not None
-        ):
-            if 'Latitude' in item and 'Longitude' in item:
-                item_lat, item_lng = item['Latitude'], item['Longitude']
-                distance = haversine(
-                    (user_lat, user_lng),
-                    (item_lat, item_lng)
-                )
-                if distance <= range_km:
-                    item['Distance'] = f"{distance:.2f} km"
-                    filtered_data.append(item)
-            continue
-
-        filtered_data.append(item)
-    # Check if no results found for provincia or comune
-    if provincia and not filtered_data:
-        return {"error": f"No results found for the PROVINCIA '{provincia}'"}
-    if comune and not filtered_data:
-        return {"error": f"No results found for the COMUNE '{comune}'"}
+@app.get('/suggest')
+async def suggest(
+    q: str = Query(..., min_length=1),
+    field: str = Query(None),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """
+    Autocomplete PROVINCIA, COMUNE and DENOMINAZIONE values.
+    Query Parameters:
+    - q: str, the text typed so far; case and accents are ignored
+    - field: str (optional), only suggest values of this field
+    - limit: int (optional), maximum number of suggestions
+    Returns:
+    - JSON list of {field, value, count}, values starting with `q`
+    first, then the most common ones.
+    Raises:
+    - HTTPException: An HTTP 400 error for an unknown `field`.
+    """
+    fields = None
+    if field:
+        fields = {field.strip().upper()}
+        if not fields <= set(SUGGEST_FIELDS):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown field: {field}. Use one of: "
+                       f"{', '.join(SUGGEST_FIELDS)}.")
+    try:
+        if shard_set.needs_check():
+            dataset = await run_in_threadpool(shard_set.get)
+        else:
+            dataset = shard_set.get()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error loading merged data: {str(e)}")
+    return dataset.suggestions.suggest(q, fields=fields, limit=limit)
+
+
+@app.get('/metrics')
+def read_metrics():
+    """
+    Export the metrics of the backend in the Prometheus text format:
+    request latency and response size per route, the time of each stage
+    of the shelter queries, the number of shelters returned, and the
+    response cache and geocoding counters.
+    """
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+
+def check_admin_token(token):
+    """
+    Check the X-Admin-Token header of an admin request.
+
+    Raises:
+    HTTPException: 403 if the admin endpoints are disabled, 401 if the
+                   token is wrong.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403,
+                            detail="Admin endpoints are disabled.")
+    if not hmac.compare_digest(token or '', ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+
+@app.post('/admin/scrape', status_code=202)
+def trigger_scrape(x_admin_token: str = Header(None)):
+    """
+    Start a scrape of the shelters in the background, unless one is
+    already running. The current dataset is served until it is done.
+
+    Returns:
+    - started: whether a new job was started
+    - job: state of the new job, or of the one already running
+    """
+    check_admin_token(x_admin_token)
+    job, started = scrape_job.trigger('admin')
+    return {'started': started, 'job': job.to_dict()}
+
+
+@app.get('/admin/jobs')
+def list_jobs(x_admin_token: str = Header(None)):
+    """Return the running scrape job, if any, and the finished ones."""
+    check_admin_token(x_admin_token)
+    current = scrape_job.current()
+    return {
+        'current': current.to_dict() if current else None,
+        'history': [job.to_dict() for job in scrape_job.history()],
+    }
+
+
+@app.get('/admin/jobs/{job_id}')
+def get_job(job_id: int, x_admin_token: str = Header(None)):
+    """Return the state of one scrape job."""
+    check_admin_token(x_admin_token)
+    job = scrape_job.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job.to_dict()
 
-    # Return filtered data if no error condition is met
-    return JSONResponse(content=filtered_data)
 
 if __name__ == "__main__":
     print("🌈 Running on http://localhost:8081")
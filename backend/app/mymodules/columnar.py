@@ -0,0 +1,236 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_FILE = 'manifest.json'
+STRINGS_FILE = 'strings.bin'
+OFFSETS_FILE = 'string_offsets.npy'
+
+
+def columnar_path(csv_path):
+    """Directory of the columnar copy of `csv_path`."""
+    return os.path.splitext(csv_path)[0] + '.columns'
+
+
+def _source_stat(source):
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_columnar(frame, directory, source=None):
+    """
+    Save a DataFrame as one .npy file per column plus a string table.
+
+    Numeric columns are saved as they are. Text columns are saved as int32
+    codes into a table of the distinct strings of the whole frame, stored
+    once as UTF-8 bytes with their offsets; -1 stands for a missing value.
+    The files go in a new subdirectory and the manifest naming it is
+    replaced last, so readers never see a half-written version.
+
+    Parameters:
+    frame (pd.DataFrame): The data to save.
+    directory (str): Directory of the columnar copy.
+    source (str, optional): File the data was saved from too, usually the
+                            CSV. The copy is only read back while that file
+                            is unchanged.
+    """
+    version = uuid.uuid4().hex
+    version_dir = os.path.join(directory, version)
+    os.makedirs(version_dir)
+
+    strings = {}
+    columns = []
+    for position, name in enumerate(frame.columns):
+        values = frame[name]
+        path = os.path.join(version_dir, f'c{position}.npy')
+        if pd.api.types.is_numeric_dtype(values.dtype):
+            array = values.to_numpy()
+            columns.append({'name': name, 'kind': 'numeric',
+                            'dtype': array.dtype.str})
+        else:
+            array = np.array(
+                [-1 if pd.isna(value)
+                 else strings.setdefault(str(value), len(strings))
+                 for value in values], dtype=np.int32)
+            columns.append({'name': name, 'kind': 'str'})
+        np.save(path, array)
+
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded])
+    with open(os.path.join(version_dir, STRINGS_FILE), 'wb') as file:
+        file.write(b''.join(encoded))
+    np.save(os.path.join(version_dir, OFFSETS_FILE), offsets)
+
+    manifest = {
+        'version': version,
+        'rows': len(frame),
+        'columns': columns,
+        'source': _source_stat(source) if source else None,
+    }
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as file:
+        json.dump(manifest, file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    # Older versions may still be mapped by readers, which keep them alive
+    for entry in os.listdir(directory):
+        old_dir = os.path.join(directory, entry)
+        if entry != version and os.path.isdir(old_dir):
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class StringTable:
+    """
+    The distinct strings of a columnar copy, kept as the memory-mapped
+    UTF-8 bytes and decoded each time one of them is read.
+    """
+
+    def __init__(self, blob, offsets):
+        """
+        Parameters:
+        blob (np.ndarray): The UTF-8 bytes of every string, end to end.
+        offsets (np.ndarray): Start of each string in `blob`, plus its end.
+        """
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        if code < 0:
+            return None
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return bytes(self.blob[start:end]).decode('utf-8')
+
+
+class StringColumn:
+    """
+    Text column of a columnar copy: memory-mapped int32 codes into a
+    StringTable, with -1 for a missing value. Values are only decoded when
+    they are read.
+    """
+
+    def __init__(self, codes, table):
+        """
+        Parameters:
+        codes (np.ndarray): Code of the value of each row.
+        table (StringTable): The strings the codes refer to.
+        """
+        self.codes = codes
+        self.table = table
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        """Return the value of one row, or None when it is missing."""
+        return self.table[int(self.codes[index])]
+
+    def tolist(self):
+        """
+        Decode the whole column, each distinct string once.
+
+        Returns:
+        list: The value of each row, None for the missing ones.
+        """
+        decoded = {}
+        values = []
+        for code in self.codes.tolist():
+            value = decoded.get(code)
+            if value is None:
+                value = decoded[code] = self.table[code]
+            values.append(value)
+        return values
+
+    def to_numpy(self):
+        """
+        Decode the whole column into an object array, with NaN for the
+        missing values like a text column read from a CSV file.
+        """
+        array = np.empty(len(self.codes), dtype=object)
+        array[:] = [np.nan if value is None else value
+                    for value in self.tolist()]
+        return array
+
+
+def _map_bytes(path):
+    # np.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+def read_columnar(directory, source=None, decode=True):
+    """
+    Load a copy saved by write_columnar().
+
+    Numeric columns are memory-mapped rather than read, so processes
+    loading the same copy share its pages in the OS page cache. With
+    `decode` False the text columns are returned as StringColumn objects
+    over the memory-mapped codes and strings, which are shared the same
+    way; otherwise they are decoded into object arrays, each distinct
+    string once.
+
+    Parameters:
+    directory (str): Directory of the columnar copy.
+    source (str, optional): The copy is ignored if this file changed since
+                            it was saved.
+    decode (bool, optional): Decode the text columns.
+
+    Returns:
+    dict: Column name -> NumPy array or StringColumn, in the saved order,
+          or None if there is no up to date copy.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as file:
+            manifest = json.load(file)
+        if source is not None and \
+                manifest['source'] != _source_stat(source):
+            return None
+        version_dir = os.path.join(directory, manifest['version'])
+
+        table = StringTable(
+            _map_bytes(os.path.join(version_dir, STRINGS_FILE)),
+            np.load(os.path.join(version_dir, OFFSETS_FILE), mmap_mode='r'))
+        arrays = {}
+        for position, column in enumerate(manifest['columns']):
+            array = np.load(os.path.join(version_dir, f'c{position}.npy'),
+                            mmap_mode='r')
+            if column['kind'] != 'numeric':
+                array = StringColumn(array, table)
+                if decode:
+                    array = array.to_numpy()
+            arrays[column['name']] = array
+        return arrays
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def columnar_frame(arrays, columns=None):
+    """
+    Build a DataFrame over the arrays returned by read_columnar(), with
+    the same dtypes as reading the CSV file with explicit dtypes.
+
+    Parameters:
+    arrays (dict): Column name -> NumPy array or StringColumn.
+    columns (iterable, optional): Only include these columns, when present.
+
+    Returns:
+    pd.DataFrame: The data, with one row per entry of the arrays.
+    """
+    series = {}
+    for name, array in arrays.items():
+        if columns is not None and name not in columns:
+            continue
+        if isinstance(array, StringColumn):
+            array = array.to_numpy()
+        series[name] = (pd.Series(array, dtype=str) if array.dtype == object
+                        else pd.Series(array, copy=False))
+    rows = len(next(iter(arrays.values()))) if arrays else 0
+    return pd.DataFrame(series, index=pd.RangeIndex(rows))
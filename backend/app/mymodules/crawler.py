@@ -0,0 +1,168 @@
+import asyncio
+import random
+from urllib.parse import urlsplit
+
+import httpx
+
+# Responses worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostLimiter:
+    """
+    Limits the requests sent to one host, both in number of concurrent
+    requests and in requests started per second.
+    """
+
+    def __init__(self, concurrency, rate=None):
+        """
+        Parameters:
+        concurrency (int): Maximum number of requests in flight.
+        rate (float, optional): Maximum number of requests started per
+                                second. Unlimited when None.
+        """
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval:
+            loop = asyncio.get_running_loop()
+            async with self._lock:
+                now = loop.time()
+                start = max(now, self._next_start)
+                self._next_start = start + self.interval
+            if start > now:
+                await asyncio.sleep(start - now)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+
+class AsyncCrawler:
+    """
+    Asynchronous HTTP fetcher for the scraper.
+
+    All requests share one keep-alive httpx.AsyncClient. Each host gets its
+    own HostLimiter, and failed requests are retried with exponential
+    backoff and random jitter, honouring Retry-After when the server sends
+    it. Use it as an async context manager.
+    """
+
+    def __init__(self, max_connections=20, per_host_concurrency=5,
+                 per_host_rate=5.0, retries=3, backoff=0.5, timeout=30.0,
+                 verify=True, transport=None):
+        """
+        Parameters:
+        max_connections (int, optional): Size of the connection pool.
+        per_host_concurrency (int, optional): Requests in flight per host.
+        per_host_rate (float, optional): Requests started per second and
+                                         per host. Unlimited when None.
+        retries (int, optional): Number of retries after a failed request.
+        backoff (float, optional): Base delay in seconds between retries.
+        timeout (float, optional): Timeout in seconds of each request.
+        verify (bool, optional): Whether to verify TLS certificates.
+        transport (httpx.AsyncBaseTransport, optional): Transport to use
+                                                        instead of the
+                                                        network, e.g. a stub.
+        """
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_rate = per_host_rate
+        self.retries = retries
+        self.backoff = backoff
+        self._limiters = {}
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections),
+            follow_redirects=True, verify=verify, transport=transport)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the pooled client."""
+        await self._client.aclose()
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._limiters:
+            self._limiters[host] = HostLimiter(
+                self.per_host_concurrency, self.per_host_rate)
+        return self._limiters[host]
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    async def fetch(self, url, headers=None):
+        """
+        GET a URL, retrying transient failures.
+
+        Parameters:
+        url (str): The URL to fetch.
+        headers (dict, optional): Extra request headers.
+
+        Returns:
+        httpx.Response: The response. After the last retry it may still
+                        have one of the RETRY_STATUSES.
+        Raises:
+        httpx.TransportError: If the last attempt failed to connect.
+        """
+        limiter = self._limiter(url)
+        for attempt in range(self.retries + 1):
+            try:
+                async with limiter:
+                    response = await self._client.get(url, headers=headers)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            if (response.status_code not in RETRY_STATUSES
+                    or attempt == self.retries):
+                return response
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    async def _fetch_and_parse(self, url, parse):
+        try:
+            response = await self.fetch(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Error fetching {url}: {e}")
+            return url, None
+        if parse is None:
+            return url, response
+        return url, parse(response.content)
+
+    async def crawl(self, urls, parse=None):
+        """
+        Fetch many URLs concurrently.
+
+        Parameters:
+        urls (list): The URLs to fetch.
+        parse (callable, optional): Called with the body of each response.
+
+        Yields:
+        tuple: (url, result) as soon as each URL is done, where result is
+               parse(body), or the response when no parse function is
+               given, or None if the URL could not be fetched.
+        """
+        tasks = [asyncio.ensure_future(self._fetch_and_parse(url, parse))
+                 for url in urls]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -2,8 +2,12 @@ import pandas as pd
 import numpy as np
 import os
 
+from .columnar import columnar_path, write_columnar
+from .name_matching import NameMatcher
 
-def clean_csv1(file_path_regpie, file_path_shelters, delimiter=';'):
+
+def clean_csv1(file_path_regpie, file_path_shelters, delimiter=';',
+               chunksize=None):
     """
     Merge and clean data from two CSV files containing information about
     mountain shelters.
@@ -14,6 +18,8 @@ def clean_csv1(file_path_regpie, file_path_shelters, delimiter=';'):
                               shelter data.
     delimiter (str, optional): Delimiter used in the CSV files. Defaults
     to ';'.
+    chunksize (int, optional): Read the first file this many rows at a
+                               time; see clean_structures().
     Returns:
     pd.DataFrame: A pandas DataFrame containing merged and cleaned data from
                   both input CSV files.
@@ -26,67 +32,186 @@ def clean_csv1(file_path_regpie, file_path_shelters, delimiter=';'):
     # Construct the output file path in the same directory
     output_file = os.path.join(directory, 'merged_data.csv')
 
-    # Read the first CSV file
-    data = pd.read_csv(file_path_regpie, delimiter=delimiter)
+    # Clean the structures and match them to the scraped shelters
+    data = clean_structures(file_path_regpie, delimiter, chunksize)
+    shelters = read_shelters(file_path_shelters)
+    matcher = NameMatcher(shelters['Name'])
+
+    def best_shelter(denominazione):
+        position, _ = matcher.best_match(denominazione)
+        return None if position is None else shelters.index[position]
+
+    # Create a merge key from the best matching shelter
+    merge_key = data['DENOMINAZIONE'].apply(best_shelter)
+    merged_data = merge_structures(data, shelters, merge_key)
+
+    # Save the merged DataFrame to a CSV, and a typed columnar copy of it
+    # that the backend can load without parsing text
+    merged_data.to_csv(output_file, index=False)
+    write_columnar(merged_data, columnar_path(output_file),
+                   source=output_file)
+    # print(f"File '{output_file}' saved successfully.")
+
+    return merged_data
 
-    # Convert all column names in the first CSV to uppercase
-    data.columns = data.columns.str.upper()
 
-    # Define indexes of columns to drop and then drop them
-    drop_indexes = [0, 1, 4, 5, 8, 9, 40] + list(range(11, 39))
-    data.drop(data.columns[drop_indexes], axis=1, inplace=True)
+# Columns read from the regpie file, by name, and their names in the
+# merged data. Upper-case, since the file's capitalization has varied.
+# The bathrooms and beds counts have always been stored as LETTI and BAGNI
+# respectively; the mapping keeps the merged data as it was.
+REGPIE_COLUMNS = {
+    'DENOMINAZIONESTRUTTURA': 'DENOMINAZIONE',
+    'PROVINCIA': 'PROVINCIA',
+    'COMUNE': 'COMUNE',
+    'INDIRIZZO': 'INDIRIZZO',
+    'TELEFONO': 'TELEFONO',
+    'CAPACITRICETTIVACAMEREDALETTO': 'CAMERE',
+    'CAPACITRICETTIVABAGNI': 'LETTI',
+    'CAPACITRICETTIVAPOSTILETTO': 'BAGNI',
+}
+
+# Capacity columns, which may be empty and are therefore read as floats
+REGPIE_COUNT_COLUMNS = {
+    'CAPACITRICETTIVACAMEREDALETTO', 'CAPACITRICETTIVABAGNI',
+    'CAPACITRICETTIVAPOSTILETTO',
+}
+
+
+def check_regpie_schema(file_path_regpie, delimiter=';'):
+    """
+    Check that the regpie file has every column the merge needs.
 
-    # Keep only the first 8 columns of the data
-    data = data.iloc[:, :8]
+    Parameters:
+    file_path_regpie (str): File path of the regpie CSV file.
+    delimiter (str, optional): Delimiter used in the file. Defaults to ';'.
+
+    Returns:
+    dict: Name of each needed column in the file -> its explicit dtype.
+
+    Raises:
+    ValueError: If a needed column is missing, naming the missing columns,
+                so that a change upstream stops the merge instead of
+                silently shifting data into the wrong columns.
+    """
+    header = pd.read_csv(file_path_regpie, delimiter=delimiter, nrows=0)
+    found = {name.upper(): name for name in header.columns}
+    missing = sorted(set(REGPIE_COLUMNS) - set(found))
+    if missing:
+        message = (f"{file_path_regpie} is missing the columns "
+                   f"{', '.join(missing)}; the upstream format changed.")
+        print(message)
+        raise ValueError(message)
+    return {found[col]: 'float64' if col in REGPIE_COUNT_COLUMNS else str
+            for col in REGPIE_COLUMNS}
+
+
+def iter_structures(file_path_regpie, delimiter=';', chunksize=None):
+    """
+    Read and clean the regional list of structures, chunk by chunk.
+
+    Only the columns in REGPIE_COLUMNS are parsed, with explicit dtypes.
+    With a `chunksize`, at most that many raw rows are parsed at a time;
+    the memory held across chunks is the names already seen.
+
+    Parameters:
+    file_path_regpie (str): File path of the regpie CSV file.
+    delimiter (str, optional): Delimiter used in the file. Defaults to ';'.
+    chunksize (int, optional): Number of rows read at a time. The whole
+                               file is read at once when None.
+
+    Yields:
+    pd.DataFrame: Cleaned structures, in file order. A structure already
+                  seen in an earlier chunk is left out.
+    """
+    dtypes = check_regpie_schema(file_path_regpie, delimiter)
+    reader = pd.read_csv(file_path_regpie, delimiter=delimiter,
+                         usecols=list(dtypes), dtype=dtypes,
+                         chunksize=chunksize)
+    seen = set()
+    for data in [reader] if chunksize is None else reader:
+        # Name the columns as in the merged data, DENOMINAZIONE first
+        data.columns = [REGPIE_COLUMNS[name.upper()] for name in data.columns]
+        data = data[list(REGPIE_COLUMNS.values())]
+
+        # Remove rows where 'DENOMINAZIONE' is 'camposecco'
+        data = data[data['DENOMINAZIONE'].str.lower() != "camposecco"]
+
+        # Remove duplicate rows based on 'DENOMINAZIONE'
+        data = data.drop_duplicates(subset='DENOMINAZIONE', keep='first')
+        data = data[~data['DENOMINAZIONE'].isin(seen)].copy()
+        seen.update(data['DENOMINAZIONE'])
+
+        # Fill NaNs in 'CAMERE', 'LETTI', and 'BAGNI' with 0 and convert
+        # to int
+        int_cols = ['CAMERE', 'LETTI', 'BAGNI']
+        data[int_cols] = data[int_cols].fillna(0).astype(int)
+
+        # Replace other NaNs with '---' and fix phone number format
+        data = data.fillna('---')
+        data['TELEFONO'] = data['TELEFONO'].apply(
+            lambda x: '---' if len(str(x)) < 10 else x)
+        yield data
+
+
+def clean_structures(file_path_regpie, delimiter=';', chunksize=None):
+    """
+    Read and clean the regional list of structures.
 
-    # Move 'DENOMINAZIONESTRUTTURA' column to the first position
-    denom_col = data.pop('DENOMINAZIONESTRUTTURA')
-    data.insert(0, 'DENOMINAZIONE', denom_col)
+    The merge needs every structure at once, so the result always holds
+    all of the cleaned rows, in the REGPIE_COLUMNS columns only. What
+    `chunksize` bounds is the parsing: the raw text and the parser buffers
+    of at most `chunksize` rows at a time, instead of the whole file. The
+    cleaned chunks are then concatenated, which briefly needs twice the
+    size of the result.
 
-    # Remove rows where 'DENOMINAZIONE' is 'camposecco'
-    data = data[data['DENOMINAZIONE'].str.lower() != "camposecco"]
+    Parameters:
+    file_path_regpie (str): File path of the regpie CSV file.
+    delimiter (str, optional): Delimiter used in the file. Defaults to ';'.
+    chunksize (int, optional): Read the file this many rows at a time.
+                               The whole file is read at once when None.
 
-    # Remove duplicate rows based on 'DENOMINAZIONE'
-    data.drop_duplicates(subset='DENOMINAZIONE', keep='first', inplace=True)
+    Returns:
+    pd.DataFrame: One row per structure, with DENOMINAZIONE first and the
+                  CAMERE, LETTI and BAGNI counts as integers.
+    """
+    chunks = list(iter_structures(file_path_regpie, delimiter, chunksize))
+    return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
 
-    # Rename specific columns for clarity
-    new_col_names = {
-        data.columns[5]: 'CAMERE',
-        data.columns[6]: 'LETTI',
-        data.columns[7]: 'BAGNI'
-    }
-    data.rename(columns=new_col_names, inplace=True)
 
-    # Fill NaNs in 'CAMERE', 'LETTI', and 'BAGNI' with 0 and convert to int
-    int_cols = ['CAMERE', 'LETTI', 'BAGNI']
-    data[int_cols] = data[int_cols].fillna(0).astype(int)
+def read_shelters(file_path_shelters):
+    """
+    Read the scraped shelters, with numeric coordinates.
 
-    # Replace other NaNs with '---' and fix phone number format
-    data.fillna('---', inplace=True)
-    data['TELEFONO'] = data['TELEFONO'].apply(
-        lambda x: '---' if len(str(x)) < 10 else x)
+    Parameters:
+    file_path_shelters (str): File path of mountain_shelters.csv.
 
-    # Read the second CSV file
+    Returns:
+    pd.DataFrame: The shelters; unparseable coordinates become NaN.
+    """
     shelters = pd.read_csv(file_path_shelters)
 
     # Convert 'Latitude' and 'Longitude' in the shelters DataFrame to floats
     shelters['Latitude'] = pd.to_numeric(shelters['Latitude'], errors='coerce')
     shelters['Longitude'] = pd.to_numeric(
         shelters['Longitude'], errors='coerce')
+    return shelters
 
-    # Nested function to find a partial, case-insensitive match
-    def partial_match(denominazione, df_shelters):
-        """
-        Find partial, case-insensitive match for a name in shelters DataFrame.
-        """
-        for _, row in df_shelters.iterrows():
-            if denominazione.lower() in row['Name'].lower():
-                return row.name
-        return None
 
-    # Apply the partial_match function to create a merge key
-    data['merge_key'] = data['DENOMINAZIONE'].apply(
-        lambda x: partial_match(x, shelters))
+def merge_structures(data, shelters, merge_key):
+    """
+    Join the structures with the shelters they were matched to.
+
+    Parameters:
+    data (pd.DataFrame): The cleaned structures.
+    shelters (pd.DataFrame): The shelters.
+    merge_key (pd.Series): Index label in `shelters` of the shelter matched
+                           to each structure, or None.
+
+    Returns:
+    pd.DataFrame: The merged data, without the structures that have no
+                  coordinates.
+    """
+    data = data.assign(merge_key=merge_key)
 
     # Merge the two dataframes based on the merge key
     merged_data = pd.merge(data, shelters, left_on='merge_key',
@@ -103,10 +228,4 @@ def clean_csv1(file_path_regpie, file_path_shelters, delimiter=';'):
     merged_data.rename(columns={'Name': 'DENOMINAZIONE'}, inplace=True)
 
     # Drop rows where coordinates are NaN
-    merged_data = merged_data.dropna(subset=['Latitude', 'Longitude'])
-
-    # Save the merged DataFrame to a CSV
-    merged_data.to_csv(output_file, index=False)
-    # print(f"File '{output_file}' saved successfully.")
-
-    return merged_data
+    return merged_data.dropna(subset=['Latitude', 'Longitude'])
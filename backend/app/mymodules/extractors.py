@@ -0,0 +1,155 @@
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    from .regions import match_region
+except ImportError:  # Run as a script: python app/mymodules/scrape.py
+    from regions import match_region
+
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = 'lxml'
+except ImportError:  # pragma: no cover - fall back to the standard library
+    DEFAULT_PARSER = 'html.parser'
+
+
+def _default_details():
+    return {
+        'Name': 'Name not found',
+        'Description': 'Description not found',
+        'Region': 'Region not found',
+        'Latitude': 'Coords not found',
+        'Longitude': 'Coords not found',
+    }
+
+
+def _read_coords(td, details):
+    coords = td.get_text(separator="|").split('|')
+    if len(coords) >= 2:
+        lat, long = coords[0].split(':'), coords[1].split(':')
+        details['Latitude'] = lat[1].strip()
+        details['Longitude'] = long[1].strip()
+
+
+def extract_details_soup(content):
+    """
+    Extracts the details of a shelter by parsing its whole page.
+
+    This is the original extractor: a full html.parser tree, searched
+    once per field.
+
+    Parameters:
+    content (bytes): The HTML of the shelter page.
+
+    Returns:
+    dict: Name, description, region and coordinates of the shelter.
+    """
+    details = _default_details()
+    soup = BeautifulSoup(content, 'html.parser')
+
+    # Extract shelter name
+    name_tag = soup.find('h3', style="margin-top: 25px")
+    if name_tag:
+        details['Name'] = name_tag.text.strip()
+
+    # Extract shelter description
+    description_tag = soup.find('div', class_='descrizione-lunga')
+    if description_tag:
+        details['Description'] = description_tag.text.strip()
+
+    # Extract region information
+    for td in soup.find_all('td'):
+        region = match_region(td.text)
+        if region is not None:
+            details['Region'] = region
+            break
+
+    # Extract coordinates
+    for td in soup.find_all('td'):
+        if 'Lat:' in td.text and 'Long:' in td.text:
+            _read_coords(td, details)
+            break
+
+    return details
+
+
+def _is_detail_tag(name, attrs):
+    """Tells the parser which tags hold shelter details."""
+    if name == 'td':
+        return True
+    if name == 'h3':
+        return attrs.get('style') == 'margin-top: 25px'
+    if name == 'div':
+        classes = attrs.get('class') or []
+        if isinstance(classes, str):
+            classes = classes.split()
+        return 'descrizione-lunga' in classes
+    return False
+
+
+# Only the name heading, the description and the table cells are parsed
+DETAIL_TAGS = SoupStrainer(_is_detail_tag)
+
+
+def extract_details_fast(content, parser=None):
+    """
+    Extracts the details of a shelter by parsing only the relevant tags.
+
+    A SoupStrainer keeps the tree down to the name heading, the description
+    and the table cells, using the lxml parser when it is installed. The
+    fields are then collected in a single pass over that small tree.
+
+    Parameters:
+    content (bytes): The HTML of the shelter page.
+    parser (str, optional): BeautifulSoup parser to use. Defaults to lxml,
+                            or html.parser when lxml is not installed.
+
+    Returns:
+    dict: Name, description, region and coordinates of the shelter, the
+          same as extract_details_soup() returns.
+    """
+    details = _default_details()
+    soup = BeautifulSoup(content, parser or DEFAULT_PARSER,
+                         parse_only=DETAIL_TAGS)
+    found_name = found_description = found_region = found_coords = False
+
+    for tag in soup.find_all(['h3', 'div', 'td']):
+        if tag.name == 'td':
+            text = tag.text
+            if not found_region:
+                region = match_region(text)
+                if region is not None:
+                    details['Region'] = region
+                    found_region = True
+            if not found_coords and 'Lat:' in text and 'Long:' in text:
+                _read_coords(tag, details)
+                found_coords = True
+        elif tag.name == 'h3':
+            if not found_name and _is_detail_tag('h3', tag.attrs):
+                details['Name'] = tag.text.strip()
+                found_name = True
+        elif not found_description and _is_detail_tag('div', tag.attrs):
+            details['Description'] = tag.text.strip()
+            found_description = True
+
+    return details
+
+
+# Extraction backends, selectable by name
+EXTRACTORS = {
+    'soup': extract_details_soup,
+    'fast': extract_details_fast,
+}
+DEFAULT_EXTRACTOR = 'fast'
+
+
+def get_extractor(name=None):
+    """
+    Returns the extraction function registered under `name`.
+
+    Parameters:
+    name (str, optional): 'soup' or 'fast'. Defaults to DEFAULT_EXTRACTOR.
+
+    Returns:
+    callable: Function taking the page HTML and returning its details.
+    """
+    return EXTRACTORS[name or DEFAULT_EXTRACTOR]
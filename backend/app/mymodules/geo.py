@@ -0,0 +1,24 @@
+import numpy as np
+
+# Mean Earth radius in km, the same value used by the haversine package
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """
+    Great-circle distance in km from one point to many points at once.
+
+    Parameters:
+    lat (float): Latitude of the origin, in degrees.
+    lng (float): Longitude of the origin, in degrees.
+    lats (np.ndarray): Latitudes of the destinations, in degrees.
+    lngs (np.ndarray): Longitudes of the destinations, in degrees.
+
+    Returns:
+    np.ndarray: Distances in km, one per destination.
+    """
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
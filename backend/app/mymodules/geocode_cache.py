@@ -0,0 +1,139 @@
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_address(address):
+    """
+    Build the cache key of an address.
+
+    Case, Unicode form, surrounding punctuation and repeated whitespace are
+    ignored, so that "Torino", " torino " and "TORINO," share one entry.
+
+    Parameters:
+    address (str): The address typed by the user.
+
+    Returns:
+    str: The normalized key.
+    """
+    key = unicodedata.normalize('NFKC', address).casefold()
+    key = re.sub(r'\s+', ' ', key)
+    return key.strip(' ,.;')
+
+
+class GeocodeCache:
+    """
+    Two-tier cache of geocoding results.
+
+    The first tier is an in-process LRU dictionary with a time-to-live on
+    each entry. The optional second tier is a SQLite table that survives
+    restarts. Addresses that could not be geocoded are cached too, as
+    negative entries with a shorter time-to-live.
+    """
+
+    def __init__(self, max_size=1024, ttl=7 * 24 * 3600, negative_ttl=300,
+                 db_path=None, clock=time.time):
+        """
+        Parameters:
+        max_size (int, optional): Maximum number of in-memory entries.
+        ttl (float, optional): Lifetime in seconds of a found address.
+        negative_ttl (float, optional): Lifetime in seconds of an address
+                                        that could not be geocoded.
+        db_path (str, optional): Path of the SQLite file for the persistent
+                                 tier. No persistent tier when None.
+        clock (callable, optional): Returns the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "key TEXT PRIMARY KEY, lat REAL, lng REAL, "
+                "expires_at REAL NOT NULL)")
+            self._db.commit()
+
+    @property
+    def persistent(self):
+        """True when the SQLite tier is enabled."""
+        return self._db is not None
+
+    def get(self, address):
+        """
+        Look up an address.
+
+        Parameters:
+        address (str): The address to look up.
+
+        Returns:
+        tuple: (hit, coords). `hit` is False when the address is not cached.
+               `coords` is a (lat, lng) tuple, or None for a cached failure.
+        """
+        key = normalize_address(address)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, coords = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    return True, coords
+                del self._entries[key]
+
+            if self._db is None:
+                return False, None
+            row = self._db.execute(
+                "SELECT lat, lng, expires_at FROM geocode WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return False, None
+            lat, lng, expires_at = row
+            if expires_at <= now:
+                self._db.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                self._db.commit()
+                return False, None
+            coords = None if lat is None else (lat, lng)
+            self._remember(key, expires_at, coords)
+            return True, coords
+
+    def set(self, address, coords):
+        """
+        Store the result of geocoding an address.
+
+        Parameters:
+        address (str): The address that was geocoded.
+        coords (tuple or None): (lat, lng), or None if it was not found.
+        """
+        key = normalize_address(address)
+        ttl = self.ttl if coords is not None else self.negative_ttl
+        expires_at = self.clock() + ttl
+        with self._lock:
+            self._remember(key, expires_at, coords)
+            if self._db is not None:
+                lat, lng = coords if coords is not None else (None, None)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)",
+                    (key, lat, lng, expires_at))
+                self._db.commit()
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM geocode")
+                self._db.commit()
+
+    def _remember(self, key, expires_at, coords):
+        self._entries[key] = (expires_at, coords)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
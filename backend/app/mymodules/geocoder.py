@@ -0,0 +1,185 @@
+import asyncio
+
+import httpx
+
+from .geocode_cache import normalize_address
+from .metrics import MetricsRegistry
+
+# Status of the Geocoding API for an address that has no location; the
+# other non-OK statuses (quota, key, server errors) are transient
+NO_RESULT_STATUS = 'ZERO_RESULTS'
+
+
+class GeocodingError(Exception):
+    """The Geocoding API could not answer, e.g. over quota or malformed."""
+
+
+class AsyncGeocoder:
+    """
+    Non-blocking client for Google's Geocoding API.
+
+    All lookups share one pooled httpx.AsyncClient with keep-alive
+    connections and strict timeouts. The number of concurrent calls to the
+    API is bounded by a semaphore, and concurrent lookups of the same
+    address share a single in-flight call. Results go through a
+    GeocodeCache before any call is made.
+
+    Cache hits and misses, API calls by outcome and API call latency are
+    counted in a MetricsRegistry.
+    """
+
+    def __init__(self, api_url, api_key, cache=None, timeout=5.0,
+                 max_concurrency=10, max_connections=20, transport=None,
+                 metrics=None):
+        """
+        Parameters:
+        api_url (str): URL of the Geocoding API endpoint.
+        api_key (str): Google API key.
+        cache (GeocodeCache, optional): Cache consulted before the API.
+        timeout (float, optional): Timeout in seconds of each API call.
+        max_concurrency (int, optional): Maximum number of API calls in
+                                         flight at the same time.
+        max_connections (int, optional): Size of the connection pool.
+        transport (httpx.AsyncBaseTransport, optional): Transport to use
+                                                        instead of the
+                                                        network, e.g. a stub.
+        metrics (MetricsRegistry, optional): Registry of the counters.
+        """
+        self.api_url = api_url
+        self.api_key = api_key
+        self.cache = cache
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.transport = transport
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._inflight = {}
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self.cache_hits = metrics.counter(
+            'geocode_cache_hits_total',
+            'Geocoding lookups answered by the cache.')
+        self.cache_misses = metrics.counter(
+            'geocode_cache_misses_total',
+            'Geocoding lookups not found in the cache.')
+        self.api_calls = metrics.counter(
+            'geocode_api_calls_total', 'Calls to the Geocoding API.',
+            labelnames=('outcome',))
+        self.api_latency = metrics.histogram(
+            'geocode_api_call_seconds',
+            'Duration of the calls to the Geocoding API.')
+
+    def _ensure_client(self):
+        """Create the client, bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections),
+            transport=self.transport)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._inflight = {}
+
+    async def geocode(self, address):
+        """
+        Call the Geocoding API for an address, without using the cache.
+
+        Returns:
+        tuple or None: (lat, lng), or None if the API found no result.
+        Raises:
+        httpx.HTTPError: If the API can't be reached.
+        GeocodingError: If the API returned an error status, such as
+                        OVER_QUERY_LIMIT or REQUEST_DENIED, or a malformed
+                        reply.
+        """
+        self._ensure_client()
+        params = {"address": address, "key": self.api_key}
+        try:
+            async with self._semaphore:
+                with self.api_latency.time():
+                    response = await self._client.get(
+                        self.api_url, params=params)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            self.api_calls.inc(outcome='error')
+            raise
+        try:
+            data = response.json()
+            status = data['status']
+            if status == NO_RESULT_STATUS:
+                self.api_calls.inc(outcome='no_result')
+                return None
+            if status != 'OK':
+                raise GeocodingError(f"Geocoding API status {status}")
+            location = data['results'][0]['geometry']['location']
+            coords = float(location['lat']), float(location['lng'])
+        except GeocodingError:
+            self.api_calls.inc(outcome='error')
+            raise
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self.api_calls.inc(outcome='error')
+            raise GeocodingError(
+                f"Malformed Geocoding API response: {e!r}") from e
+        self.api_calls.inc(outcome='ok')
+        return coords
+
+    async def _lookup(self, address):
+        coords = await self.geocode(address)
+        if self.cache is not None:
+            await self._run_cache(self.cache.set, address, coords)
+        return coords
+
+    async def _run_cache(self, func, *args):
+        # The persistent tier touches disk, keep it off the event loop
+        if self.cache.persistent:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, func, *args)
+        return func(*args)
+
+    async def get_coordinates(self, address):
+        """
+        Convert an address to geographic coordinates.
+
+        Cached results are returned without calling the API, and concurrent
+        lookups of the same address wait for the same call.
+
+        Returns:
+        tuple: (lat, lng), or (None, None) if the address can't be geocoded.
+        """
+        if self.cache is not None:
+            hit, coords = await self._run_cache(self.cache.get, address)
+            if hit:
+                self.cache_hits.inc()
+                return coords if coords is not None else (None, None)
+            self.cache_misses.inc()
+
+        self._ensure_client()
+        key = normalize_address(address)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(address))
+            self._inflight[key] = task
+            task.add_done_callback(
+                lambda _: self._inflight.pop(key, None))
+        try:
+            coords = await asyncio.shield(task)
+        except (httpx.HTTPError, GeocodingError) as e:
+            # Connection and API errors are transient, so they are not
+            # cached; only addresses without a result are
+            print(f"Error in Geocoding API response: {e}")
+            return None, None
+        if coords is None:
+            return None, None
+        return coords
+
+    async def aclose(self):
+        """Close the pooled client."""
+        if self._client is not None:
+            await self._client.aclose()
+        self._loop = None
+        self._client = None
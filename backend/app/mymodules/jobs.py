@@ -0,0 +1,172 @@
+import itertools
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class Job:
+    """
+    State of one run of a background job.
+
+    Attributes:
+    id (int): Sequential number of the run.
+    name (str): Name of the job.
+    reason (str): Why the run was started, e.g. 'admin' or 'scheduled'.
+    status (str): 'running', 'succeeded' or 'failed'.
+    started_at (float): Unix time the run started.
+    finished_at (float): Unix time the run ended, or None while running.
+    done (int): Units of work done so far.
+    total (int): Units of work in the run, or None if not known yet.
+    message (str): Last progress message.
+    error (str): Error message of a failed run.
+    """
+    id: int
+    name: str
+    reason: str
+    status: str = 'running'
+    started_at: float = None
+    finished_at: float = None
+    done: int = 0
+    total: int = None
+    message: str = None
+    error: str = None
+
+    def to_dict(self):
+        """Return the job state as a JSON-serializable dictionary."""
+        return asdict(self)
+
+
+class JobRunner:
+    """
+    Runs a job in a background thread, at most one run at a time.
+
+    Triggering the job while it runs does not start a second run: the
+    caller gets the run in progress instead. The function of the job is
+    called with a progress callback, progress(done, total, message=None),
+    that updates the state reported by current() and history().
+    """
+
+    def __init__(self, name, target, history_size=20, clock=time.time):
+        """
+        Parameters:
+        name (str): Name of the job.
+        target (callable): Function doing the work, called with the progress
+                           callback. A run fails if it raises.
+        history_size (int, optional): Number of finished runs remembered.
+        clock (callable, optional): Returns the current Unix time.
+        """
+        self.name = name
+        self.target = target
+        self.clock = clock
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._current = None
+        self._thread = None
+        self._history = deque(maxlen=history_size)
+        self._stop = threading.Event()
+        self._scheduler = None
+
+    def trigger(self, reason='manual'):
+        """
+        Start a run unless one is already in progress.
+
+        Parameters:
+        reason (str, optional): Why the run is started, kept in its state.
+
+        Returns:
+        tuple: (job, started), where job is the new run or the one already
+               in progress, and started tells which.
+        """
+        with self._lock:
+            if self._current is not None:
+                return self._current, False
+            job = Job(id=next(self._ids), name=self.name, reason=reason,
+                      started_at=self.clock())
+            self._current = job
+            self._thread = threading.Thread(
+                target=self._run, args=(job,), name=f'job-{self.name}',
+                daemon=True)
+            self._thread.start()
+            return job, True
+
+    def _run(self, job):
+        def progress(done, total=None, message=None):
+            job.done = done
+            if total is not None:
+                job.total = total
+            if message is not None:
+                job.message = message
+
+        try:
+            self.target(progress)
+            job.status = 'succeeded'
+        except Exception as e:
+            print(f"Job {self.name} #{job.id} failed: {e}")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = self.clock()
+            with self._lock:
+                self._history.appendleft(job)
+                self._current = None
+
+    def current(self):
+        """Return the run in progress, or None."""
+        return self._current
+
+    def history(self):
+        """Return the finished runs, most recent first."""
+        with self._lock:
+            return list(self._history)
+
+    def get(self, job_id):
+        """Return the run with the given id, or None if it is forgotten."""
+        current = self._current
+        if current is not None and current.id == job_id:
+            return current
+        return next((job for job in self.history() if job.id == job_id),
+                    None)
+
+    def last_success(self):
+        """Return the most recent successful run, or None."""
+        return next((job for job in self.history()
+                     if job.status == 'succeeded'), None)
+
+    def wait(self, timeout=None):
+        """Wait for the run in progress, if any, to finish."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def start_schedule(self, interval, first_delay=None):
+        """
+        Trigger the job every `interval` seconds in a background thread.
+
+        Parameters:
+        interval (float): Seconds between two scheduled runs.
+        first_delay (float, optional): Seconds before the first scheduled
+                                       run. Defaults to `interval`.
+        """
+        if self._scheduler is not None:
+            return
+        self._stop.clear()
+        delay = interval if first_delay is None else first_delay
+
+        def schedule():
+            wait = delay
+            while not self._stop.wait(wait):
+                self.trigger('scheduled')
+                wait = interval
+
+        self._scheduler = threading.Thread(
+            target=schedule, name=f'schedule-{self.name}', daemon=True)
+        self._scheduler.start()
+
+    def stop_schedule(self):
+        """Stop the thread started by start_schedule()."""
+        self._stop.set()
+        if self._scheduler is not None:
+            self._scheduler.join()
+            self._scheduler = None
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import threading
+
+from .columnar import columnar_path, write_columnar
+from .csv_cleaning import clean_structures, merge_structures, read_shelters
+from .name_matching import NameMatcher
+
+
+def file_fingerprint(path, previous=None):
+    """
+    Fingerprint a file by size, modification time and content hash.
+
+    The file is only hashed again when its size or mtime changed since
+    `previous`, so an unchanged input costs a single stat() call.
+
+    Parameters:
+    path (str): The file to fingerprint.
+    previous (dict, optional): An earlier fingerprint of the same file.
+
+    Returns:
+    dict: The size, mtime_ns and sha256 of the file, or None if it does
+          not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if (previous and previous['size'] == stat.st_size
+            and previous['mtime_ns'] == stat.st_mtime_ns):
+        return previous
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest.hexdigest()}
+
+
+def _row_digests(frame, key):
+    """Map each value of the `key` column to a hash of its first row."""
+    frame = frame.drop_duplicates(subset=key, keep='first')
+    digests = {}
+    for row in frame.itertuples(index=False):
+        digests[getattr(row, key)] = hashlib.sha1(
+            '\x1f'.join(map(str, row)).encode()).hexdigest()
+    return digests
+
+
+class MergeBuilder:
+    """
+    Keeps merged_data.csv up to date with its two input files.
+
+    The fingerprints of the inputs, and the shelter matched to each
+    structure, are saved in a manifest next to the output. A rebuild only
+    matches again the structures that are new or changed, that lost their
+    shelter, or that one of the new shelters matches better; the other
+    matches are reused. The cleaned structures are kept in memory while
+    the regpie file is unchanged, so a new scrape does not clean it again.
+
+    The incremental part is the name matching, the costly step. The join
+    itself is redone, and the output is written whole, aside, then moved
+    over the old one, so readers always see a complete dataset. Builds run
+    in a background thread (see start()), not on the request path.
+    """
+
+    def __init__(self, regpie_path, shelters_path, output_path,
+                 manifest_path=None, delimiter=';', on_build=None,
+                 chunksize=None):
+        """
+        Parameters:
+        regpie_path (str): Path to the regional list of structures.
+        shelters_path (str): Path to mountain_shelters.csv.
+        output_path (str): Path of the merged data CSV file.
+        manifest_path (str, optional): Path of the manifest. Defaults to
+                                       the output path with a
+                                       .manifest.json extension.
+        delimiter (str, optional): Delimiter of the regpie file.
+        on_build (callable, optional): Called with the output path after
+                                       every rebuild, e.g. to reload it.
+        chunksize (int, optional): Read the regpie file this many rows at
+                                   a time; see clean_structures().
+        """
+        self.regpie_path = regpie_path
+        self.shelters_path = shelters_path
+        self.output_path = output_path
+        self.manifest_path = manifest_path or \
+            os.path.splitext(output_path)[0] + '.manifest.json'
+        self.delimiter = delimiter
+        self.on_build = on_build
+        self.chunksize = chunksize
+        self._cleaned = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_atomically(self, path, write):
+        tmp_path = f'{path}.tmp'
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _fingerprints(self, manifest):
+        previous = manifest.get('inputs', {})
+        return {
+            'regpie': file_fingerprint(self.regpie_path,
+                                       previous.get('regpie')),
+            'shelters': file_fingerprint(self.shelters_path,
+                                         previous.get('shelters')),
+        }
+
+    def _clean_structures(self, fingerprint):
+        # Reuse the cleaned rows while the regpie file is unchanged
+        if self._cleaned is None or self._cleaned[0] != fingerprint['sha256']:
+            data = clean_structures(self.regpie_path, self.delimiter,
+                                    self.chunksize)
+            self._cleaned = (fingerprint['sha256'], data,
+                             _row_digests(data, 'DENOMINAZIONE'))
+        return self._cleaned[1], self._cleaned[2]
+
+    def is_stale(self):
+        """
+        Tell whether the output is missing or older than its inputs.
+
+        Returns:
+        bool: True if rebuild() would have work to do.
+        """
+        manifest = self._read_manifest()
+        return (not os.path.exists(self.output_path)
+                or self._fingerprints(manifest) != manifest.get('inputs'))
+
+    def rebuild(self, force=False, notify=True):
+        """
+        Rebuild the merged data if an input changed.
+
+        Parameters:
+        force (bool, optional): Rebuild even if the inputs did not change.
+        notify (bool, optional): Whether to call on_build afterwards.
+
+        Returns:
+        int: Number of structures matched again, or None if the output was
+             already up to date.
+        """
+        with self._lock:
+            manifest = self._read_manifest()
+            inputs = self._fingerprints(manifest)
+            if (not force and os.path.exists(self.output_path)
+                    and inputs == manifest.get('inputs')):
+                return None
+
+            data, structure_digests = self._clean_structures(inputs['regpie'])
+            shelters = read_shelters(self.shelters_path)
+            shelter_digests = _row_digests(shelters, 'Name')
+
+            old_structures = manifest.get('structures', {})
+            old_shelters = manifest.get('shelters', {})
+            old_matches = manifest.get('matches', {})
+            added = [name for name in shelter_digests
+                     if name not in old_shelters]
+
+            # Only the first shelter of each name can be matched
+            first_label = {}
+            for label, name in zip(shelters.index, shelters['Name']):
+                first_label.setdefault(name, label)
+            names = list(shelters['Name'])
+            matcher = added_matcher = None
+
+            matches, rematched = {}, 0
+            for structure, digest in structure_digests.items():
+                previous = old_matches.get(structure)
+                reusable = (old_structures.get(structure) == digest
+                            and previous is not None
+                            and (previous[0] is None
+                                 or previous[0] in shelter_digests))
+                if not reusable:
+                    if matcher is None:
+                        matcher = NameMatcher(names)
+                    position, score = matcher.best_match(structure)
+                    name = None if position is None else names[position]
+                    matches[structure] = [name, score]
+                    rematched += 1
+                    continue
+                matches[structure] = previous
+                if added:
+                    # A new shelter may match this structure better
+                    if added_matcher is None:
+                        added_matcher = NameMatcher(added)
+                    position, score = added_matcher.best_match(structure)
+                    if position is not None and score > previous[1]:
+                        matches[structure] = [added[position], score]
+                        rematched += 1
+
+            merge_key = data['DENOMINAZIONE'].map(
+                lambda structure: first_label.get(matches[structure][0]))
+            merged_data = merge_structures(data, shelters, merge_key)
+            self._write_atomically(
+                self.output_path,
+                lambda path: merged_data.to_csv(path, index=False))
+            write_columnar(merged_data, columnar_path(self.output_path),
+                           source=self.output_path)
+
+            manifest = {'inputs': inputs, 'structures': structure_digests,
+                        'shelters': shelter_digests, 'matches': matches}
+
+            def write_manifest(path):
+                with open(path, 'w') as file:
+                    json.dump(manifest, file)
+            self._write_atomically(self.manifest_path, write_manifest)
+
+        print(f"Rebuilt {self.output_path}: "
+              f"{rematched} of {len(matches)} structures matched again.")
+        if notify and self.on_build is not None:
+            self.on_build(self.output_path)
+        return rematched
+
+    def start(self, interval=60.0):
+        """
+        Check the inputs every `interval` seconds in a background thread,
+        rebuilding the output when they change. The first check runs
+        immediately.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name='merge-builder',
+            daemon=True)
+        self._thread.start()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"Could not rebuild {self.output_path}: {e}")
+            self._stop.wait(interval)
+
+    def stop(self):
+        """Stop the background thread started by start()."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,285 @@
+import contextvars
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds of the default latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the result count buckets
+SIZE_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Upper bounds of the response size buckets, in bytes
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Spans of the request being served, as (stage, seconds) pairs
+_spans = contextvars.ContextVar('spans', default=None)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        """
+        Parameters:
+        name (str): Name of the metric, e.g. 'geocode_cache_hits_total'.
+        help_text (str): Description shown in the exposition.
+        labelnames (tuple, optional): Names of the labels of each value.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        """Add `amount` to the value with the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Return the value with the given labels."""
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Yield the lines of the metric in the exposition format."""
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        for key, value in values:
+            yield (f'{self.name}{_format_labels(self.labelnames, key)} '
+                   f'{_format_number(value)}')
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS,
+                 labelnames=()):
+        """
+        Parameters:
+        name (str): Name of the metric, e.g. 'stage_seconds'.
+        help_text (str): Description shown in the exposition.
+        buckets (tuple, optional): Increasing upper bounds of the buckets.
+        labelnames (tuple, optional): Names of the labels of each value.
+        """
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record one value with the given labels."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][bucket] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        """Return the number of values observed with the given labels."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        state = self._values.get(key)
+        return state[2] if state else 0
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in a `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        """Yield the lines of the metric in the exposition format."""
+        with self._lock:
+            values = sorted((key, ([*state[0]], state[1], state[2]))
+                            for key, state in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key,
+                                        [('le', _format_number(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_number(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, rendered in the Prometheus text format.
+
+    Asking twice for a metric with the same name returns the same object,
+    so modules can declare the metrics they update independently.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        """Return the Counter called `name`, creating it if needed."""
+        return self._get(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS,
+                  labelnames=()):
+        """Return the Histogram called `name`, creating it if needed."""
+        return self._get(Histogram, name, help_text, buckets, labelnames)
+
+    def render(self):
+        """
+        Render every metric.
+
+        Returns:
+        str: The metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            help_text = metric.help_text.replace('\\', '\\\\').replace(
+                '\n', '\\n')
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def span(histogram, stage):
+    """
+    Time one stage of a request, e.g. 'geocode'.
+
+    The duration is observed in `histogram`, labelled by stage, and kept
+    with the spans of the current request for its Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, stage=stage)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency and size of every response.
+
+    Requests are labelled by the path of the route that served them, like
+    '/admin/jobs/{job_id}', so that the number of series stays bounded.
+    The spans recorded while serving a request are sent back in its
+    Server-Timing header, and a profiler may sample the requests.
+    """
+
+    def __init__(self, app, registry, profiler=None):
+        """
+        Parameters:
+        app: The ASGI application.
+        registry (MetricsRegistry): Registry of the metrics.
+        profiler (SamplingProfiler, optional): Profiler of some requests.
+        """
+        self.app = app
+        self.profiler = profiler
+        self.latency = registry.histogram(
+            'http_request_duration_seconds',
+            'Time spent serving HTTP requests.',
+            labelnames=('method', 'path', 'status'))
+        self.sizes = registry.histogram(
+            'http_response_bytes', 'Size of the HTTP response bodies.',
+            buckets=BYTES_BUCKETS, labelnames=('method', 'path'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        spans = []
+        token = _spans.set(spans)
+        status = [500]
+        size = [0]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                if spans:
+                    timing = ', '.join(f'{stage};dur={seconds * 1000:.3f}'
+                                       for stage, seconds in spans)
+                    message = dict(message, headers=list(
+                        message.get('headers', []))
+                        + [(b'server-timing', timing.encode('latin-1'))])
+            elif message['type'] == 'http.response.body':
+                size[0] += len(message.get('body', b''))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                with self.profiler.sample(scope.get('path', '')):
+                    await self.app(scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _spans.reset(token)
+            route = scope.get('route')
+            path = getattr(route, 'path', None) or 'unmatched'
+            self.latency.observe(elapsed, method=scope['method'], path=path,
+                                 status=status[0])
+            self.sizes.observe(size[0], method=scope['method'], path=path)
@@ -0,0 +1,119 @@
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+# Kinds of shelter that prefix the names, e.g. "Bivacco - Longa [2036m]"
+SHELTER_KINDS = {
+    'rifugio', 'rifugio non custodito', 'bivacco', 'capanna',
+    'baita ricovero alpino', 'albergo rifugio', 'punto tappa',
+    'ricovero', 'casera', 'malga',
+}
+
+_ALTITUDE = re.compile(r'\[\s*\d+\s*m?\s*\]')
+_NOT_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def fold_text(text):
+    """Lowercase, strip accents and turn punctuation into spaces."""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NOT_WORD.sub(' ', text.lower()).strip()
+
+
+def normalize_name(name):
+    """
+    Normalize a shelter name for matching.
+
+    Accents, case and punctuation are ignored, the altitude suffix (like
+    "[1630m]") is dropped, and so is a leading kind of shelter (like
+    "Rifugio - " or "Bivacco - ").
+
+    Parameters:
+    name (str): The shelter name.
+
+    Returns:
+    str: The normalized name, words separated by single spaces.
+    """
+    name = _ALTITUDE.sub(' ', str(name))
+    parts = [part for part in re.split(r'\s+-\s+', name) if part.strip()]
+    if len(parts) > 1 and fold_text(parts[0]) in SHELTER_KINDS:
+        parts = parts[1:]
+    return fold_text(' '.join(parts))
+
+
+def trigrams(key):
+    """Character trigrams of each word of `key`, padded with spaces."""
+    grams = set()
+    for word in key.split():
+        padded = f' {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NameMatcher:
+    """
+    Finds the best matching shelter name through a trigram inverted index.
+
+    The names to search are normalized and indexed once. Each query only
+    scores the names sharing at least half of its trigrams: an exact
+    normalized match scores highest, then a name containing the query as
+    whole words, then as a plain substring, then names that are merely
+    similar (Dice coefficient of the trigram sets).
+    """
+
+    def __init__(self, names, min_similarity=0.75):
+        """
+        Parameters:
+        names (iterable): The shelter names to search.
+        min_similarity (float, optional): Minimum Dice coefficient for a
+                                          name that does not contain the
+                                          query to count as a match.
+        """
+        self.keys = [normalize_name(name) for name in names]
+        self.grams = [trigrams(key) for key in self.keys]
+        self.min_similarity = min_similarity
+        self.index = defaultdict(list)
+        for position, grams in enumerate(self.grams):
+            for gram in grams:
+                self.index[gram].append(position)
+
+    def _score(self, query, query_grams, position):
+        key = self.keys[position]
+        if query == key:
+            return 4.0
+        coverage = len(query) / len(key)
+        if f' {query} ' in f' {key} ':
+            return 3.0 + coverage
+        if query in key:
+            return 2.0 + coverage
+        grams = self.grams[position]
+        dice = 2 * len(query_grams & grams) / (len(query_grams) + len(grams))
+        return dice if dice >= self.min_similarity else 0.0
+
+    def best_match(self, name):
+        """
+        Find the indexed name that best matches `name`.
+
+        Parameters:
+        name (str): The name to look up.
+
+        Returns:
+        tuple: (position, score) of the best match, the earliest one on
+               ties, or (None, 0.0) if nothing matches.
+        """
+        query = normalize_name(name)
+        query_grams = trigrams(query)
+        if not query_grams:
+            return None, 0.0
+
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self.index.get(gram, ()))
+        needed = max(1, len(query_grams) // 2)
+
+        best, best_score = None, 0.0
+        for position in sorted(p for p, n in shared.items() if n >= needed):
+            score = self._score(query, query_grams, position)
+            if score > best_score:
+                best, best_score = position, score
+        return best, best_score
@@ -0,0 +1,139 @@
+import cProfile
+import itertools
+import os
+import pstats
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Deepest stack written to the collapsed output
+MAX_STACK_DEPTH = 64
+
+# Stacks taking less than this many seconds are left out
+MIN_STACK_SECONDS = 1e-6
+
+
+def _frame_name(func):
+    filename, line, name = func
+    if filename == '~':  # Built-in function
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def collapse_stats(stats):
+    """
+    Turn cProfile statistics into collapsed stacks.
+
+    cProfile only records which function called which, so the time of a
+    function is split among its callers in proportion to the time each of
+    them spent calling it. The result can be fed to flamegraph.pl or
+    speedscope.
+
+    Parameters:
+    stats (pstats.Stats): The profile.
+
+    Returns:
+    dict: 'caller;...;callee' -> microseconds spent in the callee itself.
+    """
+    raw = stats.stats
+    children = defaultdict(list)
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            children[caller].append((func, edge[3]))
+    roots = [func for func, entry in raw.items() if not entry[4]]
+
+    stacks = defaultdict(float)
+
+    def walk(func, path, seconds):
+        _, _, own, cumulative, _ = raw[func]
+        scale = seconds / cumulative if cumulative else 0.0
+        path = path + (func,)
+        stacks[';'.join(_frame_name(frame).replace(';', ',')
+                        for frame in path)] += own * scale
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for child, child_seconds in children[func]:
+            share = child_seconds * scale
+            # Recursive calls are already counted in the caller
+            if child not in path and share >= MIN_STACK_SECONDS:
+                walk(child, path, share)
+
+    for root in roots:
+        walk(root, (), raw[root][3])
+    return {stack: round(seconds * 1e6) for stack, seconds in stacks.items()
+            if round(seconds * 1e6) > 0}
+
+
+class SamplingProfiler:
+    """
+    Profiles one request in every `every` with cProfile.
+
+    Each sampled request leaves two files in `output_dir`: a .prof file
+    for pstats or snakeviz, and a .folded file of collapsed stacks for
+    flame graphs. Only one request is profiled at a time. The profiler
+    sees the thread serving the request, so in an async server it also
+    sees the other requests running on the event loop meanwhile, and not
+    the work sent to the thread pool.
+    """
+
+    def __init__(self, every, output_dir='profiles'):
+        """
+        Parameters:
+        every (int): Profile one request in this many; 0 disables sampling.
+        output_dir (str, optional): Directory of the profile files.
+        """
+        self.every = every
+        self.output_dir = output_dir
+        self._requests = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def sample(self, label=''):
+        """
+        Profile the `with` block if it is the request to sample.
+
+        Parameters:
+        label (str, optional): Added to the file names, e.g. the path.
+        """
+        number = next(self._requests)
+        if self.every <= 0 or number % self.every:
+            yield
+            return
+        if not self._lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # Another profiler is already running
+                profile = None
+            try:
+                yield
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    self.dump(profile, f'{number}-{label}')
+        finally:
+            self._lock.release()
+
+    def dump(self, profile, label=''):
+        """
+        Write the .prof and .folded files of a profile.
+
+        Returns:
+        str: Path of the files, without their extension.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = re.sub(r'[^0-9A-Za-z]+', '_', label).strip('_') or 'request'
+        base = os.path.join(self.output_dir,
+                            f'{time.strftime("%Y%m%d-%H%M%S")}-{name}')
+        stats = pstats.Stats(profile)
+        stats.dump_stats(base + '.prof')
+        with open(base + '.folded', 'w') as file:
+            for stack, micros in sorted(collapse_stats(stats).items()):
+                file.write(f'{stack} {micros}\n')
+        print(f"Profile written to {base}.prof")
+        return base
@@ -0,0 +1,186 @@
+import math
+
+import numpy as np
+
+from .spatial_index import KM_PER_DEGREE, circle_bounds
+
+# Approximate bounding boxes of the Italian regions, islands included, as
+# (min_lat, max_lat, min_lng, max_lng) in degrees
+REGION_BOUNDS = {
+    'Abruzzo': (41.68, 42.90, 13.02, 14.78),
+    'Basilicata': (39.90, 41.14, 15.34, 16.87),
+    'Calabria': (37.92, 40.14, 15.63, 17.21),
+    'Campania': (39.99, 41.51, 13.76, 15.81),
+    'Emilia-Romagna': (43.73, 45.14, 9.20, 12.76),
+    'Friuli-Venezia Giulia': (45.58, 46.65, 12.32, 13.92),
+    'Lazio': (40.78, 42.84, 11.45, 14.03),
+    'Liguria': (43.78, 44.68, 7.49, 10.07),
+    'Lombardia': (44.68, 46.64, 8.50, 11.43),
+    'Marche': (42.69, 43.97, 12.19, 13.92),
+    'Molise': (41.36, 42.07, 13.94, 15.16),
+    'Piemonte': (44.06, 46.46, 6.63, 9.21),
+    'Puglia': (39.79, 42.23, 14.93, 18.52),
+    'Sardegna': (38.86, 41.32, 8.13, 9.83),
+    'Sicilia': (35.49, 38.82, 11.92, 15.65),
+    'Toscana': (42.24, 44.47, 9.69, 12.37),
+    'Trentino-Alto Adige': (45.67, 47.09, 10.38, 12.48),
+    'Umbria': (42.36, 43.62, 11.89, 13.26),
+    "Valle d'Aosta": (45.47, 45.99, 6.80, 7.94),
+    'Veneto': (44.79, 46.68, 10.62, 13.10),
+}
+
+# Simplified borders of the regions whose box takes in large parts of the
+# neighbouring ones, as (lat, lng) vertices in degrees. They are within a
+# few kilometres of the real borders.
+REGION_OUTLINES = {
+    'Piemonte': (
+        (46.47, 8.40), (46.41, 8.48), (46.33, 8.47), (46.22, 8.55),
+        (46.16, 8.60), (46.11, 8.72), (45.92, 8.59), (45.76, 8.57),
+        (45.70, 8.67), (45.53, 8.72), (45.43, 8.79), (45.38, 8.80),
+        (45.31, 8.71), (45.31, 8.56), (45.22, 8.54), (45.12, 8.55),
+        (45.05, 8.72), (45.04, 8.85), (44.98, 8.92), (44.90, 9.03),
+        (44.80, 9.10), (44.72, 9.22), (44.60, 9.17), (44.63, 9.03),
+        (44.67, 8.94), (44.58, 8.88), (44.62, 8.76), (44.58, 8.62),
+        (44.57, 8.45), (44.50, 8.37), (44.50, 8.30), (44.40, 8.17),
+        (44.24, 8.06), (44.12, 7.89), (44.06, 7.73), (44.13, 7.63),
+        (44.15, 7.55), (44.09, 7.45), (44.11, 7.32), (44.15, 7.22),
+        (44.21, 7.10), (44.32, 6.93), (44.42, 6.86), (44.53, 6.84),
+        (44.68, 6.96), (44.80, 6.98), (44.93, 6.72), (45.07, 6.63),
+        (45.14, 6.74), (45.21, 6.90), (45.30, 7.06), (45.41, 7.10),
+        (45.47, 7.10), (45.50, 7.20), (45.53, 7.45), (45.56, 7.62),
+        (45.59, 7.80), (45.70, 7.90), (45.85, 7.88), (45.93, 7.87),
+        (46.02, 7.99), (46.12, 8.03), (46.21, 8.17), (46.26, 8.08),
+        (46.30, 8.20), (46.40, 8.33),
+    ),
+}
+
+# Distance around an outline within which points still count as inside,
+# to make up for its simplified border
+OUTLINE_MARGIN_KM = 3.0
+
+
+class RegionOutline:
+    """
+    Polygon of a region, for the points that its bounding box cannot tell
+    apart from the neighbouring regions.
+    """
+
+    def __init__(self, vertices):
+        """
+        Parameters:
+        vertices (iterable): (lat, lng) of each vertex, in order; the last
+                             one is joined back to the first.
+        """
+        self.lats, self.lngs = np.array(vertices, dtype=np.float64).T
+
+    def distance_km(self, lat, lng):
+        """
+        Distance in km from a point to the border, on a local flat
+        projection, which is accurate enough at the scale of a region.
+        """
+        x = (self.lngs - lng) * KM_PER_DEGREE * math.cos(math.radians(lat))
+        y = (self.lats - lat) * KM_PER_DEGREE
+        dx, dy = np.roll(x, -1) - x, np.roll(y, -1) - y
+        # Closest point of each edge to the origin, i.e. to the point
+        t = np.clip(-(x * dx + y * dy) / (dx * dx + dy * dy), 0.0, 1.0)
+        return float(np.hypot(x + t * dx, y + t * dy).min())
+
+    def contains(self, lat, lng, margin_km=0.0):
+        """
+        Tell whether a point is inside the outline, or within `margin_km`
+        of its border.
+        """
+        next_lats, next_lngs = np.roll(self.lats, -1), np.roll(self.lngs, -1)
+        # Count the edges crossed by a ray going east from the point
+        crossing = (self.lats > lat) != (next_lats > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            edge_lngs = self.lngs + (lat - self.lats) * (
+                next_lngs - self.lngs) / (next_lats - self.lats)
+        if np.count_nonzero(crossing & (lng < edge_lngs)) % 2:
+            return True
+        return margin_km > 0 and self.distance_km(lat, lng) <= margin_km
+
+
+class BoundsIndex:
+    """
+    Offline point-in-area lookup over named bounding boxes.
+
+    The boxes are kept as NumPy arrays, so finding the areas around a point
+    is a handful of vectorized comparisons, without any geocoding request.
+    Boxes overlap near borders, so a point may be in several areas.
+    """
+
+    def __init__(self, bounds):
+        """
+        Parameters:
+        bounds (dict): Area name -> (min_lat, max_lat, min_lng, max_lng).
+        """
+        self.names = list(bounds)
+        boxes = np.array([bounds[name] for name in self.names],
+                         dtype=np.float64).reshape(-1, 4)
+        self.min_lat, self.max_lat, self.min_lng, self.max_lng = boxes.T
+
+    @classmethod
+    def from_points(cls, names, lats, lngs, margin_km=0.0):
+        """
+        Build the box of each area from points known to be in it, such as
+        the shelter coordinates of each PROVINCIA.
+
+        Parameters:
+        names (array-like): Area of each point.
+        lats (array-like): Latitude of each point.
+        lngs (array-like): Longitude of each point.
+        margin_km (float, optional): Distance added around each box, since
+                                     the points rarely reach the borders.
+
+        Returns:
+        BoundsIndex: The index of the areas.
+        """
+        points = {}
+        for name, lat, lng in zip(names, lats, lngs):
+            if lat == lat and lng == lng:  # Skip NaN coordinates
+                points.setdefault(name, []).append((lat, lng))
+        bounds = {}
+        for name, coords in points.items():
+            coords = np.array(coords)
+            min_lat, max_lat = coords[:, 0].min(), coords[:, 0].max()
+            min_lng, max_lng = coords[:, 1].min(), coords[:, 1].max()
+            if margin_km:
+                # Widen by the margin at the box's most poleward edge
+                south, _, west, _ = circle_bounds(min_lat, min_lng, margin_km)
+                _, north, _, east = circle_bounds(max_lat, max_lng, margin_km)
+                min_lat, max_lat = south, north
+                dlng = max(min_lng - west, east - max_lng)
+                min_lng, max_lng = min_lng - dlng, max_lng + dlng
+            bounds[name] = (min_lat, max_lat, min_lng, max_lng)
+        return cls(bounds)
+
+    def bounds(self):
+        """Return the boxes as a dict, as given to the constructor."""
+        return {name: (float(self.min_lat[i]), float(self.max_lat[i]),
+                       float(self.min_lng[i]), float(self.max_lng[i]))
+                for i, name in enumerate(self.names)}
+
+    def locate(self, lat, lng):
+        """
+        Find the areas whose box contains a point.
+
+        Returns:
+        list: Names of the areas, smallest box first.
+        """
+        inside = np.flatnonzero(
+            (self.min_lat <= lat) & (lat <= self.max_lat)
+            & (self.min_lng <= lng) & (lng <= self.max_lng))
+        if len(inside) > 1:
+            areas = ((self.max_lat[inside] - self.min_lat[inside])
+                     * (self.max_lng[inside] - self.min_lng[inside]))
+            inside = inside[np.argsort(areas, kind='stable')]
+        return [self.names[index] for index in inside.tolist()]
+
+    def contains(self, name, lat, lng):
+        """Tell whether the box of area `name` contains a point."""
+        if name not in self.names:
+            return False
+        index = self.names.index(name)
+        return bool(self.min_lat[index] <= lat <= self.max_lat[index]
+                    and self.min_lng[index] <= lng <= self.max_lng[index])
@@ -0,0 +1,115 @@
+import csv
+import os
+import re
+
+# The Italian regions, as written on escursionismo.it
+ITALIAN_REGIONS = [
+    'Abruzzo', 'Basilicata', 'Calabria', 'Campania', 'Emilia-Romagna',
+    'Friuli-Venezia Giulia', 'Lazio', 'Liguria', 'Lombardia', 'Marche',
+    'Molise', 'Piemonte', 'Puglia', 'Sardegna', 'Sicilia', 'Toscana',
+    'Trentino-Alto Adige', 'Umbria', "Valle d'Aosta", 'Veneto',
+]
+
+
+def _simplify(text):
+    """Lowercase and drop the punctuation that varies between spellings."""
+    return re.sub(r"[\s\-'’]+", ' ', text).strip().lower()
+
+
+_REGION_BY_KEY = {_simplify(region): region for region in ITALIAN_REGIONS}
+
+# Separators between the parts of a location, as in "Cuneo, Piemonte"
+_LOCATION_SEPARATORS = re.compile(r'[,|/·•]')
+
+
+def match_region(text):
+    """
+    Returns the region whose name is exactly `text`, ignoring case,
+    hyphens and apostrophes, or None.
+    """
+    return _REGION_BY_KEY.get(_simplify(text))
+
+
+def region_of_fields(texts):
+    """
+    Returns the region named by the location fields of a listing card.
+
+    Only a text that is exactly a region name, or a location part like the
+    "Piemonte" of "Cuneo, Piemonte", counts: a region mentioned in a
+    shelter's name or description does not. When no region, or more than
+    one, is found, the region is unknown.
+
+    Parameters:
+    texts (iterable): The texts of the elements of the card.
+
+    Returns:
+    str: The region, or None if it is unknown.
+    """
+    found = set()
+    for text in texts:
+        for part in _LOCATION_SEPARATORS.split(text):
+            region = match_region(part)
+            if region is not None:
+                found.add(region)
+    return found.pop() if len(found) == 1 else None
+
+
+class RegionIndex:
+    """
+    Cached mapping from shelter URL to the region of the shelter.
+
+    It is filled from the listing pages and from parsed detail pages, and
+    lets the scraper skip the detail pages of shelters outside the target
+    regions.
+    """
+
+    def __init__(self, path=None, regions=None):
+        """
+        Parameters:
+        path (str, optional): CSV file the index is loaded from and saved to.
+        regions (dict, optional): Initial URL -> region mapping.
+        """
+        self.path = path
+        self.regions = dict(regions or {})
+
+    @classmethod
+    def load(cls, path):
+        """Loads the index from `path`, or returns an empty one."""
+        regions = {}
+        if os.path.exists(path):
+            with open(path, newline='') as file:
+                for row in csv.DictReader(file):
+                    regions[row['URL']] = row['Region']
+        return cls(path, regions)
+
+    def save(self):
+        """Writes the index back to its file."""
+        with open(self.path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['URL', 'Region'])
+            writer.writerows(sorted(self.regions.items()))
+
+    def learn(self, url, region):
+        """Records the region of `url`, if it is a known Italian region."""
+        region = match_region(region) if region else None
+        if region is not None:
+            self.regions[url] = region
+
+    def select(self, urls, target_regions):
+        """
+        Keeps the URLs that may belong to one of `target_regions`.
+
+        URLs of an unknown region are kept, since their page must be
+        fetched to find out.
+
+        Parameters:
+        urls (list): Shelter URLs.
+        target_regions (iterable): Names of the regions to keep.
+
+        Returns:
+        list: The selected URLs, in the same order.
+        """
+        target_regions = set(target_regions)
+        return [url for url in urls
+                if url not in self.regions
+                or self.regions[url] in target_regions]
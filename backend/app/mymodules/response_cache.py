@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - fall back to the standard library
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+def dumps(content):
+    """
+    Serialize `content` to JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+@dataclass(frozen=True)
+class CachedBody:
+    """
+    A serialized JSON response and its precompressed variants.
+
+    Attributes:
+    body (bytes): The JSON body.
+    etag (str): Quoted entity tag of the body.
+    encoded (dict): Content-Encoding -> compressed body.
+    size (int): Number of items of a JSON array, None for other content.
+    """
+    body: bytes
+    etag: str
+    encoded: dict
+    size: int = None
+
+
+def build_cached_body(content):
+    """
+    Serialize and compress a response body once.
+
+    Parameters:
+    content: JSON-serializable response content.
+
+    Returns:
+    CachedBody: The body with its ETag and gzip/brotli variants.
+    """
+    body = dumps(content)
+    etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    encoded = {}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        if brotli is not None:
+            encoded['br'] = brotli.compress(body)
+        encoded['gzip'] = gzip.compress(body, compresslevel=6)
+    return CachedBody(body=body, etag=etag, encoded=encoded,
+                      size=len(content) if isinstance(content, list)
+                      else None)
+
+
+def etag_matches(if_none_match, etag):
+    """Tell whether an If-None-Match header matches `etag`."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+def cached_response(request, cached):
+    """
+    Build the HTTP response for a cached body.
+
+    Answers `304 Not Modified` when the client already has the body, and
+    otherwise picks the best encoding accepted by the client.
+
+    Parameters:
+    request (Request): The incoming request.
+    cached (CachedBody): The body to send.
+
+    Returns:
+    Response: The response to return from the endpoint.
+    """
+    headers = {'ETag': cached.etag, 'Vary': 'Accept-Encoding'}
+    if etag_matches(request.headers.get('if-none-match'), cached.etag):
+        return Response(status_code=304, headers=headers)
+
+    accepted = request.headers.get('accept-encoding', '')
+    accepted = {part.split(';')[0].strip() for part in accepted.split(',')}
+    for encoding in ('br', 'gzip'):
+        if encoding in accepted and encoding in cached.encoded:
+            headers['Content-Encoding'] = encoding
+            return Response(content=cached.encoded[encoding],
+                            media_type='application/json', headers=headers)
+    return Response(content=cached.body, media_type='application/json',
+                    headers=headers)
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses for one dataset version.
+
+    Entries are keyed by the normalized query parameters. When a request
+    arrives for a newer dataset version, every entry is dropped.
+    """
+
+    def __init__(self, max_entries=256):
+        """
+        Parameters:
+        max_entries (int, optional): Maximum number of cached responses.
+        """
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(params):
+        """Build a cache key from a dictionary of query parameters."""
+        return tuple(sorted((name, value) for name, value in params.items()
+                            if value is not None))
+
+    def get(self, version, key):
+        """
+        Return the cached body for `key`, or None if it is not cached.
+        """
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+                return None
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+            return cached
+
+    def put(self, version, key, content):
+        """
+        Serialize `content` and cache it under `key`.
+
+        Returns:
+        CachedBody: The cached body.
+        """
+        cached = build_cached_body(content)
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+            self._entries[key] = cached
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
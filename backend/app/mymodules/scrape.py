@@ -3,15 +3,99 @@ import pandas as pd
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import asyncio
+import csv
+import hashlib
 import os
 
+try:
+    from .crawler import AsyncCrawler
+    from .extractors import get_extractor
+    from .regions import RegionIndex, region_of_fields
+    from .scrape_pipeline import run_pipeline
+    from .scrape_state import ScrapeState
+except ImportError:  # Run as a script: python app/mymodules/scrape.py
+    from crawler import AsyncCrawler
+    from extractors import get_extractor
+    from regions import RegionIndex, region_of_fields
+    from scrape_pipeline import run_pipeline
+    from scrape_state import ScrapeState
 
-def scrape_shelter_urls(test_mode=False):
+BASE_URL = "https://www.escursionismo.it/rifugi-bivacchi/"
+URLS_CACHE_FILE = "backend/app/urls_cache.txt"
+SHELTERS_CSV_FILE = 'backend/app/mountain_shelters.csv'
+SHELTER_FIELDS = ['Name', 'Description', 'Region', 'Latitude', 'Longitude']
+
+# Regions whose shelters are kept, e.g. SCRAPE_REGIONS="Piemonte,Lombardia"
+TARGET_REGIONS = frozenset(
+    region.strip()
+    for region in os.environ.get('SCRAPE_REGIONS', 'Piemonte').split(','))
+
+# Cached URL -> region mapping, used to skip shelters of other regions
+REGION_INDEX_FILE = 'backend/app/urls_regions.csv'
+
+# Per-URL state used by the incremental scrape mode
+STATE_DB_PATH = 'backend/app/scrape_state.sqlite3'
+
+
+def listing_page_url(page):
+    """Returns the URL of a page of the shelters listing."""
+    return f"{BASE_URL}page/{page}/" if page > 1 else BASE_URL
+
+
+def parse_total_pages(content):
+    """Reads the number of listing pages from the first listing page."""
+    soup = BeautifulSoup(content, 'html.parser')
+    return int(soup.find_all('a', class_='page-numbers')[-2].text)
+
+
+def _is_description(tag):
+    """Tells whether a tag of a listing card holds descriptive text."""
+    classes = ' '.join(tag.get('class') or [])
+    return tag.name == 'p' or 'descr' in classes or 'excerpt' in classes
+
+
+def parse_listing_entries(content):
+    """
+    Extracts the shelter URLs from a listing page, with the region of each
+    shelter when its card on the listing has a location field naming one.
+
+    The name and description of the shelter are not searched, since they
+    may mention other regions. Shelters of an unclear region are returned
+    with None, so that their page is fetched to find out.
+
+    Returns:
+    list: (url, region) tuples, where region may be None.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    entries = []
+    for div in soup.find_all('div', class_='profile-name'):
+        a_tag = div.find('a')
+        if not (a_tag and 'href' in a_tag.attrs):
+            continue
+        # The card is the largest element around the link that does not
+        # also hold the cards of other shelters
+        card = div
+        while card.parent is not None and \
+                len(card.parent.find_all('div', class_='profile-name')) == 1:
+            card = card.parent
+        # Each text of its own element, outside the name and description
+        texts = [text for text in card.find_all(string=True)
+                 if div not in text.parents
+                 and not any(_is_description(parent)
+                             for parent in text.parents)]
+        entries.append((a_tag['href'], region_of_fields(texts)))
+    return entries
+
+
+def scrape_shelter_urls(test_mode=False, region_index=None):
     """
     Scrapes shelter URLs from a website. If test_mode is True,
-    only the first 20 URLs are scraped.
+    only the first 20 URLs are scraped. Regions found on the listing
+    pages are recorded in `region_index`, when given.
     """
-    cache_file = "backend/app/urls_cache.txt"
+    cache_file = URLS_CACHE_FILE
 
     if os.path.exists(cache_file) and not test_mode:
         print("Loading URLs from cache...")
@@ -20,27 +104,23 @@ def scrape_shelter_urls(test_mode=False):
         return urls
 
     urls = []
-    base_url = "https://www.escursionismo.it/rifugi-bivacchi/"
+    base_url = BASE_URL
     response = requests.get(base_url, verify=False)
-    soup = BeautifulSoup(response.content, 'html.parser')
 
     # Find total number of pages to scrape
-    total_pages = int(soup.find_all('a', class_='page-numbers')
-                      [-2].text) if not test_mode else 1
+    total_pages = parse_total_pages(response.content) if not test_mode else 1
 
     # Iterate over each page and scrape URLs
     for page in tqdm(range(1, total_pages + 1), desc="Scraping Pages"):
-        page_url = f"{base_url}page/{page}/" if page > 1 else base_url
-        response = requests.get(page_url)
-        soup = BeautifulSoup(response.content, 'html.parser')
+        response = requests.get(listing_page_url(page))
 
         # Extract shelter URLs from the current page
-        for div in soup.find_all('div', class_='profile-name'):
-            a_tag = div.find('a')
-            if a_tag and 'href' in a_tag.attrs:
-                urls.append(a_tag['href'])
-                if test_mode and len(urls) >= 20:
-                    return urls
+        for url, region in parse_listing_entries(response.content):
+            if region_index is not None:
+                region_index.learn(url, region)
+            urls.append(url)
+            if test_mode and len(urls) >= 20:
+                return urls
 
     # Save scraped URLs to cache file
     if not test_mode:
@@ -51,6 +131,21 @@ def scrape_shelter_urls(test_mode=False):
     return urls
 
 
+def parse_shelter_details(content, extractor=None):
+    """
+    Extracts the details of a shelter from the HTML of its page.
+
+    Parameters:
+    content (bytes): The HTML of the shelter page.
+    extractor (str, optional): Name of the extraction backend, see
+                               `extractors.EXTRACTORS`.
+
+    Returns:
+    dict: Name, description, region and coordinates of the shelter.
+    """
+    return get_extractor(extractor)(content)
+
+
 def scrape_shelter_details(url):
     """
     Scrapes details of a shelter from its URL.
@@ -65,40 +160,9 @@ def scrape_shelter_details(url):
     Returns:
     dict: A dictionary containing scraped details of the shelter.
     """
-    details = {}
-
     try:
         response = requests.get(url)
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Extract shelter name
-        name_tag = soup.find('h3', style="margin-top: 25px")
-        details['Name'] = name_tag.text.strip(
-        ) if name_tag else 'Name not found'
-
-        # Extract shelter description
-        description_tag = soup.find('div', class_='descrizione-lunga')
-        details['Description'] = description_tag.text.strip(
-        ) if description_tag else 'Description not found'
-
-        # Extract region information
-        details['Region'] = 'Region not found'
-        for td in soup.find_all('td'):
-            if td.text.strip() == 'Piemonte':
-                details['Region'] = 'Piemonte'
-                break
-
-        # Extract coordinates
-        details['Latitude'] = 'Coords not found'
-        details['Longitude'] = 'Coords not found'
-        for td in soup.find_all('td'):
-            if 'Lat:' in td.text and 'Long:' in td.text:
-                coords = td.get_text(separator="|").split('|')
-                if len(coords) >= 2:
-                    lat, long = coords[0].split(':'), coords[1].split(':')
-                    details['Latitude'] = lat[1].strip()
-                    details['Longitude'] = long[1].strip()
-                break
+        details = parse_shelter_details(response.content)
 
     except requests.exceptions.RequestException as e:
         details = {'Name': 'Request failed', 'Description': 'Request failed',
@@ -112,53 +176,322 @@ def scrape_shelter_details(url):
     return details
 
 
-def process_url(url):
+def process_url(url, regions=TARGET_REGIONS):
     """
     Processes a single shelter URL to scrape details.
 
-    Calls `scrape_shelter_details` and filters results for 'Piemonte' region.
+    Calls `scrape_shelter_details` and filters results for the target
+    regions ('Piemonte' by default).
 
     Parameters:
     url (str): The URL of the shelter to process.
+    regions (iterable, optional): Names of the regions to keep.
 
     Returns:
-    dict or None: Shelter details if from 'Piemonte' region, otherwise None.
+    dict or None: Shelter details if from one of `regions`, otherwise None.
     """
     details = scrape_shelter_details(url)
-    if details['Region'] == 'Piemonte':
+    if details['Region'] in regions:
         return details
     return None
 
 
-def main():
+def process_url_incremental(url, state, session=None, run_started_at=None):
+    """
+    Processes a shelter URL, fetching and parsing it only if it changed.
+
+    Sends a conditional request built from the stored ETag/Last-Modified.
+    Pages answering `304 Not Modified`, or whose body has the same hash as
+    last time, are not parsed again. Pages already checked since
+    `run_started_at` are not fetched at all, so that an interrupted run
+    resumes where it stopped.
+
+    Parameters:
+    url (str): The URL of the shelter to process.
+    state (ScrapeState): Store of the per-URL scrape state.
+    session (requests.Session, optional): Session used for the request.
+    run_started_at (float, optional): Start time of the current run.
+
+    Returns:
+    dict or None: Shelter details (of any region), or None if the page
+                  could not be fetched and was never scraped before.
+    """
+    entry = state.get(url)
+    if (entry is not None and run_started_at is not None
+            and entry.fetched_at >= run_started_at):
+        return entry.details
+
+    headers = entry.request_headers() if entry is not None else {}
+    try:
+        response = (session or requests).get(url, headers=headers, timeout=30)
+        if response.status_code == 304 and entry is not None:
+            state.touch(url)
+            return entry.details
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        # Not recorded, so the page is retried on the next run
+        return entry.details if entry is not None else None
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    if entry is not None and entry.content_hash == content_hash:
+        details = entry.details
+    else:
+        try:
+            details = parse_shelter_details(response.content)
+        except Exception as e:
+            print(f"Error parsing {url}: {e}")
+            return entry.details if entry is not None else None
+    state.save(url, response.headers.get('ETag'),
+               response.headers.get('Last-Modified'), content_hash, details)
+    return details
+
+
+def main_incremental(state_path=STATE_DB_PATH,
+                     csv_file='backend/app/mountain_shelters.csv',
+                     regions=TARGET_REGIONS,
+                     region_index_file=REGION_INDEX_FILE):
+    """
+    Incremental version of `main`.
+
+    Only the detail pages that changed since the last run are downloaded
+    and parsed. If a previous run was interrupted, it is resumed. The CSV
+    is then written from the stored details of the shelters in `regions`.
+
+    Parameters:
+    state_path (str, optional): Path of the scrape state database.
+    csv_file (str, optional): Path of the CSV file to write.
+    regions (iterable, optional): Names of the regions to keep.
+    region_index_file (str, optional): Path of the URL -> region index.
+    """
+    region_index = RegionIndex.load(region_index_file)
+    all_shelter_urls = region_index.select(
+        scrape_shelter_urls(region_index=region_index), regions)
+    state = ScrapeState(state_path)
+    run_started_at = state.start_run()
+
+    results = {}
+    with requests.Session() as session, \
+            ThreadPoolExecutor(max_workers=10) as executor:
+        future_to_url = {executor.submit(
+            process_url_incremental, url, state, session, run_started_at):
+            url for url in all_shelter_urls}
+
+        for future in tqdm(as_completed(future_to_url),
+                           total=len(all_shelter_urls),
+                           desc="Scraping Shelter Details"):
+            url = future_to_url[future]
+            results[url] = future.result()
+            if results[url]:
+                region_index.learn(url, results[url]['Region'])
+
+    state.finish_run()
+    state.close()
+    region_index.save()
+
+    # Keep the order of the URL list, so unchanged runs give the same file
+    all_shelter_details = [
+        results[url] for url in all_shelter_urls
+        if results[url] and results[url]['Region'] in regions]
+    df = pd.DataFrame(all_shelter_details)
+    df.to_csv(csv_file, index=False)
+    print(f"CSV file created at {csv_file} with shelter details.")
+
+
+def main(regions=TARGET_REGIONS, region_index_file=REGION_INDEX_FILE):
     """
     Main function to scrape shelter URLs and details.
 
-    Scrapes all shelter URLs, uses ThreadPoolExecutor to scrape details in
-    parallel, and saves details of shelters from 'Piemonte' region to a CSV.
+    Scrapes all shelter URLs, skips the ones known to be outside the target
+    regions, uses ThreadPoolExecutor to scrape details in parallel, and
+    saves details of shelters from the target regions ('Piemonte' by
+    default) to a CSV.
+
+    Parameters:
+    regions (iterable, optional): Names of the regions to keep.
+    region_index_file (str, optional): Path of the URL -> region index.
     """
-    all_shelter_urls = scrape_shelter_urls()
+    region_index = RegionIndex.load(region_index_file)
+    all_shelter_urls = region_index.select(
+        scrape_shelter_urls(region_index=region_index), regions)
 
     all_shelter_details = []
     with ThreadPoolExecutor(max_workers=10) as executor:
         # Submitting URLs for parallel processing
         future_to_url = {executor.submit(
-            process_url, url): url for url in all_shelter_urls}
+            scrape_shelter_details, url): url for url in all_shelter_urls}
 
         # Collecting results with progress tracking
         for future in tqdm(as_completed(future_to_url),
                            total=len(all_shelter_urls),
                            desc="Scraping Shelter Details"):
             result = future.result()
-            if result:
+            region_index.learn(future_to_url[future], result['Region'])
+            if result['Region'] in regions:
                 all_shelter_details.append(result)
+    region_index.save()
 
     # Saving shelter details to CSV
-    csv_file = 'backend/app/mountain_shelters.csv'
+    csv_file = SHELTERS_CSV_FILE
     df = pd.DataFrame(all_shelter_details)
     df.to_csv(csv_file, index=False)
     print(f"CSV file created at {csv_file} with shelter details.")
 
 
+async def scrape_shelter_urls_async(crawler, test_mode=False,
+                                    cache_file=URLS_CACHE_FILE,
+                                    region_index=None):
+    """
+    Asynchronous version of `scrape_shelter_urls`.
+
+    After the first listing page, all the other pages are fetched
+    concurrently through the crawler. URLs keep the listing order. The
+    cache is only written when every listing page was read, so that a
+    page failing once does not drop its shelters from later scrapes.
+
+    Parameters:
+    crawler (AsyncCrawler): The crawler used for the requests.
+    test_mode (bool, optional): Only scrape the first 20 URLs, without
+                                using or writing the cache.
+    cache_file (str, optional): Path of the URL cache file.
+    region_index (RegionIndex, optional): Index where the regions found on
+                                          the listing pages are recorded.
+
+    Returns:
+    list: The shelter URLs.
+
+    Raises:
+    RuntimeError: If a listing page could not be fetched.
+    """
+    if os.path.exists(cache_file) and not test_mode:
+        print("Loading URLs from cache...")
+        with open(cache_file, 'r') as file:
+            return file.read().splitlines()
+
+    response = await crawler.fetch(BASE_URL)
+    response.raise_for_status()
+    total_pages = parse_total_pages(response.content) if not test_mode else 1
+
+    pages = {1: parse_listing_entries(response.content)}
+    other_pages = {listing_page_url(page): page
+                   for page in range(2, total_pages + 1)}
+    failed = []
+    async for url, entries in crawler.crawl(list(other_pages),
+                                            parse_listing_entries):
+        if entries is None:
+            failed.append(url)
+        pages[other_pages[url]] = entries or []
+    if failed:
+        raise RuntimeError(
+            f"Could not fetch the listing pages {', '.join(sorted(failed))}")
+
+    entries = [entry for page in sorted(pages) for entry in pages[page]]
+    if region_index is not None:
+        for url, region in entries:
+            region_index.learn(url, region)
+    urls = [url for url, _ in entries]
+    if test_mode:
+        return urls[:20]
+
+    with open(cache_file, 'w') as file:
+        for url in urls:
+            file.write(f"{url}\n")
+    return urls
+
+
+async def main_async(csv_file=SHELTERS_CSV_FILE, crawler=None,
+                     cache_file=URLS_CACHE_FILE, regions=TARGET_REGIONS,
+                     region_index_file=REGION_INDEX_FILE, parsers=None,
+                     executor=None, on_progress=None, state_path=None):
+    """
+    Asynchronous version of `main`.
+
+    Fetches the detail pages that may be in the target regions through an
+    AsyncCrawler (shared keep-alive connections, per-host rate limits,
+    retries with backoff), parses them in a process pool fed through a
+    bounded queue, and appends each shelter of those regions to the CSV as
+    soon as its page is parsed.
+
+    With a `state_path`, the run is incremental like `main_incremental`:
+    only the detail pages that changed since the last run are downloaded
+    and parsed, and an interrupted run is resumed.
+
+    Parameters:
+    csv_file (str, optional): Path of the CSV file to write.
+    crawler (AsyncCrawler, optional): Crawler to use. A default one is
+                                      created and closed when not given.
+    cache_file (str, optional): Path of the URL cache file.
+    regions (iterable, optional): Names of the regions to keep.
+    region_index_file (str, optional): Path of the URL -> region index.
+    parsers (int, optional): Number of parser processes. Defaults to the
+                             number of CPUs.
+    executor (Executor, optional): Pool to parse in, instead of a new
+                                   ProcessPoolExecutor.
+    on_progress (callable, optional): Called with (pages done, total pages)
+                                      after each detail page.
+    state_path (str, optional): Path of the scrape state database.
+    """
+    region_index = RegionIndex.load(region_index_file)
+    state = ScrapeState(state_path) if state_path else None
+    own_crawler = crawler is None
+    if own_crawler:
+        crawler = AsyncCrawler()
+    try:
+        all_shelter_urls = region_index.select(
+            await scrape_shelter_urls_async(
+                crawler, cache_file=cache_file, region_index=region_index),
+            regions)
+
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=SHELTER_FIELDS)
+            writer.writeheader()
+            progress = tqdm(total=len(all_shelter_urls),
+                            desc="Scraping Shelter Details")
+
+            def write_details(url, details):
+                progress.update(1)
+                if on_progress is not None:
+                    on_progress(progress.n, progress.total)
+                if not details:
+                    return
+                region_index.learn(url, details['Region'])
+                if details['Region'] in regions:
+                    writer.writerow(details)
+                    file.flush()
+
+            run_started_at = state.start_run() if state else None
+            await run_pipeline(all_shelter_urls, crawler,
+                               parse_shelter_details, write_details,
+                               parsers=parsers, executor=executor,
+                               state=state, run_started_at=run_started_at)
+            progress.close()
+        if state is not None:
+            state.finish_run()
+    finally:
+        if own_crawler:
+            await crawler.aclose()
+        if state is not None:
+            state.close()
+        region_index.save()
+    print(f"CSV file created at {csv_file} with shelter details.")
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Scrape mountain shelters.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only fetch and parse pages that changed, "
+                             "resuming an interrupted run")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="use the asyncio crawler engine")
+    parser.add_argument('--regions', default=','.join(sorted(TARGET_REGIONS)),
+                        help="comma-separated regions to keep "
+                             "(default: %(default)s)")
+    args = parser.parse_args()
+    regions = frozenset(region.strip() for region in args.regions.split(','))
+    if args.use_async:
+        asyncio.run(main_async(
+            regions=regions,
+            state_path=STATE_DB_PATH if args.incremental else None))
+    elif args.incremental:
+        main_incremental(regions=regions)
+    else:
+        main(regions=regions)
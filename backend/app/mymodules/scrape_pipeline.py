@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+
+# Marks the end of the fetched pages in the queue
+_DONE = object()
+
+
+async def run_pipeline(urls, crawler, parse, on_result, fetchers=10,
+                       parsers=None, queue_size=64, executor=None,
+                       state=None, run_started_at=None):
+    """
+    Fetch and parse pages in two stages connected by a bounded queue.
+
+    Fetcher tasks download the pages through the crawler and put the raw
+    bytes in the queue. Parser tasks take them out and parse them in a
+    process pool, so that parsing uses every core and never holds up the
+    network. When the parsers fall behind, the queue fills up and the
+    fetchers wait, which bounds the memory used by pending pages.
+
+    With a ScrapeState, pages are fetched with conditional requests, and
+    the stored result is reused for the ones answering 304 Not Modified or
+    whose body did not change. Pages already checked since
+    `run_started_at` are not fetched at all, so that an interrupted run
+    resumes where it stopped.
+
+    Parameters:
+    urls (list): The URLs to process.
+    crawler (AsyncCrawler): The crawler used to fetch the pages.
+    parse (callable): Picklable function called with the body of each page.
+    on_result (callable): Called with (url, result) as soon as each page is
+                          parsed, with result None if it failed. If it
+                          raises, the pipeline stops and raises too.
+    fetchers (int, optional): Number of concurrent fetcher tasks.
+    parsers (int, optional): Number of parser processes. Defaults to the
+                             number of CPUs.
+    queue_size (int, optional): Maximum number of fetched pages waiting to
+                                be parsed.
+    executor (Executor, optional): Pool to parse in, instead of a new
+                                   ProcessPoolExecutor of spawned
+                                   processes.
+    state (ScrapeState, optional): Store of the per-URL scrape state.
+    run_started_at (float, optional): Start time of the current run.
+    """
+    parsers = parsers or os.cpu_count() or 1
+    queue = asyncio.Queue(maxsize=queue_size)
+    pending = iter(urls)
+    loop = asyncio.get_running_loop()
+
+    async def fetch_pages():
+        for url in pending:
+            entry = state.get(url) if state is not None else None
+            if (entry is not None and run_started_at is not None
+                    and entry.fetched_at >= run_started_at):
+                on_result(url, entry.details)
+                continue
+            try:
+                response = await crawler.fetch(
+                    url, headers=entry.request_headers() if entry else None)
+                if response.status_code == 304 and entry is not None:
+                    state.touch(url)
+                    on_result(url, entry.details)
+                    continue
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                # Not recorded, so the page is retried on the next run
+                print(f"Error fetching {url}: {e}")
+                response = None
+            await queue.put((url, response, entry))
+
+    async def parse_pages(pool):
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            url, response, entry = item
+            result = entry.details if entry is not None else None
+            if response is not None:
+                body = response.content
+                content_hash = hashlib.sha256(body).hexdigest() \
+                    if state is not None else None
+                try:
+                    if entry is None or entry.content_hash != content_hash:
+                        result = await loop.run_in_executor(pool, parse, body)
+                    if state is not None:
+                        state.save(url, response.headers.get('ETag'),
+                                   response.headers.get('Last-Modified'),
+                                   content_hash, result)
+                except Exception as e:
+                    print(f"Error parsing {url}: {e}")
+            on_result(url, result)
+
+    own_executor = executor is None
+    # Spawned, not forked: the scrape job runs in a thread of the server
+    pool = ProcessPoolExecutor(
+        max_workers=parsers,
+        mp_context=multiprocessing.get_context('spawn')) if own_executor \
+        else executor
+    fetcher_tasks = [asyncio.ensure_future(fetch_pages())
+                     for _ in range(fetchers)]
+    parser_tasks = [asyncio.ensure_future(parse_pages(pool))
+                    for _ in range(parsers)]
+
+    async def close_queue():
+        await asyncio.gather(*fetcher_tasks)
+        for _ in parser_tasks:
+            await queue.put(_DONE)
+
+    tasks = fetcher_tasks + parser_tasks + [
+        asyncio.ensure_future(close_queue())]
+    try:
+        # Like a task group: the first failure stops every other task, so
+        # fetchers never wait forever on a queue no parser reads
+        done, _ = await asyncio.wait(tasks,
+                                     return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if own_executor:
+            pool.shutdown()
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class PageState:
+    """
+    What is known about a shelter detail page from previous scrapes.
+
+    Attributes:
+    url (str): URL of the page.
+    etag (str or None): ETag header of the last response.
+    last_modified (str or None): Last-Modified header of the last response.
+    content_hash (str): SHA-256 of the last downloaded body.
+    fetched_at (float): Time of the last successful check of the page.
+    details (dict): Result of parsing the page.
+    """
+    url: str
+    etag: str
+    last_modified: str
+    content_hash: str
+    fetched_at: float
+    details: dict
+
+    def request_headers(self):
+        """Headers of a conditional request for the page."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ScrapeState:
+    """
+    SQLite store of per-URL scrape state and of scrape runs.
+
+    It lets the scraper send conditional requests, skip parsing pages that
+    did not change, and resume an interrupted run: a run stays open until
+    finish_run() is called, and pages already checked since the start of
+    the open run are not fetched again.
+    """
+
+    def __init__(self, db_path, clock=time.time):
+        """
+        Parameters:
+        db_path (str): Path of the SQLite file.
+        clock (callable, optional): Returns the current time in seconds.
+        """
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+            "content_hash TEXT, fetched_at REAL, details TEXT);"
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, started_at REAL, "
+            "finished_at REAL);")
+        self._db.commit()
+
+    def get(self, url):
+        """Return the PageState of `url`, or None if it was never scraped."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, etag, last_modified, content_hash, fetched_at, "
+                "details FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return PageState(*row[:5], details=json.loads(row[5]))
+
+    def save(self, url, etag, last_modified, content_hash, details):
+        """Record a successful fetch of `url` and its parsed details."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, content_hash, self.clock(),
+                 json.dumps(details)))
+            self._db.commit()
+
+    def touch(self, url):
+        """Record that `url` was checked and had not changed."""
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched_at = ? WHERE url = ?",
+                             (self.clock(), url))
+            self._db.commit()
+
+    def start_run(self):
+        """
+        Open a scrape run, or resume the last one if it never finished.
+
+        Returns:
+        float: Start time of the run.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT started_at, finished_at FROM runs "
+                "ORDER BY id DESC LIMIT 1").fetchone()
+            if row is not None and row[1] is None:
+                print("Resuming interrupted scrape run.")
+                return row[0]
+            started_at = self.clock()
+            self._db.execute("INSERT INTO runs (started_at) VALUES (?)",
+                             (started_at,))
+            self._db.commit()
+            return started_at
+
+    def finish_run(self):
+        """Mark the open run as finished."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE runs SET finished_at = ? WHERE finished_at IS NULL",
+                (self.clock(),))
+            self._db.commit()
+
+    def close(self):
+        """Close the database connection."""
+        self._db.close()
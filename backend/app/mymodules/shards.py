@@ -0,0 +1,227 @@
+import threading
+from bisect import bisect_right
+from collections.abc import Sequence
+from dataclasses import dataclass
+from functools import cached_property
+
+from .region_bounds import (OUTLINE_MARGIN_KM, REGION_BOUNDS,
+                            REGION_OUTLINES, BoundsIndex, RegionOutline)
+from .spatial_index import circle_bounds
+from .suggest import build_prefix_index
+
+# Margin around the shelters of a region missing from REGION_BOUNDS
+SHELTER_BOUNDS_MARGIN_KM = 25.0
+
+# Boxes of every known region, covered or not
+KNOWN_REGIONS = BoundsIndex(REGION_BOUNDS)
+
+# Outlines of the regions that have one
+OUTLINES = {region: RegionOutline(vertices)
+            for region, vertices in REGION_OUTLINES.items()}
+
+
+class ChainedRecords(Sequence):
+    """
+    The records of several shards, one after the other, read from the
+    records of each shard only when they are accessed.
+    """
+
+    def __init__(self, parts):
+        """
+        Parameters:
+        parts (list): The records of each shard.
+        """
+        self.parts = parts
+        self.starts = []
+        self.size = 0
+        for part in parts:
+            self.starts.append(self.size)
+            self.size += len(part)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position]
+                    for position in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('record index out of range')
+        part = bisect_right(self.starts, index) - 1
+        return self.parts[part][index - self.starts[part]]
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    The shelters dataset of one region.
+
+    Attributes:
+    region (str): Name of the region.
+    dataset (ShelterDataset): Snapshot of the region's merged data, with
+                              its own attribute and spatial indexes.
+    bounds (tuple): Bounding box of its shelters, as (min_lat, max_lat,
+                    min_lng, max_lng), or None if it has none.
+    """
+    region: str
+    dataset: object
+    bounds: tuple
+
+    def has_value(self, column, value):
+        """Tell whether some shelter has `value` in a text column."""
+        code_of = self.dataset.columns.code_of.get(column, {})
+        return value.lower() in code_of
+
+    def may_intersect(self, lat, lng, radius_km):
+        """
+        Tell whether some shelter may be within `radius_km` of a point,
+        judging from the bounding boxes of the shard and of the circle.
+        """
+        if self.bounds is None:
+            return False
+        min_lat, max_lat, min_lng, max_lng = circle_bounds(
+            lat, lng, radius_km)
+        shard_min_lat, shard_max_lat, shard_min_lng, shard_max_lng = \
+            self.bounds
+        return (min_lat <= shard_max_lat and shard_min_lat <= max_lat
+                and min_lng <= shard_max_lng and shard_min_lng <= max_lng)
+
+
+class ShardedDataset:
+    """
+    Immutable snapshot of the datasets of every region.
+
+    Queries are routed to the shards that can answer them: the ones having
+    the requested PROVINCIA and COMUNE, and the ones whose bounding box
+    intersects the search circle. The regions covered by the shards are
+    located offline, from REGION_OUTLINES and REGION_BOUNDS or else from
+    the shelters of each region.
+    """
+
+    def __init__(self, shards):
+        """
+        Parameters:
+        shards (list): The Shard of each region.
+        """
+        self.shards = tuple(shards)
+        self.version = tuple(shard.dataset.version for shard in self.shards)
+        self.records = ChainedRecords(
+            [shard.dataset.records for shard in self.shards])
+        self.columns = list(dict.fromkeys(
+            column for shard in self.shards for column in shard.dataset.data))
+
+        bounds = {}
+        for shard in self.shards:
+            if shard.region in REGION_BOUNDS:
+                bounds[shard.region] = REGION_BOUNDS[shard.region]
+            elif shard.bounds is not None:
+                spatial = shard.dataset.spatial
+                bounds.update(BoundsIndex.from_points(
+                    [shard.region] * spatial.size, spatial.lats,
+                    spatial.lngs, SHELTER_BOUNDS_MARGIN_KM).bounds())
+        self.coverage = BoundsIndex(bounds)
+
+    def regions_at(self, lat, lng):
+        """
+        Return the covered regions containing a point, smallest box
+        first. Empty when the point is outside every covered region.
+
+        The boxes of neighbouring regions overlap, so a region with an
+        outline contains the points inside it, or within
+        OUTLINE_MARGIN_KM of its border. A point is in another region of
+        REGION_BOUNDS when its box is the smallest one containing the
+        point, covered or not.
+        """
+        smallest = KNOWN_REGIONS.locate(lat, lng)[:1]
+        regions = []
+        for region in self.coverage.locate(lat, lng):
+            if region in OUTLINES:
+                if OUTLINES[region].contains(lat, lng, OUTLINE_MARGIN_KM):
+                    regions.append(region)
+            elif region not in REGION_BOUNDS or [region] == smallest:
+                regions.append(region)
+        return regions
+
+    @cached_property
+    def suggestions(self):
+        """
+        PrefixIndex of the PROVINCIA, COMUNE and DENOMINAZIONE values of
+        every shard, built the first time it is needed.
+        """
+        return build_prefix_index(shard.dataset.data for shard in self.shards)
+
+    def route(self, provincia=None, comune=None, lat=None, lng=None,
+              range_km=None):
+        """
+        Select the shards a query needs.
+
+        Parameters:
+        provincia (str, optional): Requested PROVINCIA.
+        comune (str, optional): Requested COMUNE.
+        lat (float, optional): Latitude of the search center.
+        lng (float, optional): Longitude of the search center.
+        range_km (float, optional): Search radius in km.
+
+        Returns:
+        list: The shards to query, in region order.
+        """
+        shards = list(self.shards)
+        if provincia:
+            shards = [s for s in shards if s.has_value('PROVINCIA', provincia)]
+        if comune:
+            shards = [s for s in shards if s.has_value('COMUNE', comune)]
+        if lat is not None and lng is not None and range_km is not None:
+            shards = [s for s in shards
+                      if s.may_intersect(lat, lng, range_km)]
+        return shards
+
+
+class ShardSet:
+    """
+    Holds one ShelterStore per region and combines their snapshots.
+    """
+
+    def __init__(self, stores):
+        """
+        Parameters:
+        stores (dict): Region name -> ShelterStore of its merged data.
+        """
+        self.stores = dict(stores)
+        self._current = None
+        self._lock = threading.Lock()
+
+    def _combine(self, datasets):
+        current = self._current
+        if current is not None and all(
+                shard.dataset is dataset
+                for shard, dataset in zip(current.shards, datasets)):
+            return current
+        with self._lock:
+            self._current = ShardedDataset([
+                Shard(region, dataset, dataset.spatial.bounds)
+                for region, dataset in zip(self.stores, datasets)])
+            return self._current
+
+    def load(self):
+        """
+        (Re)load every shard from disk.
+
+        Returns:
+        ShardedDataset: The new snapshot.
+        """
+        return self._combine([store.load() for store in self.stores.values()])
+
+    def needs_check(self):
+        """Tell whether the next call to get() may read from disk."""
+        return any(store.needs_check() for store in self.stores.values())
+
+    def get(self):
+        """
+        Return the current snapshot, rebuilt when any shard changed.
+
+        Returns:
+        ShardedDataset: The current snapshot.
+        """
+        return self._combine([store.get() for store in self.stores.values()])
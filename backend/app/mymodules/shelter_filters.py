@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+# Integer capacity columns that support exact and range filters
+INT_COLUMNS = ['CAMERE', 'LETTI', 'BAGNI']
+
+# Text columns filtered by case-insensitive exact match
+CATEGORY_COLUMNS = ['PROVINCIA', 'COMUNE']
+
+
+class ShelterColumns:
+    """
+    Columnar view of the shelters dataset used to filter it with NumPy.
+
+    Integer columns are kept as int64 arrays, and text columns as category
+    codes over their lowercased values, so that a whole query is evaluated
+    as a single boolean mask instead of a Python loop over the rows.
+    """
+
+    def __init__(self, frame):
+        """
+        Parameters:
+        frame (pd.DataFrame): The merged shelters DataFrame.
+        """
+        self.size = len(frame)
+        self.ints = {
+            col: frame[col].to_numpy(dtype=np.int64)
+            for col in INT_COLUMNS if col in frame.columns
+        }
+        self.codes = {}
+        self.code_of = {}
+        for col in CATEGORY_COLUMNS:
+            if col not in frame.columns:
+                continue
+            values = pd.Categorical(frame[col].astype(str).str.lower())
+            self.codes[col] = values.codes
+            self.code_of[col] = {
+                label: code for code, label in enumerate(values.categories)}
+
+    def mask(self, equal=None, at_least=None, at_most=None, text=None):
+        """
+        Build the boolean mask of the rows matching every given condition.
+
+        Conditions whose value is None are ignored. Exact integer values are
+        given as strings, as they come from the query string; a value that is
+        not an integer matches no row.
+
+        Parameters:
+        equal (dict, optional): Integer column -> value it must be equal to.
+        at_least (dict, optional): Integer column -> minimum value.
+        at_most (dict, optional): Integer column -> maximum value.
+        text (dict, optional): Text column -> value it must be equal to,
+                               ignoring case.
+
+        Returns:
+        np.ndarray: Boolean array with one entry per shelter.
+        """
+        mask = np.ones(self.size, dtype=bool)
+
+        for col, value in (equal or {}).items():
+            if value is None or value == '':
+                continue
+            try:
+                mask &= self.ints[col] == int(value)
+            except ValueError:
+                mask[:] = False
+
+        for col, value in (at_least or {}).items():
+            if value is not None:
+                mask &= self.ints[col] >= value
+
+        for col, value in (at_most or {}).items():
+            if value is not None:
+                mask &= self.ints[col] <= value
+
+        for col, value in (text or {}).items():
+            if not value:
+                continue
+            code = self.code_of[col].get(value.lower())
+            if code is None:
+                mask[:] = False
+            else:
+                mask &= self.codes[col] == code
+
+        return mask
@@ -0,0 +1,253 @@
+import os
+import threading
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass, replace
+
+import pandas as pd
+
+from .columnar import (StringColumn, columnar_frame, columnar_path,
+                       read_columnar)
+from .shelter_filters import CATEGORY_COLUMNS, INT_COLUMNS, ShelterColumns
+from .spatial_index import GridIndex
+from .text_search import TextIndex, build_text_index
+
+# Explicit dtypes for merged_data.csv, so that nothing is inferred at load
+SHELTER_DTYPES = {
+    'PROVINCIA': str,
+    'COMUNE': str,
+    'INDIRIZZO': str,
+    'TELEFONO': str,
+    'CAMERE': 'int64',
+    'LETTI': 'int64',
+    'BAGNI': 'int64',
+    'DENOMINAZIONE': str,
+    'Description': str,
+    'Region': str,
+    'Latitude': 'float64',
+    'Longitude': 'float64',
+}
+
+# Columns read to build the filter and full-text indexes
+INDEXED_COLUMNS = (INT_COLUMNS + CATEGORY_COLUMNS
+                   + ['DENOMINAZIONE', 'Description'])
+
+
+def _cell_reader(array):
+    if isinstance(array, StringColumn):
+        return array.__getitem__
+    if array.dtype == object:
+        # Text read from the CSV file, with NaN for the missing values
+        return lambda index: (None if not isinstance(array[index], str)
+                              else array[index])
+    return lambda index: array[index].item()
+
+
+class ShelterRecords(Sequence):
+    """
+    The rows of a snapshot as dictionaries ready to be returned as JSON.
+
+    A row is built from the columns each time it is read, so only the
+    rows being served are turned into Python objects, and modifying one
+    does not affect the snapshot. Missing text values are None.
+    """
+
+    def __init__(self, data):
+        """
+        Parameters:
+        data (dict): Column name -> NumPy array or StringColumn.
+        """
+        self.size = len(next(iter(data.values()))) if data else 0
+        self._readers = [(name, _cell_reader(array))
+                         for name, array in data.items()]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(position)
+                    for position in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('record index out of range')
+        return self._row(index)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    __hash__ = None
+
+    def _row(self, index):
+        return {name: read(index) for name, read in self._readers}
+
+
+@dataclass(frozen=True)
+class ShelterDataset:
+    """
+    Immutable snapshot of the merged shelters dataset.
+
+    Attributes:
+    data (dict): Column name -> NumPy array or StringColumn. Memory-mapped
+                 when loaded from the columnar copy.
+    records (ShelterRecords): The rows as dictionaries, built on access.
+    columns (ShelterColumns): Columnar arrays used to filter the rows.
+    spatial (GridIndex): Spatial index over the shelter coordinates.
+    text (TextIndex): Full-text index over the names and descriptions.
+    mtime (float): Modification time of the file the snapshot was read from.
+    version (int): Incremented every time the store reloads the file.
+    """
+    data: dict
+    records: ShelterRecords
+    columns: ShelterColumns
+    spatial: GridIndex
+    text: TextIndex
+    mtime: float
+    version: int
+
+    @property
+    def frame(self):
+        """
+        Typed DataFrame of the merged data. Every text value is decoded
+        to build it, so it is meant for tools and tests, not for serving.
+        """
+        return columnar_frame(self.data)
+
+
+def load_shelter_dataset(csv_path, mtime=None, version=1):
+    """
+    Build a ShelterDataset from merged_data.csv.
+
+    The columnar copy saved next to the CSV file is used when it is up to
+    date: its columns stay memory-mapped, text ones included, and the
+    records are built from them on access. Otherwise the CSV file is read
+    with explicit dtypes and its columns are kept in memory.
+
+    Parameters:
+    csv_path (str): Path to the merged data CSV file.
+    mtime (float, optional): Modification time to record. Read from the file
+                             when not given.
+    version (int, optional): Version number of the snapshot.
+
+    Returns:
+    ShelterDataset: The loaded snapshot.
+    """
+    if mtime is None:
+        mtime = os.path.getmtime(csv_path)
+    data = read_columnar(columnar_path(csv_path), source=csv_path,
+                         decode=False)
+    if data is None:
+        header = pd.read_csv(csv_path, nrows=0).columns
+        dtypes = {col: dtype for col, dtype in SHELTER_DTYPES.items()
+                  if col in header}
+        frame = pd.read_csv(csv_path, dtype=dtypes)
+        data = {name: frame[name].to_numpy() for name in frame.columns}
+    # Only the indexes are kept; the decoded text is freed once they exist
+    indexed = columnar_frame(data, columns=INDEXED_COLUMNS)
+    return ShelterDataset(data=data, records=ShelterRecords(data),
+                          columns=ShelterColumns(indexed),
+                          spatial=GridIndex(data['Latitude'],
+                                            data['Longitude']),
+                          text=build_text_index(indexed),
+                          mtime=mtime, version=version)
+
+
+class ShelterStore:
+    """
+    Resident, hot-reloadable holder of the merged shelters dataset.
+
+    The dataset is loaded once (normally from the FastAPI lifespan hook) and
+    then served from memory. The modification time of the CSV file is checked
+    at most every `check_interval` seconds, and the file is reloaded when it
+    changed on disk.
+    """
+
+    def __init__(self, csv_path, prepare=None, check_interval=1.0):
+        """
+        Parameters:
+        csv_path (str): Path to the merged data CSV file.
+        prepare (callable, optional): Called before loading when the file
+                                      does not exist, to generate it.
+        check_interval (float, optional): Minimum number of seconds between
+                                          two mtime checks.
+        """
+        self.csv_path = csv_path
+        self.prepare = prepare
+        self.check_interval = check_interval
+        self._dataset = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        (Re)load the dataset from disk, generating the file if needed.
+
+        Returns:
+        ShelterDataset: The freshly loaded snapshot.
+        """
+        with self._lock:
+            return self._load()
+
+    def _load(self):
+        if not os.path.exists(self.csv_path) and self.prepare is not None:
+            self.prepare()
+        version = self._dataset.version + 1 if self._dataset else 1
+        self._dataset = load_shelter_dataset(self.csv_path, version=version)
+        self._last_check = time.monotonic()
+        return self._dataset
+
+    def reload(self):
+        """
+        Load the file again and swap it in, for when it is known to have
+        changed. Readers keep the previous snapshot until the swap, since
+        the file is read before the lock is taken.
+
+        Returns:
+        ShelterDataset: The new snapshot.
+        """
+        dataset = load_shelter_dataset(self.csv_path)
+        with self._lock:
+            version = self._dataset.version + 1 if self._dataset else 1
+            self._dataset = replace(dataset, version=version)
+            self._last_check = time.monotonic()
+            return self._dataset
+
+    def needs_check(self):
+        """
+        Tell whether the next call to get() may read from disk.
+
+        Returns:
+        bool: True if the dataset is not loaded or its mtime is due a check.
+        """
+        return (self._dataset is None
+                or time.monotonic() - self._last_check >= self.check_interval)
+
+    def get(self):
+        """
+        Return the current dataset, reloading it if the file changed.
+
+        Returns:
+        ShelterDataset: The current snapshot.
+        """
+        dataset = self._dataset
+        now = time.monotonic()
+        if dataset is not None and \
+                now - self._last_check < self.check_interval:
+            return dataset
+
+        with self._lock:
+            if self._dataset is None:
+                return self._load()
+            self._last_check = now
+            try:
+                mtime = os.path.getmtime(self.csv_path)
+            except OSError:
+                # Keep serving the last good snapshot if the file disappears
+                return self._dataset
+            if mtime != self._dataset.mtime:
+                print(f"{self.csv_path} changed on disk, reloading.")
+                return self._load()
+            return self._dataset
@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+
+from .geo import EARTH_RADIUS_KM, haversine_km
+
+# Length of one degree of latitude in km
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def circle_bounds(lat, lng, radius_km):
+    """
+    Latitude/longitude box containing the circle of `radius_km` around a
+    point.
+
+    Returns:
+    tuple: (min_lat, max_lat, min_lng, max_lng), in degrees. The longitude
+           range is not wrapped around the antimeridian.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    max_lat = min(abs(lat) + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max_lat))
+    dlng = 180.0 if cos_lat < 1e-6 else min(dlat / cos_lat, 180.0)
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+class GridIndex:
+    """
+    Uniform latitude/longitude grid over the shelter coordinates.
+
+    Each shelter is assigned to a cell of `cell_deg` degrees. A radius query
+    only visits the cells overlapping the bounding box of the search circle,
+    and computes exact haversine distances for the shelters in those cells.
+    """
+
+    def __init__(self, lats, lngs, cell_deg=0.25):
+        """
+        Parameters:
+        lats (array-like): Latitudes of the shelters, in degrees.
+        lngs (array-like): Longitudes of the shelters, in degrees.
+        cell_deg (float, optional): Size of a grid cell, in degrees.
+        """
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.size = len(self.lats)
+        self.cell_deg = cell_deg
+
+        rows = np.floor(self.lats / cell_deg).astype(np.int64)
+        cols = np.floor(self.lngs / cell_deg).astype(np.int64)
+        self.cells = {}
+        for index, key in enumerate(zip(rows.tolist(), cols.tolist())):
+            self.cells.setdefault(key, []).append(index)
+        self.cells = {key: np.array(indices, dtype=np.int64)
+                      for key, indices in self.cells.items()}
+
+    @property
+    def bounds(self):
+        """
+        Bounding box of the shelters, as (min_lat, max_lat, min_lng,
+        max_lng), or None when there are none.
+        """
+        if self.size == 0:
+            return None
+        return (float(self.lats.min()), float(self.lats.max()),
+                float(self.lngs.min()), float(self.lngs.max()))
+
+    def _candidates(self, lat, lng, radius_km):
+        """Indices of the shelters in the cells overlapping the circle."""
+        min_lat, max_lat, min_lng, max_lng = circle_bounds(
+            lat, lng, radius_km)
+        row_min = math.floor(min_lat / self.cell_deg)
+        row_max = math.floor(max_lat / self.cell_deg)
+        col_min = math.floor(min_lng / self.cell_deg)
+        col_max = math.floor(max_lng / self.cell_deg)
+
+        n_cells = (row_max - row_min + 1) * (col_max - col_min + 1)
+        if n_cells > len(self.cells):
+            # Cheaper to scan the non-empty cells than the bounding box
+            keys = [key for key in self.cells
+                    if row_min <= key[0] <= row_max
+                    and col_min <= key[1] <= col_max]
+        else:
+            keys = [(row, col)
+                    for row in range(row_min, row_max + 1)
+                    for col in range(col_min, col_max + 1)
+                    if (row, col) in self.cells]
+        if not keys:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.cells[key] for key in keys])
+
+    def within(self, lat, lng, radius_km, mask=None):
+        """
+        Find the shelters within `radius_km` of a point.
+
+        Parameters:
+        lat (float): Latitude of the point.
+        lng (float): Longitude of the point.
+        radius_km (float): Search radius in km.
+        mask (np.ndarray, optional): Boolean array; only shelters where it
+                                     is True are considered.
+
+        Returns:
+        tuple: (indices, distances) of the matching shelters, in index order.
+        """
+        if radius_km is None or radius_km < 0 or self.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        candidates = np.sort(self._candidates(lat, lng, radius_km))
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        distances = haversine_km(
+            lat, lng, self.lats[candidates], self.lngs[candidates])
+        keep = distances <= radius_km
+        return candidates[keep], distances[keep]
+
+    def nearest(self, lat, lng, k, mask=None):
+        """
+        Find the `k` shelters closest to a point.
+
+        The search radius starts at one cell and doubles until enough
+        shelters are found, so only the nearby cells are visited.
+
+        Parameters:
+        lat (float): Latitude of the point.
+        lng (float): Longitude of the point.
+        k (int): Number of shelters to return.
+        mask (np.ndarray, optional): Boolean array; only shelters where it
+                                     is True are considered.
+
+        Returns:
+        tuple: (indices, distances) of the shelters, closest first.
+        """
+        available = self.size if mask is None else int(mask.sum())
+        k = min(k, available)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        radius_km = self.cell_deg * KM_PER_DEGREE
+        while True:
+            indices, distances = self.within(lat, lng, radius_km, mask)
+            if len(indices) >= k or radius_km > math.pi * EARTH_RADIUS_KM:
+                break
+            radius_km *= 2
+
+        order = np.argsort(distances, kind='stable')[:k]
+        return indices[order], distances[order]
@@ -0,0 +1,96 @@
+from bisect import bisect_left
+from collections import Counter
+
+from .name_matching import fold_text
+
+# Columns whose values are suggested, in the order of their results
+SUGGEST_FIELDS = ('PROVINCIA', 'COMUNE', 'DENOMINAZIONE')
+
+
+class PrefixIndex:
+    """
+    Autocomplete index over the values of some text columns.
+
+    Every value is folded (lowercase, no accents or punctuation) and kept in
+    a sorted array once for each of its words, from that word to the end, so
+    "Rifugio Alpe Plane" is found typing "rif", "alpe" or "plane". The
+    entries starting with a prefix are one contiguous range of the array,
+    found with two binary searches.
+    """
+
+    def __init__(self, values):
+        """
+        Parameters:
+        values (iterable): (field, value) pairs; repeated pairs count the
+                           shelters having that value.
+        """
+        counts = Counter((field, value) for field, value in values
+                         if isinstance(value, str) and value.strip())
+        entries = []
+        for (field, value), count in counts.items():
+            words = fold_text(value).split()
+            for start in range(len(words)):
+                entries.append((' '.join(words[start:]), start, field, value,
+                                count))
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def suggest(self, prefix, fields=None, limit=10):
+        """
+        Find the values having a word that starts with `prefix`.
+
+        Parameters:
+        prefix (str): Text typed so far; case, accents and punctuation are
+                      ignored.
+        fields (iterable, optional): Only suggest values of these fields.
+        limit (int, optional): Maximum number of suggestions.
+
+        Returns:
+        list: Dictionaries with the field, the value and the number of
+              shelters having it. Values starting with the prefix come
+              first, then the most common ones.
+        """
+        key = fold_text(prefix)
+        if not key or limit <= 0:
+            return []
+        low = bisect_left(self.keys, key)
+        high = bisect_left(self.keys, key + '\uffff', low)
+
+        best = {}
+        for _, start, field, value, count in self.entries[low:high]:
+            if fields is not None and field not in fields:
+                continue
+            found = best.get((field, value))
+            if found is None or start < found[0]:
+                best[(field, value)] = (start, count)
+
+        def rank(item):
+            (field, value), (start, count) = item
+            order = (SUGGEST_FIELDS.index(field) if field in SUGGEST_FIELDS
+                     else len(SUGGEST_FIELDS))
+            return start > 0, -count, order, value
+
+        ranked = sorted(best.items(), key=rank)[:limit]
+        return [{'field': field, 'value': value, 'count': count}
+                for (field, value), (_, count) in ranked]
+
+
+def build_prefix_index(frames, fields=SUGGEST_FIELDS):
+    """
+    Build the PrefixIndex of some columns of one or more DataFrames.
+
+    Parameters:
+    frames (iterable): DataFrames of the shelters, or dictionaries of
+                       their columns like ShelterDataset.data.
+    fields (tuple, optional): Columns to index; missing ones are skipped.
+
+    Returns:
+    PrefixIndex: The index.
+    """
+    return PrefixIndex(
+        (field, value) for frame in frames for field in fields
+        if field in frame for value in frame[field].tolist())
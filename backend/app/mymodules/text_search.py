@@ -0,0 +1,134 @@
+import math
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from .name_matching import fold_text
+
+# Common Italian words, accents folded, including the elided forms left by
+# splitting "dell'Alpe" or "all'inizio" at the apostrophe
+ITALIAN_STOPWORDS = frozenset('''
+    ad agli ai al all alla alle allo anche che ci coi col come con cui da
+    dagli dai dal dall dalla dalle dallo degli dei del dell della delle
+    dello di dove ed fra gli il in la le lo ma ne negli nei nel nell nella
+    nelle nello non per piu poi quando quest questa queste questi
+    questo quell quella quelle quelli quello se si sia sono su sugli sui sul
+    sull sulla sulle sullo tra un una uno verso
+'''.split())
+
+# Vowels stripped from the end of the words, so that singular and plural
+# forms like "rifugio" and "rifugi" share a term
+_ENDINGS = 'aeiou'
+
+# Shortest stem left by stripping the final vowels
+MIN_STEM_LENGTH = 3
+
+
+def stem(word):
+    """
+    Light Italian stemmer: drop the final vowels of longer words, and the
+    "h" of plurals like "laghi" or "bianchi".
+    """
+    if word.isdigit():
+        return word
+    stemmed = word.rstrip(_ENDINGS)
+    if stemmed.endswith(('gh', 'ch')) and stemmed != word:
+        stemmed = stemmed[:-1]
+    return stemmed if len(stemmed) >= MIN_STEM_LENGTH else word
+
+
+def tokenize(text):
+    """
+    Split a text into search terms.
+
+    Case, accents and punctuation are ignored, Italian stopwords and single
+    letters are dropped, and the remaining words are stemmed.
+
+    Parameters:
+    text (str): The text, e.g. a shelter description or a query.
+
+    Returns:
+    list: The terms, in order.
+    """
+    if not isinstance(text, str):
+        return []
+    return [stem(word) for word in fold_text(text).split()
+            if len(word) > 1 and word not in ITALIAN_STOPWORDS]
+
+
+class TextIndex:
+    """
+    In-memory inverted index with BM25 ranking.
+
+    The BM25 weight of every term in every document is computed when the
+    index is built, so scoring a query only adds up the posting arrays of
+    its terms.
+    """
+
+    def __init__(self, documents, k1=1.2, b=0.75):
+        """
+        Parameters:
+        documents (list): Text of each document; None for an empty one.
+        k1 (float, optional): BM25 term frequency saturation.
+        b (float, optional): BM25 document length normalization.
+        """
+        self.size = len(documents)
+        counts = [Counter(tokenize(document)) for document in documents]
+        lengths = np.array([sum(terms.values()) for terms in counts],
+                           dtype=np.float64)
+        average = lengths.mean() if self.size and lengths.any() else 1.0
+
+        occurrences = defaultdict(list)
+        for position, terms in enumerate(counts):
+            for term, frequency in terms.items():
+                occurrences[term].append((position, frequency))
+
+        self.postings = {}
+        for term, entries in occurrences.items():
+            ids = np.array([entry[0] for entry in entries], dtype=np.int32)
+            frequencies = np.array([entry[1] for entry in entries],
+                                   dtype=np.float64)
+            idf = math.log(1 + (self.size - len(ids) + 0.5)
+                           / (len(ids) + 0.5))
+            norms = k1 * (1 - b + b * lengths[ids] / average)
+            self.postings[term] = (
+                ids, idf * frequencies * (k1 + 1) / (frequencies + norms))
+
+    def scores(self, query):
+        """
+        Score every document against a query.
+
+        Parameters:
+        query (str): The words searched, any of which may match.
+
+        Returns:
+        np.ndarray: BM25 score of each document, 0 for the ones without
+                    any of the query terms.
+        """
+        scores = np.zeros(self.size, dtype=np.float64)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights
+        return scores
+
+
+def build_text_index(frame, columns=('DENOMINAZIONE', 'Description')):
+    """
+    Build the TextIndex of the shelters, one document per row made of the
+    given text columns.
+
+    Parameters:
+    frame (pd.DataFrame): The shelters.
+    columns (tuple, optional): Text columns to index; missing ones are
+                               skipped.
+
+    Returns:
+    TextIndex: The index.
+    """
+    parts = [frame[column].tolist() for column in columns
+             if column in frame.columns]
+    documents = [' '.join(value for value in row if isinstance(value, str))
+                 for row in zip(*parts)] if parts else [None] * len(frame)
+    return TextIndex(documents)
@@ -0,0 +1,45 @@
+"""
+Compare the shelter page extractors on saved pages.
+
+Run from the backend/ folder:
+python benchmarks/bench_extract.py [page.html ...]
+
+Without arguments, the fixture pages in tests/fixtures/ are used.
+"""
+import glob
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..')))
+
+from app.mymodules.extractors import EXTRACTORS  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures')
+
+
+def main(paths):
+    pages = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            pages.append(file.read())
+
+    # Every extractor must agree with the original one
+    reference = [EXTRACTORS['soup'](page) for page in pages]
+    for name, extract in EXTRACTORS.items():
+        assert [extract(page) for page in pages] == reference, name
+
+    print(f"{len(pages)} page(s), {sum(map(len, pages))} bytes")
+    timings = {}
+    for name, extract in EXTRACTORS.items():
+        runs, total = timeit.Timer(
+            lambda: [extract(page) for page in pages]).autorange()
+        timings[name] = total / runs / len(pages)
+    for name, seconds in timings.items():
+        speedup = timings['soup'] / seconds
+        print(f"{name:>6}: {seconds * 1e6:8.1f} us/page  ({speedup:.1f}x)")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or sorted(glob.glob(os.path.join(FIXTURES, '*.html'))))
@@ -1,22 +1,56 @@
+import asyncio
+import hashlib
+import json
 import os
 import sys
+import threading
 import pytest
 import pandas as pd
 import numpy as np
 
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Add the project root to the sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.main import app
+from app.main import app, shelter_store, geocoder
 
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock, mock_open, call
+from unittest.mock import patch, MagicMock, AsyncMock, mock_open, call
 import requests
+import httpx
 
-from app.mymodules.csv_cleaning import clean_csv1
+from app.mymodules.csv_cleaning import clean_csv1, clean_structures
+from app.mymodules.name_matching import NameMatcher, normalize_name
+from app.mymodules.merge_build import MergeBuilder
 from app.mymodules.scrape import main, process_url, scrape_shelter_details, scrape_shelter_urls
+from app.mymodules.scrape import parse_shelter_details, process_url_incremental, main_incremental
+from app.mymodules.scrape import BASE_URL, main_async, parse_listing_entries
+from app.mymodules.regions import RegionIndex
+from app.mymodules.scrape_pipeline import run_pipeline
+from app.mymodules.scrape_state import ScrapeState
+from app.mymodules.crawler import AsyncCrawler
+from app.mymodules.extractors import EXTRACTORS, extract_details_fast
+from app.mymodules.shelter_store import ShelterStore, load_shelter_dataset
+from app.mymodules.columnar import (StringColumn, columnar_path,
+                                    read_columnar, write_columnar)
+from app.mymodules.shelter_filters import ShelterColumns
+from app.mymodules.spatial_index import GridIndex
+from app.mymodules.suggest import PrefixIndex
+from app.mymodules.text_search import TextIndex, tokenize
+from app.mymodules.metrics import MetricsRegistry
+from app.mymodules.profiling import SamplingProfiler
+from app.mymodules.geo import haversine_km
+from app.mymodules.geocode_cache import GeocodeCache
+from app.mymodules.geocoder import AsyncGeocoder
+from app.mymodules.response_cache import ResponseCache
+from app.mymodules.jobs import JobRunner
+from app.mymodules.shards import ShardSet
+from app.mymodules.region_bounds import REGION_BOUNDS, BoundsIndex
+import app.main as backend_main
+from fastapi import HTTPException
+from haversine import haversine
 
 """
 Execute this test by running on the terminal (from the app/) the command:
@@ -30,11 +64,11 @@ from app.main import app
 
 client = TestClient(app)
 
-@patch('requests.get')
-def test_get_coordinates_exception(mock_get):
+@patch.object(geocoder, 'geocode', new_callable=AsyncMock)
+def test_get_coordinates_exception(mock_geocode):
     invalid_location = "InvalidLocation"
     range_km = "5"
-    mock_get.side_effect = requests.exceptions.RequestException("An error occurred")
+    mock_geocode.side_effect = httpx.ConnectError("An error occurred")
     response = client.get(f"/cleaned_csv_show?location={invalid_location}&range_km={range_km}")
     assert response.status_code == 200  # or another appropriate status code
     assert response.json() == {"error": "💀 Invalid location. Please re-enter a valid location."}
@@ -165,8 +199,135 @@ def test_clean_csv1_with_actual_data():
     assert 'CAMERE' in result.columns
     assert 'LETTI' in result.columns
     assert 'BAGNI' in result.columns
-    
-    
+
+
+
+def test_clean_structures_in_chunks():
+    file_path_regpie = 'app/regpie-RifugiOpenDa_2296-all.csv'
+    whole = clean_structures(file_path_regpie)
+    pd.testing.assert_frame_equal(
+        clean_structures(file_path_regpie, chunksize=50), whole)
+    assert list(whole.columns) == ['DENOMINAZIONE', 'PROVINCIA', 'COMUNE',
+                                   'INDIRIZZO', 'TELEFONO', 'CAMERE',
+                                   'LETTI', 'BAGNI']
+    assert whole['DENOMINAZIONE'].is_unique
+
+
+def test_clean_structures_rejects_missing_columns(tmp_path):
+    regpie = pd.read_csv('app/regpie-RifugiOpenDa_2296-all.csv', delimiter=';')
+    drifted = tmp_path / 'regpie.csv'
+    regpie.drop(columns=['CapacitRicettivapostiLetto']).to_csv(
+        drifted, sep=';', index=False)
+    with pytest.raises(ValueError, match='CAPACITRICETTIVAPOSTILETTO'):
+        clean_structures(str(drifted))
+
+
+def test_normalize_name():
+    assert normalize_name('Rifugio - Città di Luino [1630m]') == 'citta di luino'
+    assert normalize_name("CITTA' DI LUINO") == 'citta di luino'
+    assert normalize_name('Bivacco - Alpe Colma      [1728m]') == 'alpe colma'
+    assert normalize_name('Rifugio - La baita - Alpe Seccio [1409m]') == \
+        'la baita alpe seccio'
+
+
+def test_name_matcher_scores_best_match():
+    matcher = NameMatcher([
+        'Rifugio - Longarone [1200m]',
+        'Bivacco - Longa [2036m]',
+        'Rifugio - Crosta Pietro [1751m]',
+        'Rifugio - Zamboni-Zappa [2065m]',
+    ])
+    # An exact match beats an earlier name that merely contains the query
+    assert matcher.best_match('LONGA')[0] == 1
+    assert matcher.best_match('ZAMBONI ZAPPA')[0] == 3
+    # Swapped words are still similar enough
+    assert matcher.best_match('PIETRO CROSTA')[0] == 2
+    assert matcher.best_match('MONTE ROSA') == (None, 0.0)
+
+
+def make_merge_builder(tmp_path, shelters, on_build=None):
+    shelters.to_csv(tmp_path / 'mountain_shelters.csv', index=False)
+    return MergeBuilder('app/regpie-RifugiOpenDa_2296-all.csv',
+                        str(tmp_path / 'mountain_shelters.csv'),
+                        str(tmp_path / 'merged_data.csv'),
+                        on_build=on_build)
+
+
+def test_merge_builder_matches_clean_csv1(tmp_path):
+    builder = make_merge_builder(tmp_path,
+                                 pd.read_csv('app/mountain_shelters.csv'))
+    assert builder.is_stale()
+    assert builder.rebuild() == 166
+    pd.testing.assert_frame_equal(pd.read_csv(builder.output_path),
+                                  pd.read_csv('app/merged_data.csv'))
+    # Nothing to do while the inputs are unchanged
+    assert not builder.is_stale()
+    assert builder.rebuild() is None
+
+
+def test_merge_builder_rematches_only_affected_structures(tmp_path):
+    shelters = pd.read_csv('app/mountain_shelters.csv')
+    andolla = shelters['Name'].str.contains('Andolla')
+    builds = []
+    builder = make_merge_builder(tmp_path, shelters[~andolla],
+                                 on_build=builds.append)
+    builder.rebuild()
+    assert 'Rifugio - Andolla [2061m]' not in \
+        set(pd.read_csv(builder.output_path)['DENOMINAZIONE'])
+
+    # The scraper finds the missing shelter again
+    shelters.to_csv(builder.shelters_path, index=False)
+    assert builder.rebuild() == 1
+    assert 'Rifugio - Andolla [2061m]' in \
+        set(pd.read_csv(builder.output_path)['DENOMINAZIONE'])
+    assert builds == [builder.output_path] * 2
+    assert not os.path.exists(builder.output_path + '.tmp')
+
+
+def test_merge_builder_reads_regpie_in_chunks(tmp_path):
+    shelters = pd.read_csv('app/mountain_shelters.csv')
+    shelters.to_csv(tmp_path / 'mountain_shelters.csv', index=False)
+    builder = MergeBuilder('app/regpie-RifugiOpenDa_2296-all.csv',
+                           str(tmp_path / 'mountain_shelters.csv'),
+                           str(tmp_path / 'merged_data.csv'), chunksize=50)
+    with patch('app.mymodules.csv_cleaning.pd.read_csv',
+               wraps=pd.read_csv) as read_csv:
+        builder.rebuild()
+    assert {call.kwargs.get('chunksize') for call in read_csv.call_args_list
+            if call.kwargs.get('usecols')} == {50}
+    pd.testing.assert_frame_equal(pd.read_csv(builder.output_path),
+                                  pd.read_csv('app/merged_data.csv'))
+
+
+def test_merge_builder_reuses_cleaned_structures(tmp_path):
+    shelters = pd.read_csv('app/mountain_shelters.csv')
+    builder = make_merge_builder(tmp_path, shelters)
+    with patch('app.mymodules.merge_build.clean_structures',
+               wraps=clean_structures) as clean:
+        builder.rebuild()
+        # Only the shelters changed: the regpie file is not cleaned again
+        shelters.iloc[:-1].to_csv(builder.shelters_path, index=False)
+        assert builder.rebuild() is not None
+        assert clean.call_count == 1
+        builder.rebuild(force=True)
+        assert clean.call_count == 1
+
+
+def test_missing_merged_data_is_built_off_the_request_path(tmp_path):
+    builder = make_merge_builder(
+        tmp_path, pd.read_csv('app/mountain_shelters.csv'))
+    runner = JobRunner('merge', lambda progress: builder.rebuild())
+    with patch('app.main.MERGED_DATA_CSV_PATH', builder.output_path), \
+            patch('app.main.merge_job', runner):
+        with pytest.raises(HTTPException) as error:
+            backend_main.ensure_merged_data()
+        assert error.value.status_code == 503
+        runner.wait(30)
+        assert runner.last_success() is not None
+        assert os.path.exists(builder.output_path)
+        backend_main.ensure_merged_data()
+
+
 def test_scrape_shelter_urls_real_page():
     # Call the function in test mode
     urls = scrape_shelter_urls(test_mode=True)
@@ -274,4 +435,1120 @@ def test_process_url():
 
 #     # Clean up - remove the created CSV file
 #     if os.path.exists('backend/app/mountain_shelters.csv'):
-#         os.remove('backend/app/mountain_shelters.csv')
\ No newline at end of file
+#         os.remove('backend/app/mountain_shelters.csv')
+
+def test_shelter_store_serves_from_memory(tmp_path):
+    csv_path = tmp_path / 'merged_data.csv'
+    pd.read_csv('app/merged_data.csv').head(3).to_csv(csv_path, index=False)
+    store = ShelterStore(str(csv_path), check_interval=0)
+
+    first = store.load()
+    assert len(first.records) == 3
+    assert first.frame['LETTI'].dtype == np.int64
+    assert store.get() is first
+
+
+def test_shelter_store_reloads_on_mtime_change(tmp_path):
+    csv_path = tmp_path / 'merged_data.csv'
+    merged = pd.read_csv('app/merged_data.csv')
+    merged.head(3).to_csv(csv_path, index=False)
+    store = ShelterStore(str(csv_path), check_interval=0)
+    first = store.load()
+
+    merged.head(5).to_csv(csv_path, index=False)
+    os.utime(csv_path, (first.mtime + 10, first.mtime + 10))
+    second = store.get()
+    assert len(second.records) == 5
+    assert second.version == first.version + 1
+
+
+def test_shelter_store_reload_swaps_dataset(tmp_path):
+    csv_path = tmp_path / 'merged_data.csv'
+    merged = pd.read_csv('app/merged_data.csv')
+    merged.head(3).to_csv(csv_path, index=False)
+    store = ShelterStore(str(csv_path), check_interval=60)
+    first = store.load()
+
+    merged.head(4).to_csv(csv_path, index=False)
+    second = store.reload()
+    assert store.get() is second
+    assert len(second.records) == 4
+    assert second.version == first.version + 1
+
+
+def test_columnar_copy_loads_like_the_csv(tmp_path):
+    csv_path = str(tmp_path / 'merged_data.csv')
+    merged = pd.read_csv('app/merged_data.csv')
+    merged.to_csv(csv_path, index=False)
+    from_csv = load_shelter_dataset(csv_path)
+
+    write_columnar(merged, columnar_path(csv_path), source=csv_path)
+    arrays = read_columnar(columnar_path(csv_path), source=csv_path)
+    assert isinstance(arrays['Latitude'], np.memmap)
+    from_columns = load_shelter_dataset(csv_path)
+    pd.testing.assert_frame_equal(from_columns.frame, from_csv.frame)
+    assert from_columns.records == from_csv.records
+
+    # Text columns stay mapped too, and rows are only built when read
+    names = from_columns.data['DENOMINAZIONE']
+    assert isinstance(names, StringColumn)
+    assert isinstance(names.codes, np.memmap)
+    assert isinstance(names.table.blob, np.memmap)
+    first = from_columns.records[0]
+    first['DENOMINAZIONE'] = 'Changed'
+    assert from_columns.records[0] == from_csv.records[0]
+    assert from_columns.records[-1] == from_csv.records[len(merged) - 1]
+
+
+def test_columnar_copy_ignored_when_csv_changes(tmp_path):
+    csv_path = str(tmp_path / 'merged_data.csv')
+    merged = pd.read_csv('app/merged_data.csv')
+    merged.to_csv(csv_path, index=False)
+    write_columnar(merged, columnar_path(csv_path), source=csv_path)
+
+    merged.head(3).to_csv(csv_path, index=False)
+    assert read_columnar(columnar_path(csv_path), source=csv_path) is None
+    assert len(load_shelter_dataset(csv_path).records) == 3
+
+
+def test_distance_does_not_leak_into_store():
+    with patch('app.main.get_coordinates', new_callable=AsyncMock, return_value=(46.3, 8.26)):
+        response = client.get("/cleaned_csv_show?location=Baceno&range_km=20")
+    assert response.status_code == 200
+    assert 'Distance' in response.json()[0]
+    assert all('Distance' not in item for item in shelter_store.get().records)
+
+
+def test_letti_range_filter():
+    response = client.get("/cleaned_csv_show?min_letti=2&max_letti=4")
+    assert response.status_code == 200
+    data = response.json()
+    assert data
+    assert all(2 <= item['LETTI'] <= 4 for item in data)
+
+
+def test_min_camere_filter_with_provincia():
+    response = client.get("/cleaned_csv_show?min_camere=1&provincia=cuneo")
+    assert response.status_code == 200
+    assert all(item['CAMERE'] >= 1 and item['PROVINCIA'] == 'CUNEO'
+               for item in response.json())
+
+
+def test_shelter_columns_mask_matches_row_filter():
+    frame = pd.read_csv('app/merged_data.csv')
+    columns = ShelterColumns(frame)
+    mask = columns.mask(equal={'BAGNI': '19'}, text={'COMUNE': 'entracque'})
+    expected = ((frame['BAGNI'] == 19)
+                & (frame['COMUNE'].str.lower() == 'entracque')).to_numpy()
+    assert (mask == expected).all()
+    assert not columns.mask(equal={'LETTI': 'abc'}).any()
+
+
+def test_grid_index_within_matches_haversine():
+    frame = pd.read_csv('app/merged_data.csv')
+    index = GridIndex(frame['Latitude'], frame['Longitude'])
+    origin = (45.07, 7.69)
+
+    indices, distances = index.within(*origin, 60)
+    expected = [i for i, row in frame.iterrows()
+                if haversine(origin, (row['Latitude'], row['Longitude'])) <= 60]
+    assert indices.tolist() == expected
+    assert np.allclose(distances, [
+        haversine(origin, (frame['Latitude'][i], frame['Longitude'][i]))
+        for i in expected])
+
+
+def test_grid_index_nearest():
+    frame = pd.read_csv('app/merged_data.csv')
+    index = GridIndex(frame['Latitude'], frame['Longitude'])
+    origin = (44.5, 7.3)
+    all_distances = [haversine(origin, (lat, lng)) for lat, lng
+                     in zip(frame['Latitude'], frame['Longitude'])]
+
+    indices, distances = index.nearest(*origin, 5)
+    assert indices.tolist() == list(np.argsort(all_distances, kind='stable')[:5])
+    assert list(distances) == sorted(distances)
+
+
+def test_nearest_filter():
+    with patch('app.main.get_coordinates', new_callable=AsyncMock, return_value=(46.3, 8.26)):
+        response = client.get("/cleaned_csv_show?location=Baceno&nearest=3")
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+
+
+@pytest.mark.parametrize('nearest', [0, -1])
+def test_nearest_must_be_positive(nearest):
+    with patch('app.main.get_coordinates', new_callable=AsyncMock, return_value=(46.3, 8.26)):
+        response = client.get(f"/cleaned_csv_show?location=Baceno&nearest={nearest}")
+    assert response.status_code == 422
+
+
+def test_location_results_sorted_by_distance():
+    with patch('app.main.get_coordinates', new_callable=AsyncMock, return_value=(45.07, 7.69)):
+        response = client.get("/cleaned_csv_show?location=Torino&range_km=100")
+    data = response.json()
+    assert data
+    distances = [item['Distance_km'] for item in data]
+    assert distances == sorted(distances)
+    assert all(distance <= 100 for distance in distances)
+
+
+def test_location_limit_offset():
+    with patch('app.main.get_coordinates', new_callable=AsyncMock, return_value=(45.07, 7.69)):
+        full = client.get("/cleaned_csv_show?location=Torino").json()
+        page = client.get(
+            "/cleaned_csv_show?location=Torino&limit=5&offset=2").json()
+    assert len(full) == len(shelter_store.get().records)
+    assert page == full[2:7]
+
+
+def test_haversine_km_matches_haversine():
+    lats = np.array([45.0, 46.32034, 44.1])
+    lngs = np.array([7.0, 8.26158, 7.9])
+    expected = [haversine((45.5, 7.5), point) for point in zip(lats, lngs)]
+    assert np.allclose(haversine_km(45.5, 7.5, lats, lngs), expected)
+
+
+def make_geocoding_stub(calls, status='OK', lat=45.07, lng=7.69):
+    """Build a local transport that answers like the Geocoding API."""
+    async def handler(request):
+        calls.append(request.url.params['address'])
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={
+            'status': status,
+            'results': [{'geometry': {'location': {'lat': lat, 'lng': lng}}}],
+        })
+    return httpx.MockTransport(handler)
+
+
+def test_geocode_cache_hits_skip_the_api():
+    calls = []
+    stub_geocoder = AsyncGeocoder('http://geocoder.test/json', 'key',
+                                  cache=GeocodeCache(),
+                                  transport=make_geocoding_stub(calls))
+
+    async def run():
+        first = await stub_geocoder.get_coordinates('Torino')
+        second = await stub_geocoder.get_coordinates('  TORINO, ')
+        await stub_geocoder.aclose()
+        return first, second
+
+    assert asyncio.run(run()) == ((45.07, 7.69), (45.07, 7.69))
+    assert calls == ['Torino']
+
+
+def test_geocoder_coalesces_concurrent_lookups():
+    calls = []
+    stub_geocoder = AsyncGeocoder('http://geocoder.test/json', 'key',
+                                  transport=make_geocoding_stub(calls))
+
+    async def run():
+        results = await asyncio.gather(*[
+            stub_geocoder.get_coordinates('Cuneo') for _ in range(5)])
+        await stub_geocoder.aclose()
+        return results
+
+    assert asyncio.run(run()) == [(45.07, 7.69)] * 5
+    assert calls == ['Cuneo']
+
+
+def test_geocoder_caches_not_found_addresses():
+    calls = []
+    cache = GeocodeCache()
+    stub_geocoder = AsyncGeocoder('http://geocoder.test/json', 'key',
+                                  cache=cache,
+                                  transport=make_geocoding_stub(
+                                      calls, status='ZERO_RESULTS'))
+    assert asyncio.run(stub_geocoder.get_coordinates('Nowhere')) == (None, None)
+    assert cache.get('nowhere') == (True, None)
+
+
+@pytest.mark.parametrize('status', [
+    'OVER_QUERY_LIMIT', 'REQUEST_DENIED', 'UNKNOWN_ERROR', 'INVALID_REQUEST'])
+def test_geocoder_does_not_cache_api_errors(status):
+    calls = []
+    cache = GeocodeCache()
+    stub_geocoder = AsyncGeocoder('http://geocoder.test/json', 'key',
+                                  cache=cache,
+                                  transport=make_geocoding_stub(
+                                      calls, status=status))
+
+    async def run():
+        first = await stub_geocoder.get_coordinates('Torino')
+        second = await stub_geocoder.get_coordinates('Torino')
+        await stub_geocoder.aclose()
+        return first, second
+
+    assert asyncio.run(run()) == ((None, None), (None, None))
+    # Both lookups reached the API, nothing was cached
+    assert calls == ['Torino', 'Torino']
+    assert cache.get('torino') == (False, None)
+    assert stub_geocoder.api_calls.value(outcome='error') == 2
+
+
+@pytest.mark.parametrize('reply', [
+    b'not json', b'{}', b'[]', b'{"status": "OK", "results": []}',
+    b'{"status": "OK", "results": [{"geometry": {}}]}'])
+def test_geocoder_handles_malformed_replies(reply):
+    cache = GeocodeCache()
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=reply))
+    stub_geocoder = AsyncGeocoder('http://geocoder.test/json', 'key',
+                                  cache=cache, transport=transport)
+    assert asyncio.run(stub_geocoder.get_coordinates('Torino')) == \
+        (None, None)
+    assert cache.get('torino') == (False, None)
+
+
+def test_geocode_cache_negative_entries_expire():
+    now = [1000.0]
+    cache = GeocodeCache(negative_ttl=60, clock=lambda: now[0])
+    cache.set('Nowhere', None)
+    assert cache.get('nowhere') == (True, None)
+    now[0] += 61
+    assert cache.get('nowhere') == (False, None)
+
+
+def test_geocode_cache_lru_eviction():
+    cache = GeocodeCache(max_size=2)
+    cache.set('a', (1.0, 1.0))
+    cache.set('b', (2.0, 2.0))
+    cache.get('a')
+    cache.set('c', (3.0, 3.0))
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, (1.0, 1.0))
+
+
+def test_geocode_cache_persists_in_sqlite(tmp_path):
+    db_path = str(tmp_path / 'geocode.sqlite3')
+    GeocodeCache(db_path=db_path).set('Cuneo', (44.39, 7.55))
+    assert GeocodeCache(db_path=db_path).get('cuneo') == (True, (44.39, 7.55))
+
+
+def test_listing_etag_and_not_modified():
+    first = client.get("/cleaned_csv_show")
+    etag = first.headers['ETag']
+    assert first.headers['Content-Encoding'] == 'gzip'
+
+    second = client.get("/cleaned_csv_show", headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.content == b''
+
+
+def test_response_cache_serializes_once_per_version():
+    cache = ResponseCache()
+    key = cache.key({'provincia': 'CUNEO', 'bagni': None})
+    cached = cache.put(1, key, [{'a': 1}])
+    assert cache.get(1, key) is cached
+    assert cache.get(2, key) is None
+    assert json.loads(cached.body) == [{'a': 1}]
+
+
+def test_fields_projection():
+    response = client.get("/cleaned_csv_show?fields=DENOMINAZIONE,LETTI&limit=3")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 3
+    assert all(set(item) == {'DENOMINAZIONE', 'LETTI'} for item in data)
+
+
+def test_unknown_field_is_rejected():
+    response = client.get("/cleaned_csv_show?fields=DENOMINAZIONE,Foo")
+    assert response.status_code == 400
+
+
+def test_summary_mode_leaves_out_descriptions():
+    with patch('app.main.get_coordinates', new_callable=AsyncMock, return_value=(45.07, 7.69)):
+        response = client.get("/cleaned_csv_show?location=Torino&range_km=50&summary=true")
+    data = response.json()
+    assert data
+    assert all('Description' not in item and 'Distance_km' in item
+               for item in data)
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as file:
+        return file.read()
+
+
+class StubShelterSite:
+    """Local HTTP server serving fixture shelter pages, with ETag support."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append((self.path, self.headers.get('If-None-Match')))
+                body = site.pages.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_site():
+    site = StubShelterSite({
+        '/rifugi-bivacchi/andolla': read_fixture('shelter_piemonte.html'),
+        '/rifugi-bivacchi/neuve': read_fixture('shelter_valle_aosta.html'),
+    })
+    yield site
+    site.close()
+
+
+def test_parse_shelter_details_fixture():
+    details = parse_shelter_details(read_fixture('shelter_piemonte.html'))
+    assert details['Name'] == 'Rifugio - Andolla [2061m]'
+    assert details['Region'] == 'Piemonte'
+    assert (details['Latitude'], details['Longitude']) == ('46.0898', '8.0526')
+
+
+def test_process_url_incremental_uses_conditional_requests(stub_site, tmp_path):
+    state = ScrapeState(str(tmp_path / 'state.sqlite3'))
+    url = stub_site.url + '/rifugi-bivacchi/andolla'
+
+    first = process_url_incremental(url, state)
+    assert first['Region'] == 'Piemonte'
+    with patch('app.mymodules.scrape.parse_shelter_details') as mock_parse:
+        second = process_url_incremental(url, state)
+    mock_parse.assert_not_called()
+    assert second == first
+    assert stub_site.requests[0][1] is None
+    assert stub_site.requests[1][1] == state.get(url).etag
+
+
+def test_main_incremental_resumes_interrupted_run(stub_site, tmp_path):
+    urls = [stub_site.url + '/rifugi-bivacchi/andolla',
+            stub_site.url + '/rifugi-bivacchi/neuve']
+    state_path = str(tmp_path / 'state.sqlite3')
+    csv_file = str(tmp_path / 'mountain_shelters.csv')
+
+    # An interrupted run that only got to the first page
+    state = ScrapeState(state_path)
+    run_started_at = state.start_run()
+    process_url_incremental(urls[0], state, run_started_at=run_started_at)
+    state.close()
+
+    with patch('app.mymodules.scrape.scrape_shelter_urls', return_value=urls):
+        main_incremental(state_path=state_path, csv_file=csv_file,
+                         region_index_file=str(tmp_path / 'urls_regions.csv'))
+
+    assert [path for path, _ in stub_site.requests] == [
+        '/rifugi-bivacchi/andolla', '/rifugi-bivacchi/neuve']
+    shelters = pd.read_csv(csv_file)
+    assert shelters['Name'].tolist() == ['Rifugio - Andolla [2061m]']
+
+
+def make_listing_page(urls, total_pages=3, regions=None):
+    regions = regions or {}
+    links = ''.join(f'<div class="card"><div class="profile-name"><a href="{url}">{url}</a></div>'
+                    f'<span>{regions.get(url) or ""}</span></div>'
+                    for url in urls)
+    numbers = ''.join(f'<a class="page-numbers" href="#">{page}</a>'
+                      for page in range(1, total_pages + 1))
+    return f'<html><body>{links}{numbers}<a class="page-numbers">Next</a></body></html>'
+
+
+def test_crawler_retries_with_backoff():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url)
+        if len(attempts) < 3:
+            return httpx.Response(503)
+        return httpx.Response(200, text='ok')
+
+    async def run():
+        async with AsyncCrawler(backoff=0, per_host_rate=None,
+                                transport=httpx.MockTransport(handler)) as crawler:
+            return await crawler.fetch('http://stub.test/page')
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    assert len(attempts) == 3
+
+
+def test_main_async_streams_piemonte_shelters(tmp_path):
+    detail_pages = {
+        'http://stub.test/rifugi-bivacchi/andolla': read_fixture('shelter_piemonte.html'),
+        'http://stub.test/rifugi-bivacchi/neuve': read_fixture('shelter_valle_aosta.html'),
+    }
+    listing = {
+        BASE_URL: make_listing_page(['http://stub.test/rifugi-bivacchi/andolla']),
+        BASE_URL + 'page/2/': make_listing_page([]),
+        BASE_URL + 'page/3/': make_listing_page(['http://stub.test/rifugi-bivacchi/neuve']),
+    }
+
+    def handler(request):
+        url = str(request.url)
+        if url in listing:
+            return httpx.Response(200, text=listing[url])
+        return httpx.Response(200, content=detail_pages[url])
+
+    cache_file = str(tmp_path / 'urls_cache.txt')
+    csv_file = str(tmp_path / 'mountain_shelters.csv')
+
+    async def run():
+        async with AsyncCrawler(per_host_rate=None,
+                                transport=httpx.MockTransport(handler)) as crawler:
+            await main_async(csv_file=csv_file, crawler=crawler,
+                             cache_file=cache_file,
+                             region_index_file=str(tmp_path / 'urls_regions.csv'),
+                             parsers=2)
+
+    asyncio.run(run())
+    with open(cache_file) as file:
+        assert file.read().splitlines() == list(detail_pages)
+    shelters = pd.read_csv(csv_file)
+    assert shelters['Name'].tolist() == ['Rifugio - Andolla [2061m]']
+
+
+def test_main_async_incremental_resumes_and_revalidates(tmp_path):
+    andolla = 'http://stub.test/rifugi-bivacchi/andolla'
+    neuve = 'http://stub.test/rifugi-bivacchi/neuve'
+    pages = {andolla: read_fixture('shelter_piemonte.html'),
+             neuve: read_fixture('shelter_valle_aosta.html')}
+    cache_file = tmp_path / 'urls_cache.txt'
+    cache_file.write_text(f'{andolla}\n{neuve}\n')
+    state_path = str(tmp_path / 'state.sqlite3')
+    csv_file = str(tmp_path / 'mountain_shelters.csv')
+    etags = {url: '"' + hashlib.md5(page).hexdigest() + '"'
+             for url, page in pages.items()}
+    requests_seen = []
+
+    def handler(request):
+        url = str(request.url)
+        etag = etags[url]
+        requests_seen.append((url, request.headers.get('If-None-Match')))
+        if request.headers.get('If-None-Match') == etag:
+            return httpx.Response(304)
+        return httpx.Response(200, content=pages[url],
+                              headers={'ETag': etag})
+
+    def run():
+        async def scrape():
+            async with AsyncCrawler(per_host_rate=None,
+                                    transport=httpx.MockTransport(handler)) as crawler:
+                await main_async(csv_file=csv_file, crawler=crawler,
+                                 cache_file=str(cache_file),
+                                 region_index_file=str(tmp_path / 'urls_regions.csv'),
+                                 executor=executor, state_path=state_path)
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                patch('app.mymodules.scrape.parse_shelter_details',
+                      wraps=parse_shelter_details) as parse:
+            asyncio.run(scrape())
+        return pd.read_csv(csv_file)['Name'].tolist(), parse.call_count
+
+    # An interrupted run that only got to the first page
+    state = ScrapeState(state_path)
+    state.start_run()
+    state.save(andolla, etags[andolla], None,
+               hashlib.sha256(pages[andolla]).hexdigest(),
+               parse_shelter_details(pages[andolla]))
+    state.close()
+
+    assert run() == (['Rifugio - Andolla [2061m]'], 1)
+    assert requests_seen == [(neuve, None)]
+
+    # The next run skips the Valle d'Aosta page, now known, and
+    # revalidates the other one without parsing it again
+    requests_seen.clear()
+    assert run() == (['Rifugio - Andolla [2061m]'], 0)
+    assert requests_seen == [(andolla, etags[andolla])]
+
+
+def test_main_async_fails_when_a_listing_page_fails(tmp_path):
+    listing = {
+        BASE_URL: make_listing_page(['http://stub.test/rifugi-bivacchi/andolla']),
+        BASE_URL + 'page/3/': make_listing_page(['http://stub.test/rifugi-bivacchi/neuve']),
+    }
+    fetched = []
+
+    def handler(request):
+        fetched.append(str(request.url))
+        if str(request.url) in listing:
+            return httpx.Response(200, text=listing[str(request.url)])
+        return httpx.Response(500)
+
+    cache_file = tmp_path / 'urls_cache.txt'
+    csv_file = tmp_path / 'mountain_shelters.csv'
+
+    async def run():
+        async with AsyncCrawler(retries=0, per_host_rate=None,
+                                transport=httpx.MockTransport(handler)) as crawler:
+            await main_async(csv_file=str(csv_file), crawler=crawler,
+                             cache_file=str(cache_file),
+                             region_index_file=str(tmp_path / 'urls_regions.csv'))
+
+    with pytest.raises(RuntimeError, match='page/2/'):
+        asyncio.run(run())
+    # No detail page is fetched, and neither file is written
+    assert sorted(fetched) == [BASE_URL, BASE_URL + 'page/2/',
+                               BASE_URL + 'page/3/']
+    assert not cache_file.exists()
+    assert not csv_file.exists()
+
+
+@pytest.mark.parametrize('fixture', ['shelter_piemonte.html', 'shelter_valle_aosta.html'])
+def test_extractors_agree(fixture):
+    page = read_fixture(fixture)
+    expected = EXTRACTORS['soup'](page)
+    assert extract_details_fast(page) == expected
+    assert extract_details_fast(page, parser='html.parser') == expected
+
+
+def test_fast_extractor_handles_missing_fields():
+    details = extract_details_fast(b'<html><body><p>Nothing here</p></body></html>')
+    assert details['Name'] == 'Name not found'
+    assert details['Latitude'] == 'Coords not found'
+
+
+def test_parse_listing_entries_reads_card_regions():
+    page = make_listing_page(['http://stub.test/a', 'http://stub.test/b'],
+                             regions={'http://stub.test/a': "Valle d'Aosta"})
+    assert parse_listing_entries(page) == [
+        ('http://stub.test/a', "Valle d'Aosta"), ('http://stub.test/b', None)]
+
+
+def test_parse_listing_entries_ignores_regions_in_names_and_text():
+    page = '''
+    <div class="list">
+      <div class="card">
+        <div class="profile-name"><a href="http://stub.test/a">Rifugio Marche</a></div>
+        <p>Dal confine con la Lombardia si sale verso le Marche.</p>
+        <span class="location">Cuneo, Piemonte</span>
+      </div>
+      <div class="card">
+        <div class="profile-name"><a href="http://stub.test/b">Rifugio Veneto</a></div>
+        <div class="descrizione">Vista sul Veneto</div>
+      </div>
+      <div class="card">
+        <div class="profile-name"><a href="http://stub.test/c">Bivacco</a></div>
+        <span>Piemonte</span><span>Liguria</span>
+      </div>
+    </div>'''
+    # Only the location field counts, and an unclear region is unknown
+    assert parse_listing_entries(page) == [
+        ('http://stub.test/a', 'Piemonte'), ('http://stub.test/b', None),
+        ('http://stub.test/c', None)]
+    index = RegionIndex()
+    for url, region in parse_listing_entries(page):
+        index.learn(url, region)
+    assert index.select(['http://stub.test/b', 'http://stub.test/c'],
+                        {'Piemonte'}) == [
+        'http://stub.test/b', 'http://stub.test/c']
+
+
+def test_region_index_selects_target_and_unknown_urls(tmp_path):
+    index = RegionIndex(str(tmp_path / 'urls_regions.csv'))
+    index.learn('http://stub.test/a', 'piemonte')
+    index.learn('http://stub.test/b', 'Lombardia')
+    index.learn('http://stub.test/c', 'Region not found')
+    index.save()
+
+    loaded = RegionIndex.load(index.path)
+    urls = ['http://stub.test/a', 'http://stub.test/b', 'http://stub.test/c']
+    assert loaded.select(urls, {'Piemonte'}) == ['http://stub.test/a', 'http://stub.test/c']
+    assert loaded.select(urls, {'Piemonte', 'Lombardia'}) == urls
+
+
+def test_main_async_skips_pages_of_other_regions(tmp_path):
+    andolla = 'http://stub.test/rifugi-bivacchi/andolla'
+    neuve = 'http://stub.test/rifugi-bivacchi/neuve'
+    listing = make_listing_page([andolla, neuve], total_pages=1,
+                                regions={neuve: "Valle d'Aosta"})
+    fetched = []
+
+    def handler(request):
+        fetched.append(str(request.url))
+        if str(request.url) == BASE_URL:
+            return httpx.Response(200, text=listing)
+        return httpx.Response(200, content=read_fixture('shelter_piemonte.html'))
+
+    async def run():
+        async with AsyncCrawler(per_host_rate=None,
+                                transport=httpx.MockTransport(handler)) as crawler:
+            await main_async(csv_file=str(tmp_path / 'shelters.csv'),
+                             crawler=crawler,
+                             cache_file=str(tmp_path / 'urls_cache.txt'),
+                             region_index_file=str(tmp_path / 'urls_regions.csv'))
+
+    asyncio.run(run())
+    assert fetched == [BASE_URL, andolla]
+    index = RegionIndex.load(str(tmp_path / 'urls_regions.csv'))
+    assert index.regions == {andolla: 'Piemonte', neuve: "Valle d'Aosta"}
+
+
+def test_pipeline_parses_in_process_pool_with_backpressure():
+    pages = {f'http://stub.test/rifugi-bivacchi/{i}': read_fixture('shelter_piemonte.html')
+             for i in range(12)}
+    fetched, results = [], {}
+
+    def handler(request):
+        fetched.append(str(request.url))
+        return httpx.Response(200, content=pages[str(request.url)])
+
+    async def run():
+        async with AsyncCrawler(per_host_rate=None,
+                                transport=httpx.MockTransport(handler)) as crawler:
+            with ProcessPoolExecutor(max_workers=2) as pool:
+                await run_pipeline(list(pages), crawler, parse_shelter_details,
+                                   lambda url, details: results.update({url: details}),
+                                   fetchers=3, parsers=2, queue_size=2,
+                                   executor=pool)
+
+    asyncio.run(run())
+    assert sorted(fetched) == sorted(pages)
+    assert set(results) == set(pages)
+    assert all(details['Name'] == 'Rifugio - Andolla [2061m]'
+               for details in results.values())
+
+
+def test_pipeline_stops_fetching_when_a_result_fails():
+    fetched = []
+
+    def handler(request):
+        fetched.append(str(request.url))
+        return httpx.Response(200, content=b'page')
+
+    def on_result(url, result):
+        raise RuntimeError('disk full')
+
+    async def run():
+        async with AsyncCrawler(per_host_rate=None,
+                                transport=httpx.MockTransport(handler)) as crawler:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                await asyncio.wait_for(run_pipeline(
+                    [f'http://stub.test/{i}' for i in range(100)], crawler,
+                    len, on_result, fetchers=3, parsers=1, queue_size=1,
+                    executor=pool), 5)
+
+    with pytest.raises(RuntimeError, match='disk full'):
+        asyncio.run(run())
+    assert len(fetched) < 100
+
+
+def test_pipeline_spawns_its_parser_processes():
+    async def run():
+        crawler = MagicMock()
+        crawler.fetch = AsyncMock(return_value=httpx.Response(
+            200, content=b'page', request=httpx.Request('GET', 'http://stub.test/')))
+        results = {}
+        await run_pipeline(['http://stub.test/'], crawler, len,
+                           lambda url, result: results.update({url: result}),
+                           parsers=1)
+        return results
+
+    with patch('app.mymodules.scrape_pipeline.ProcessPoolExecutor',
+               wraps=ProcessPoolExecutor) as pool_class:
+        assert asyncio.run(run()) == {'http://stub.test/': 4}
+    assert pool_class.call_args.kwargs['mp_context'].get_start_method() == 'spawn'
+
+
+def test_job_runner_is_single_flight():
+    release = threading.Event()
+
+    def work(progress):
+        progress(1, 2, 'halfway')
+        release.wait(5)
+
+    runner = JobRunner('test', work)
+    job, started = runner.trigger('admin')
+    again, started_again = runner.trigger('scheduled')
+    assert started and not started_again
+    assert again is job
+    release.set()
+    runner.wait(5)
+
+    assert runner.current() is None
+    assert [j.status for j in runner.history()] == ['succeeded']
+    assert (job.done, job.total, job.message) == (1, 2, 'halfway')
+    assert runner.last_success() is job
+
+
+def test_job_runner_records_failures():
+    def work(progress):
+        raise RuntimeError('listing page unreachable')
+
+    runner = JobRunner('test', work)
+    job, _ = runner.trigger()
+    runner.wait(5)
+    assert job.status == 'failed'
+    assert job.error == 'listing page unreachable'
+    assert runner.get(job.id) is job
+
+
+def test_admin_scrape_endpoints():
+    release = threading.Event()
+    runner = JobRunner('scrape', lambda progress: release.wait(5))
+    with patch('app.main.scrape_job', runner), \
+            patch('app.main.ADMIN_TOKEN', 'secret'):
+        assert client.post('/admin/scrape').status_code == 401
+        headers = {'X-Admin-Token': 'secret'}
+        first = client.post('/admin/scrape', headers=headers).json()
+        second = client.post('/admin/scrape', headers=headers).json()
+        assert first['started'] and not second['started']
+        assert second['job']['id'] == first['job']['id']
+        jobs = client.get('/admin/jobs', headers=headers).json()
+        assert jobs['current']['status'] == 'running'
+
+        release.set()
+        runner.wait(5)
+        job = client.get(f"/admin/jobs/{first['job']['id']}",
+                         headers=headers).json()
+        assert job['status'] == 'succeeded'
+        assert client.get('/admin/jobs/999', headers=headers).status_code == 404
+
+    with patch('app.main.ADMIN_TOKEN', None):
+        assert client.post('/admin/scrape').status_code == 403
+
+
+def test_failed_scrape_keeps_last_good_file(tmp_path):
+    shelters_path = tmp_path / 'mountain_shelters.csv'
+    shelters_path.write_text('Name,Description,Region,Latitude,Longitude\n'
+                             'Rifugio - Andolla [2061m],,Piemonte,46.09,8.05\n')
+    urls_path = tmp_path / 'urls.txt'
+    urls_path.write_text('https://example.com/rifugio-andolla\n')
+
+    async def scrape_nothing(csv_file, cache_file, **kwargs):
+        assert cache_file != str(urls_path)
+        with open(cache_file, 'w') as file:
+            file.write('https://example.com/other\n')
+        with open(csv_file, 'w') as file:
+            file.write('Name,Description,Region,Latitude,Longitude\n')
+
+    async def scrape_and_fail(csv_file, cache_file, **kwargs):
+        with open(csv_file, 'w') as file:
+            file.write('Name,Description,Region,Latitude,Longitude\n')
+        raise OSError('Connection lost')
+
+    with patch('app.main.SHELTERS_CSV_PATH', str(shelters_path)), \
+            patch('app.main.URLS_CACHE_PATH', str(urls_path)):
+        for scrape, error in [(scrape_nothing, RuntimeError),
+                              (scrape_and_fail, OSError)]:
+            with patch('app.main.main_async', scrape), \
+                    pytest.raises(error):
+                backend_main.scrape_shelters(lambda *args, **kwargs: None)
+            assert 'Andolla' in shelters_path.read_text()
+            assert 'andolla' in urls_path.read_text()
+            assert sorted(os.listdir(tmp_path)) == [
+                'mountain_shelters.csv', 'urls.txt']
+
+
+def test_scrape_replaces_url_cache_on_success(tmp_path):
+    shelters_path = tmp_path / 'mountain_shelters.csv'
+    urls_path = tmp_path / 'urls.txt'
+    urls_path.write_text('https://example.com/old\n')
+
+    async def scrape(csv_file, cache_file, **kwargs):
+        with open(cache_file, 'w') as file:
+            file.write('https://example.com/rifugio-andolla\n')
+        with open(csv_file, 'w') as file:
+            file.write('Name,Description,Region,Latitude,Longitude\n'
+                       'Rifugio - Andolla [2061m],,Piemonte,46.09,8.05\n')
+
+    with patch('app.main.SHELTERS_CSV_PATH', str(shelters_path)), \
+            patch('app.main.URLS_CACHE_PATH', str(urls_path)), \
+            patch('app.main.main_async', scrape), \
+            patch.object(backend_main.merge_builder, 'rebuild') as rebuild:
+        backend_main.scrape_shelters(lambda *args, **kwargs: None)
+    rebuild.assert_called_once()
+    assert 'Andolla' in shelters_path.read_text()
+    assert urls_path.read_text() == 'https://example.com/rifugio-andolla\n'
+    assert sorted(os.listdir(tmp_path)) == ['mountain_shelters.csv',
+                                            'urls.txt']
+
+
+def make_split_shards(tmp_path):
+    """One shard for Cuneo, one for the rest of the merged data."""
+    merged = pd.read_csv('app/merged_data.csv')
+    cuneo = merged['PROVINCIA'] == 'CUNEO'
+    stores = {}
+    for region, part in [('Sud', merged[cuneo]), ('Nord', merged[~cuneo])]:
+        path = tmp_path / f'{region}.csv'
+        part.to_csv(path, index=False)
+        stores[region] = ShelterStore(str(path))
+    single_path = tmp_path / 'all.csv'
+    merged.to_csv(single_path, index=False)
+    return (ShardSet(stores).load(),
+            ShardSet({'Piemonte': ShelterStore(str(single_path))}).load())
+
+
+def test_shards_route_by_province_and_circle(tmp_path):
+    sharded, _ = make_split_shards(tmp_path)
+    assert [s.region for s in sharded.route(provincia='cuneo')] == ['Sud']
+    assert [s.region for s in sharded.route(comune='entracque')] == ['Sud']
+    assert sharded.route(provincia='milano') == []
+    # 20 km around Domodossola only reaches the northern shard
+    assert [s.region for s in sharded.route(
+        lat=46.116, lng=8.292, range_km=20)] == ['Nord']
+    assert len(sharded.route(lat=45.07, lng=7.69, range_km=500)) == 2
+
+
+def test_sharded_search_matches_single_dataset(tmp_path):
+    sharded, single = make_split_shards(tmp_path)
+    queries = [
+        dict(user_lat=45.07, user_lng=7.69, nearest=10),
+        dict(user_lat=44.3, user_lng=7.3, range_km=40, min_letti=1),
+        dict(provincia='cuneo', min_camere=1),
+        dict(bagni='19'),
+    ]
+    for query in queries:
+        result = backend_main.search_shelters(sharded, **query)
+        expected = backend_main.search_shelters(single, **query)
+        if 'user_lat' in query:
+            assert result == expected
+        else:
+            # Without a location, results keep the shard order
+            assert sorted(map(json.dumps, result)) == \
+                sorted(map(json.dumps, expected))
+
+
+def test_bounds_index_locates_regions_offline():
+    regions = BoundsIndex(REGION_BOUNDS)
+    assert regions.locate(45.07, 7.69) == ['Piemonte']
+    assert regions.locate(41.9, 12.5) == ['Lazio']
+    assert regions.locate(48.85, 2.35) == []
+    assert regions.contains("Valle d'Aosta", 45.74, 7.32)
+
+
+def test_bounds_index_from_shelter_points():
+    merged = pd.read_csv('app/merged_data.csv')
+    provinces = BoundsIndex.from_points(
+        merged['PROVINCIA'], merged['Latitude'], merged['Longitude'],
+        margin_km=10)
+    assert provinces.locate(44.39, 7.82) == ['CUNEO']
+    # Entracque is also in the box of Torino, which is larger
+    assert provinces.locate(44.24, 7.40) == ['CUNEO', 'TORINO']
+    assert provinces.locate(41.9, 12.5) == []
+
+
+@pytest.mark.parametrize('location, coordinates', [
+    ('Roma', (41.9, 12.5)),
+    ('Aosta', (45.737, 7.315)),
+    ('Milano', (45.464, 9.190)),
+    ('Genova', (44.405, 8.946)),
+    ('Lugano', (46.004, 8.951)),
+])
+def test_location_outside_covered_regions_is_rejected(location, coordinates):
+    with patch('app.main.get_coordinates', new_callable=AsyncMock, return_value=coordinates):
+        response = client.get(f"/cleaned_csv_show?location={location}&range_km=50")
+    assert response.status_code == 200
+    assert 'outside the covered regions (Piemonte)' in response.json()['error']
+
+
+def test_piemonte_outline_contains_its_towns_and_shelters():
+    sharded = backend_main.shard_set.get()
+    towns = [(45.070, 7.687), (44.384, 7.543), (45.446, 8.622),
+             (45.921, 8.551), (46.116, 8.292), (44.913, 8.615),
+             (44.896, 8.864), (45.080, 6.700), (45.858, 7.937)]
+    merged = pd.read_csv('app/merged_data.csv')
+    towns += list(zip(merged['Latitude'], merged['Longitude']))
+    assert all(sharded.regions_at(lat, lng) == ['Piemonte']
+               for lat, lng in towns)
+
+
+def test_prefix_index_suggests_word_prefixes():
+    index = PrefixIndex([
+        ('COMUNE', 'ENTRACQUE'), ('COMUNE', 'ENTRACQUE'),
+        ('PROVINCIA', 'CUNEO'),
+        ('DENOMINAZIONE', 'Rifugio - Città di Arona [1750m]'),
+        ('DENOMINAZIONE', 'Bivacco - Città di Luino [3562m]'),
+    ])
+    assert index.suggest('entr') == [
+        {'field': 'COMUNE', 'value': 'ENTRACQUE', 'count': 2}]
+    # Accents and case are ignored, values starting with the text first
+    assert [s['value'] for s in index.suggest('CITTA')] == [
+        'Bivacco - Città di Luino [3562m]',
+        'Rifugio - Città di Arona [1750m]']
+    assert [s['value'] for s in index.suggest('bi')] == [
+        'Bivacco - Città di Luino [3562m]']
+    assert index.suggest('c', fields={'PROVINCIA'}) == [
+        {'field': 'PROVINCIA', 'value': 'CUNEO', 'count': 1}]
+    assert index.suggest('c', limit=1)[0]['value'] == 'CUNEO'
+    assert index.suggest('zz') == []
+    assert index.suggest(' - ') == []
+
+
+def test_suggest_endpoint():
+    response = client.get('/suggest?q=entr')
+    assert response.status_code == 200
+    assert {'field': 'COMUNE', 'value': 'ENTRACQUE', 'count': 4} in \
+        response.json()
+    response = client.get('/suggest?q=cu&field=provincia&limit=5')
+    suggestions = response.json()
+    assert suggestions[0] == {'field': 'PROVINCIA', 'value': 'CUNEO',
+                              'count': 18}
+    assert {s['field'] for s in suggestions} == {'PROVINCIA'}
+    assert client.get('/suggest?q=cu&field=INDIRIZZO').status_code == 400
+    assert client.get('/suggest?q=').status_code == 422
+
+
+def test_tokenize_folds_accents_and_drops_stopwords():
+    assert tokenize("Dal parcheggio dell’Alpe Dévero al Rifugio") == \
+        ['parchegg', 'alp', 'dever', 'rifug']
+    # Singular and plural forms share a term
+    assert tokenize('rifugi') == tokenize('rifugio')
+    assert tokenize('laghi') == tokenize('lago')
+    assert tokenize('quota 2061 m') == ['quot', '2061']
+    assert tokenize(None) == []
+
+
+def test_text_index_ranks_with_bm25():
+    index = TextIndex([
+        'Rifugio al lago, sentiero dal lago superiore',
+        'Bivacco sul colle, vista sul lago',
+        'Rifugio in valle',
+        None,
+    ])
+    scores = index.scores('Laghi')
+    assert scores[0] > scores[1] > 0
+    assert scores[2] == scores[3] == 0
+    assert not index.scores('il della').any()
+    assert index.scores('valle colle').nonzero()[0].tolist() == [1, 2]
+
+
+def test_full_text_query_combines_with_filters():
+    response = client.get(
+        '/cleaned_csv_show?q=alpe devero&fields=DENOMINAZIONE,Score')
+    results = response.json()
+    assert results[0]['DENOMINAZIONE'] == 'Rifugio - Sesto Calende [1630m]'
+    scores = [result['Score'] for result in results]
+    assert scores == sorted(scores, reverse=True) and scores[-1] > 0
+
+    response = client.get('/cleaned_csv_show?q=lago&provincia=cuneo')
+    assert response.json()
+    assert {result['PROVINCIA'] for result in response.json()} == {'CUNEO'}
+
+    with patch('app.main.get_coordinates', new_callable=AsyncMock,
+               return_value=(46.116, 8.292)):
+        response = client.get(
+            '/cleaned_csv_show?q=lago&location=Domodossola&range_km=30')
+    results = response.json()
+    assert results and all(result['Score'] > 0 for result in results)
+    distances = [result['Distance_km'] for result in results]
+    assert distances == sorted(distances) and distances[-1] <= 30
+
+    assert client.get('/cleaned_csv_show?q=zzzz').json() == []
+
+
+def test_metrics_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    hits = registry.counter('hits_total', 'Cache hits.')
+    calls = registry.counter('calls_total', 'API calls.',
+                             labelnames=('outcome',))
+    latency = registry.histogram('latency_seconds', 'Latency.',
+                                 buckets=(0.1, 1.0))
+    assert registry.counter('hits_total', 'Cache hits.') is hits
+    hits.inc()
+    calls.inc(outcome='ok')
+    calls.inc(2, outcome='say "hi"')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    assert registry.render().splitlines() == [
+        '# HELP calls_total API calls.',
+        '# TYPE calls_total counter',
+        'calls_total{outcome="ok"} 1',
+        'calls_total{outcome="say \\"hi\\""} 2',
+        '# HELP hits_total Cache hits.',
+        '# TYPE hits_total counter',
+        'hits_total 1',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        'latency_seconds_sum 0.55',
+        'latency_seconds_count 2',
+    ]
+    with pytest.raises(ValueError):
+        registry.histogram('hits_total', 'Not a histogram.')
+
+
+def test_geocoder_counts_cache_hits_and_api_calls():
+    calls = []
+    registry = MetricsRegistry()
+    stub_geocoder = AsyncGeocoder('http://geocoder.test/json', 'key',
+                                  cache=GeocodeCache(),
+                                  transport=make_geocoding_stub(calls),
+                                  metrics=registry)
+
+    async def run():
+        for address in ['Torino', 'torino', 'Cuneo']:
+            await stub_geocoder.get_coordinates(address)
+        await stub_geocoder.aclose()
+
+    asyncio.run(run())
+    assert stub_geocoder.cache_hits.value() == 1
+    assert stub_geocoder.cache_misses.value() == 2
+    assert stub_geocoder.api_calls.value(outcome='ok') == 2
+    assert 'geocode_api_call_seconds_count 2' in registry.render()
+
+
+def test_metrics_endpoint_and_server_timing():
+    with patch('app.main.get_coordinates', new_callable=AsyncMock,
+               return_value=(45.07, 7.69)):
+        response = client.get(
+            '/cleaned_csv_show?location=Torino&range_km=37&letti=8')
+    stages = [part.split(';')[0]
+              for part in response.headers['server-timing'].split(', ')]
+    assert stages == ['load', 'geocode', 'filter', 'serialize']
+
+    text = client.get('/metrics').text
+    assert client.get('/metrics').headers['content-type'].startswith(
+        'text/plain; version=0.0.4')
+    assert 'shelters_stage_seconds_count{stage="geocode"}' in text
+    assert 'http_request_duration_seconds_count{method="GET",' \
+           'path="/cleaned_csv_show",status="200"}' in text
+    assert 'shelters_results_count' in text
+    assert 'response_cache_misses_total' in text
+
+
+def test_sampling_profiler_writes_collapsed_stacks(tmp_path):
+    profiler = SamplingProfiler(2, str(tmp_path))
+
+    def work():
+        return sorted(str(i) for i in range(20000))
+
+    for _ in range(4):
+        with profiler.sample('/cleaned_csv_show'):
+            work()
+    folded = sorted(path.name for path in tmp_path.glob('*.folded'))
+    assert len(folded) == 2 and len(list(tmp_path.glob('*.prof'))) == 2
+    assert folded[0].endswith('-2_cleaned_csv_show.folded')
+    lines = (tmp_path / folded[0]).read_text().splitlines()
+    stack, micros = lines[-1].rsplit(' ', 1)
+    assert int(micros) > 0
+    assert any(line.startswith('work (test_main.py:') for line in lines)
+    # Sampling is off with every=0
+    with SamplingProfiler(0, str(tmp_path / 'off')).sample():
+        work()
+    assert not (tmp_path / 'off').exists()
@@ -0,0 +1,233 @@
+"""
+Client for the FastAPI backend.
+
+All requests share one pooled keep-alive session with strict timeouts.
+Responses are cached for a short time, keyed by their normalized query
+parameters, and revalidated with the ETag the backend sends, so popular
+views are served without a backend round trip. Large JSON arrays can be
+streamed, decoding each item as soon as it arrives.
+"""
+
+import codecs
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Characters that may follow a complete item of a JSON array
+ITEM_ENDS = frozenset(' \t\r\n,]')
+
+# Characters that may still extend a number cut at the end of a chunk
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+def normalize_params(params):
+    """
+    Normalize query parameters, so that equivalent queries share a cache
+    entry.
+
+    Parameters whose value is None or blank are dropped, as the backend
+    treats them as not given, and the others are stripped and sorted.
+
+    Args:
+        params (dict): The query parameters.
+
+    Returns:
+        tuple: Sorted (name, value) pairs.
+    """
+    normalized = []
+    for name, value in (params or {}).items():
+        if value is None:
+            continue
+        value = str(value).strip()
+        if value:
+            normalized.append((name, value))
+    return tuple(sorted(normalized))
+
+
+def iter_json_array(chunks, first=''):
+    """
+    Decode the items of a JSON array incrementally.
+
+    An item is only yielded once the character following it is read, so
+    that a number split between two chunks is decoded whole.
+
+    Args:
+        chunks (iterable): Pieces of the JSON text, in order.
+        first (str): Text read before `chunks`.
+
+    Yields:
+        Each item of the array, as soon as it is complete.
+
+    Raises:
+        ValueError: If the text is not a well-formed JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer, started, chunks = first, False, iter(chunks)
+    while True:
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                if buffer[pos] == ',' and not started:
+                    raise ValueError("Not a JSON array")
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError("Not a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            if end == len(buffer) or buffer[end] not in ITEM_ENDS:
+                # A number may continue in the next chunk, e.g. "15." may
+                # be followed by "0"
+                if all(char in NUMBER_CHARS for char in buffer[end:]):
+                    break
+                raise ValueError("Malformed JSON array")
+            yield item
+            pos = end
+        buffer = buffer[pos:]
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("Truncated JSON array")
+        buffer += chunk
+
+
+class BackendClient:
+    """Pooled, caching HTTP client for the backend API."""
+
+    def __init__(self, base_url, timeout=(3.05, 10.0), ttl=30.0,
+                 max_entries=256, pool_size=10, retries=2):
+        """
+        Create the client.
+
+        Args:
+            base_url (str): URL of the backend, e.g. 'http://backend:80'.
+            timeout (tuple): Connect and read timeouts, in seconds.
+            ttl (float): Seconds a response is served from the cache
+                before being revalidated with the backend.
+            max_entries (int): Maximum number of cached responses.
+            pool_size (int): Number of keep-alive connections kept open.
+            retries (int): Retries of requests that failed to connect or
+                got a 502 or 504 response. A 503, which the backend sends
+                while the dataset is being prepared, is not retried: its
+                Retry-After would hold the request for up to a minute.
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=0.2,
+                              status_forcelist=[502, 504],
+                              allowed_methods=['GET'],
+                              respect_retry_after_header=False,
+                              raise_on_status=False))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+            return entry
+
+    def _store(self, key, etag, data):
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, etag, data)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def stream_json(self, path, params=None, chunk_size=16384):
+        """
+        GET a backend path, decoding a JSON array body as it arrives.
+
+        A fresh cached response is returned without contacting the backend.
+        A stale one is revalidated with If-None-Match and reused when the
+        backend answers 304 Not Modified. A streamed array is cached once
+        it has been read to the end.
+
+        Args:
+            path (str): Path of the endpoint, e.g. '/cleaned_csv_show'.
+            params (dict): Query parameters; None and blank values are
+                left out.
+            chunk_size (int): Bytes read from the connection at a time.
+
+        Returns:
+            An iterator over the items when the body is a JSON array, or
+            the decoded body otherwise, e.g. an error object.
+
+        Raises:
+            requests.RequestException: If the request fails or times out.
+        """
+        query = normalize_params(params)
+        key = (path, query)
+        entry = self._cached(key)
+        if entry is not None and entry[0] > time.monotonic():
+            data = entry[2]
+            return iter(data) if isinstance(data, list) else data
+
+        headers = {}
+        if entry is not None and entry[1]:
+            headers['If-None-Match'] = entry[1]
+        response = self.session.get(
+            f'{self.base_url}{path}', params=list(query), headers=headers,
+            timeout=self.timeout, stream=True)
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            self._store(key, entry[1], entry[2])
+            data = entry[2]
+            return iter(data) if isinstance(data, list) else data
+        try:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            chunks = (decoder.decode(chunk) for chunk in
+                      response.iter_content(chunk_size=chunk_size))
+            # Read up to the first character to tell arrays from objects
+            first = ''
+            for chunk in chunks:
+                first += chunk
+                if first.strip():
+                    break
+        except Exception:
+            response.close()
+            raise
+        etag = response.headers.get('ETag')
+        if not first.lstrip().startswith('['):
+            data = json.loads(first + ''.join(chunks))
+            response.close()
+            self._store(key, etag, data)
+            return data
+        return self._stream_items(response, chunks, first, key, etag)
+
+    def _stream_items(self, response, chunks, first, key, etag):
+        items = []
+        try:
+            for item in iter_json_array(chunks, first):
+                items.append(item)
+                yield item
+            self._store(key, etag, items)
+        finally:
+            response.close()
+
+    def clear(self):
+        """Drop every cached response."""
+        with self._lock:
+            self._cache.clear()
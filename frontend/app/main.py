@@ -5,11 +5,15 @@ This module defines a simple Flask application that serves
 as the frontend for the project.
 """
 
-from flask import Flask, render_template, request
+from urllib.parse import urlencode
+
 import requests
+from flask import Flask, render_template, request, stream_template
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField
 
+from backend_client import BackendClient, normalize_params
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
 
@@ -17,6 +21,16 @@ app.config['SECRET_KEY'] = 'your_secret_key'
 FASTAPI_BACKEND_HOST = 'http://backend'
 BACKEND_URL = f'{FASTAPI_BACKEND_HOST}/query/'
 
+# Pooled, caching client shared by all the views
+backend = BackendClient(f'{FASTAPI_BACKEND_HOST}:80')
+
+# Number of shelters rendered per page of the Piemonte view
+PAGE_SIZE = 30
+
+# Shown while the backend answers 503, before its dataset is ready
+DATASET_PREPARING_MESSAGE = ('⏳ The shelters dataset is being prepared, '
+                             'please retry shortly.')
+
 
 class QueryForm(FlaskForm):
     """Form for submitting queries to the backend."""
@@ -36,43 +50,155 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/piemonte')
-def piemonte():
+class ResultPage:
     """
-    Render the Piemonte page with dynamic content based on query parameters.
+    Iterates over at most `size` results, noting whether more follow.
 
-    This function fetches data from the backend based on query parameters
-    provided by the user and renders the Piemonte page with this data.
+    The results are fetched one more than the page size, so that the
+    extra one tells whether to offer a next page.
+    """
+
+    def __init__(self, items, size):
+        """
+        Wrap a page of results.
+
+        Args:
+            items (iterable): The results, up to size + 1 of them.
+            size (int): Number of results in a page.
+        """
+        self.items = items
+        self.size = size
+        self.has_more = False
+
+    def __iter__(self):
+        count = 0
+        for item in self.items:
+            if count < self.size:
+                count += 1
+                yield item
+            else:
+                self.has_more = True
+
+
+def shelter_query():
+    """
+    Read the shelter filters from the query string.
 
     Returns:
-        Rendered HTML content for the Piemonte page.
+        dict: The filters, None for the ones not given.
     """
-    # Fetch query parameters
-    query_params = {
+    return {
         'bagni': request.args.get('bagni'),
         'camere': request.args.get('camere'),
         'letti': request.args.get('letti'),
         'provincia': request.args.get('provincia'),
         'comune': request.args.get('comune'),
         'location': request.args.get('location'),
-        'range_km': request.args.get('range_km')
+        'range_km': request.args.get('range_km'),
+        'q': request.args.get('q')
     }
 
-    # Fetch data from the backend with query parameters
-    response = requests.get(
-        'http://backend:80/cleaned_csv_show',
-        params=query_params)
-    response.raise_for_status()
-    cleaned_data = response.json()
+
+def fetch_page(query_params, offset=0):
+    """
+    Start streaming a page of shelters from the backend.
+
+    Args:
+        query_params (dict): The shelter filters.
+        offset (int): Number of shelters before the page.
+
+    Returns:
+        ResultPage over the shelters as they arrive, or the error
+        message of the backend.
+    """
+    results = backend.stream_json(
+        '/cleaned_csv_show',
+        dict(query_params, limit=PAGE_SIZE + 1, offset=offset))
+    if isinstance(results, dict):
+        return results.get('error', 'Unexpected response from the backend.')
+    return ResultPage(results, PAGE_SIZE)
+
+
+def is_dataset_preparing(error):
+    """
+    Tell whether a failed request was answered 503 by the backend, which
+    it does while the shelters are being scraped or loaded.
+
+    Args:
+        error (requests.RequestException): The error of the request.
+
+    Returns:
+        bool: True if the dataset is not ready yet.
+    """
+    return (isinstance(error, requests.HTTPError)
+            and error.response is not None
+            and error.response.status_code == 503)
+
+
+@app.route('/piemonte')
+def piemonte():
+    """
+    Render the Piemonte page with dynamic content based on query parameters.
+
+    This function fetches data from the backend based on query parameters
+    provided by the user and streams the Piemonte page as the shelters
+    arrive. Only the first page of shelters is rendered; the others are
+    loaded on demand through piemonte_more().
+
+    Returns:
+        Rendered HTML content for the Piemonte page.
+    """
+    # Fetch query parameters
+    query_params = shelter_query()
+
+    # Fetch data from the backend with query parameters, through the
+    # client's cache; empty parameters are not sent
+    try:
+        page = fetch_page(query_params)
+    except requests.HTTPError as e:
+        if not is_dataset_preparing(e):
+            raise
+        return render_template(
+            'piemonte.html', error_message=DATASET_PREPARING_MESSAGE,
+            cleaned_data=[]), 503
 
     # Check for an error in the response
-    if 'error' in cleaned_data:
-        error_message = cleaned_data['error']
+    if isinstance(page, str):
         # Render the Piemonte page with an error message
         return render_template(
-            'piemonte.html', error_message=error_message, cleaned_data=[])
+            'piemonte.html', error_message=page, cleaned_data=[])
+
+    return stream_template(
+        'piemonte.html', cleaned_data=page, page=page,
+        more_query=urlencode(normalize_params(query_params)),
+        next_offset=PAGE_SIZE)
 
-    return render_template('piemonte.html', cleaned_data=cleaned_data)
+
+@app.route('/piemonte/more')
+def piemonte_more():
+    """
+    Render the next page of shelters of the Piemonte page, as an HTML
+    fragment appended by the "Load more" button.
+
+    Returns:
+        Streamed HTML fragment with the shelter cards.
+    """
+    offset = request.args.get('offset', default=0, type=int)
+    try:
+        page = fetch_page(shelter_query(), offset)
+    except requests.HTTPError as e:
+        if not is_dataset_preparing(e):
+            raise
+        # Keep the "Load more" button on the same offset, to retry
+        page = ResultPage([], PAGE_SIZE)
+        page.has_more = True
+        return render_template(
+            'shelter_page.html', page=page, next_offset=offset,
+            message=DATASET_PREPARING_MESSAGE), 503
+    if isinstance(page, str):
+        page = ResultPage([], PAGE_SIZE)
+    return stream_template('shelter_page.html', page=page,
+                           next_offset=offset + PAGE_SIZE)
 
 
 @app.route('/project_description')
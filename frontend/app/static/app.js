@@ -11,5 +11,35 @@ document.addEventListener('DOMContentLoaded', (event) => {
         });
     });
 
+    // Load the next page of shelters of the Piemonte page on demand
+    var loadMore = document.getElementById('load-more');
+    if (loadMore) {
+        loadMore.addEventListener('click', () => {
+            var query = loadMore.dataset.query;
+            var url = '/piemonte/more?' + (query ? query + '&' : '') +
+                'offset=' + loadMore.dataset.offset;
+            loadMore.disabled = true;
+            fetch(url)
+                .then((response) => response.text())
+                .then((html) => {
+                    var list = document.getElementById('shelter-list');
+                    // Drop the notice of a previous attempt, if any
+                    list.querySelectorAll('.load-more-message')
+                        .forEach((message) => message.remove());
+                    list.insertAdjacentHTML('beforeend', html);
+                    var state = list.querySelector('.load-more-state');
+                    if (state) {
+                        loadMore.dataset.offset = state.dataset.nextOffset;
+                        if (state.dataset.hasMore !== 'true') {
+                            loadMore.remove();
+                        }
+                        state.remove();
+                    }
+                    loadMore.disabled = false;
+                })
+                .catch(() => { loadMore.disabled = false; });
+        });
+    }
+
     // Additional JavaScript for other components can be added here
 });
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The app modules import each other as top-level modules
+sys.path.insert(0, os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'app')))
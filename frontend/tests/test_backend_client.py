@@ -0,0 +1,177 @@
+import json
+import random
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from backend_client import BackendClient, iter_json_array, normalize_params
+
+ITEMS = [
+    123456789, 15000000000.0, -0.25, 1.5e-07, 0, -12, None, True, False,
+    'str', '', 'Rifugio "Città di Cuneo"', 'a\\b\nc', 'Ügo ✓',
+    [1, 2, [3]], [], {},
+    {'PROVINCIA': 'CUNEO', 'LETTI': 20, 'Distance_km': 3.25,
+     'Tags': ['a', None]},
+]
+
+
+def random_splits(text, rng, max_size=8):
+    """Cut `text` into pieces of random sizes."""
+    pieces = []
+    while text:
+        size = rng.randint(1, max_size)
+        pieces.append(text[:size])
+        text = text[size:]
+    return pieces
+
+
+def test_iter_json_array_number_split_at_decimal_point():
+    chunks = ['[123456789, 15000000000.', '0', ', null, ', 'true, "',
+              'str", [1, 2, [3]]]']
+    assert list(iter_json_array(chunks)) == [
+        123456789, 15000000000.0, None, True, 'str', [1, 2, [3]]]
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_iter_json_array_random_splits(indent):
+    text = json.dumps(ITEMS, indent=indent, ensure_ascii=False)
+    rng = random.Random(indent)
+    for _ in range(300):
+        chunks = random_splits(text, rng)
+        assert list(iter_json_array(chunks)) == ITEMS
+        assert list(iter_json_array(chunks[1:], first=chunks[0])) == ITEMS
+
+
+@pytest.mark.parametrize('text, items', [
+    ('[]', []),
+    (' [ ] ', []),
+    ('[1e5, 2E-3, -7]', [1e5, 2e-3, -7]),
+])
+def test_iter_json_array_small_arrays(text, items):
+    for size in range(1, len(text) + 1):
+        chunks = [text[start:start + size]
+                  for start in range(0, len(text), size)]
+        assert list(iter_json_array(chunks)) == items
+
+
+@pytest.mark.parametrize('text', [
+    '{"error": "none"}', '[1, 2', '[1x]', '["a"1]', '',
+])
+def test_iter_json_array_rejects_malformed_text(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(random_splits(text, random.Random(0))))
+
+
+def fake_response(body, rng, status_code=200, etag='"v1"'):
+    """A streamed requests response sending `body` in random pieces."""
+    response = MagicMock(status_code=status_code, headers={'ETag': etag})
+    response.iter_content.side_effect = lambda chunk_size: iter(
+        random_splits(body, rng))
+    return response
+
+
+def test_stream_json_random_splits():
+    # Non-ASCII characters are cut in the middle of their UTF-8 bytes too
+    body = json.dumps(ITEMS, ensure_ascii=False).encode('utf-8')
+    rng = random.Random(1)
+    for _ in range(100):
+        client = BackendClient('http://backend')
+        response = fake_response(body, rng)
+        with patch.object(client.session, 'get',
+                          return_value=response) as get:
+            assert list(client.stream_json('/cleaned_csv_show')) == ITEMS
+            response.close.assert_called()
+            # The array read to the end is served from the cache
+            assert list(client.stream_json('/cleaned_csv_show')) == ITEMS
+            assert get.call_count == 1
+
+
+def test_stream_json_returns_objects_whole():
+    body = json.dumps({'error': 'No results found for the COMUNE "Ügo"'},
+                      ensure_ascii=False).encode('utf-8')
+    rng = random.Random(2)
+    for _ in range(20):
+        client = BackendClient('http://backend')
+        with patch.object(client.session, 'get',
+                          return_value=fake_response(body, rng)):
+            assert client.stream_json('/cleaned_csv_show', {'comune': 'x'}) \
+                == json.loads(body)
+
+
+def test_stream_json_truncated_array_is_not_cached():
+    body = json.dumps(ITEMS).encode('utf-8')[:-5]
+    client = BackendClient('http://backend')
+    with patch.object(client.session, 'get',
+                      return_value=fake_response(body, random.Random(3))):
+        with pytest.raises(ValueError):
+            list(client.stream_json('/cleaned_csv_show'))
+    assert client._cached(('/cleaned_csv_show', ())) is None
+
+
+def test_normalize_params_ignores_order_and_blank_values():
+    assert normalize_params({'provincia': ' Cuneo ', 'comune': None,
+                             'q': '', 'letti': 3}) == \
+        (('letti', '3'), ('provincia', 'Cuneo'))
+    assert normalize_params({'b': '1', 'a': '2'}) == \
+        normalize_params({'a': '2', 'b': '1', 'c': '  '})
+
+
+def test_equivalent_queries_share_a_cache_entry():
+    client = BackendClient('http://backend')
+    body = json.dumps(ITEMS).encode('utf-8')
+    with patch.object(client.session, 'get', return_value=fake_response(
+            body, random.Random(4))) as get:
+        assert list(client.stream_json(
+            '/cleaned_csv_show', {'provincia': 'CUNEO', 'letti': '3'})) == \
+            ITEMS
+        assert list(client.stream_json(
+            '/cleaned_csv_show',
+            {'letti': ' 3', 'comune': '', 'provincia': 'CUNEO'})) == ITEMS
+    assert get.call_count == 1
+    assert get.call_args.kwargs['params'] == [('letti', '3'),
+                                              ('provincia', 'CUNEO')]
+
+
+def test_stale_response_is_revalidated_with_its_etag():
+    client = BackendClient('http://backend', ttl=30.0)
+    body = json.dumps(ITEMS).encode('utf-8')
+    not_modified = MagicMock(status_code=304, headers={})
+    with patch('backend_client.time.monotonic', return_value=100.0) as now, \
+            patch.object(client.session, 'get') as get:
+        get.return_value = fake_response(body, random.Random(5))
+        assert list(client.stream_json('/cleaned_csv_show')) == ITEMS
+
+        # Still fresh: served from the cache
+        now.return_value = 129.0
+        assert list(client.stream_json('/cleaned_csv_show')) == ITEMS
+        assert get.call_count == 1
+
+        # Expired: revalidated, and the cached body reused on a 304
+        now.return_value = 131.0
+        get.return_value = not_modified
+        assert list(client.stream_json('/cleaned_csv_show')) == ITEMS
+        assert get.call_count == 2
+        assert get.call_args.kwargs['headers'] == {'If-None-Match': '"v1"'}
+        not_modified.close.assert_called()
+
+        # The 304 made the entry fresh again
+        now.return_value = 160.0
+        assert list(client.stream_json('/cleaned_csv_show')) == ITEMS
+        assert get.call_count == 2
+
+        # A changed body replaces the cached one
+        now.return_value = 200.0
+        get.return_value = fake_response(b'[1, 2]', random.Random(6),
+                                         etag='"v2"')
+        assert list(client.stream_json('/cleaned_csv_show')) == [1, 2]
+        assert get.call_args.kwargs['headers'] == {'If-None-Match': '"v1"'}
+        assert client._cached(('/cleaned_csv_show', ()))[1:] == \
+            ('"v2"', [1, 2])
+
+
+def test_unavailable_backend_is_not_retried():
+    retry = BackendClient('http://backend').session.get_adapter(
+        'http://backend').max_retries
+    assert not retry.is_retry('GET', 503, has_retry_after=True)
+    assert retry.is_retry('GET', 502)
+    assert not retry.respect_retry_after_header
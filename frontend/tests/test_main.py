@@ -0,0 +1,121 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+import main
+from main import DATASET_PREPARING_MESSAGE, PAGE_SIZE, app
+
+client = app.test_client()
+
+
+def shelters(count, start=0):
+    return [{'DENOMINAZIONE': f'Rifugio {number}', 'PROVINCIA': 'CUNEO'}
+            for number in range(start, start + count)]
+
+
+def unavailable_response():
+    """A backend response to a request made while the dataset loads."""
+    response = MagicMock(status_code=503, headers={'Retry-After': '60'})
+    response.raise_for_status.side_effect = requests.HTTPError(
+        '503 Server Error', response=response)
+    return response
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    main.backend.clear()
+    yield
+    main.backend.clear()
+
+
+def test_piemonte_renders_the_first_page():
+    with patch.object(main.backend, 'stream_json',
+                      return_value=iter(shelters(PAGE_SIZE + 1))) as stream:
+        response = client.get('/piemonte?provincia=CUNEO&comune=')
+        html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert f'Rifugio {PAGE_SIZE - 1}<' in html
+    assert f'Rifugio {PAGE_SIZE}<' not in html
+    assert 'id="load-more"' in html
+    assert 'data-query="provincia=CUNEO"' in html
+    assert f'data-offset="{PAGE_SIZE}"' in html
+    path, params = stream.call_args.args
+    assert path == '/cleaned_csv_show'
+    assert params['provincia'] == 'CUNEO'
+    assert (params['limit'], params['offset']) == (PAGE_SIZE + 1, 0)
+
+
+def test_piemonte_without_more_results_has_no_load_more_button():
+    with patch.object(main.backend, 'stream_json',
+                      return_value=iter(shelters(3))):
+        html = client.get('/piemonte').get_data(as_text=True)
+    assert 'Rifugio 2<' in html
+    assert 'id="load-more"' not in html
+
+
+def test_piemonte_shows_the_backend_error():
+    error = {'error': 'No results found for the COMUNE "Ügo"'}
+    with patch.object(main.backend, 'stream_json', return_value=error):
+        response = client.get('/piemonte?comune=Ügo')
+    assert response.status_code == 200
+    assert 'No results found for the COMUNE' in \
+        response.get_data(as_text=True)
+
+
+def test_piemonte_while_the_dataset_is_prepared():
+    with patch.object(main.backend.session, 'get',
+                      return_value=unavailable_response()) as get:
+        response = client.get('/piemonte')
+    assert response.status_code == 503
+    assert DATASET_PREPARING_MESSAGE in response.get_data(as_text=True)
+    assert get.call_count == 1
+
+
+def test_piemonte_more_renders_the_next_page():
+    with patch.object(main.backend, 'stream_json',
+                      return_value=iter(shelters(PAGE_SIZE + 1, PAGE_SIZE))
+                      ) as stream:
+        response = client.get(f'/piemonte/more?letti=3&offset={PAGE_SIZE}')
+        html = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert f'Rifugio {PAGE_SIZE}<' in html
+    assert f'Rifugio {2 * PAGE_SIZE}<' not in html
+    assert 'data-has-more="true"' in html
+    assert f'data-next-offset="{2 * PAGE_SIZE}"' in html
+    params = stream.call_args.args[1]
+    assert (params['letti'], params['offset']) == ('3', PAGE_SIZE)
+
+
+def test_piemonte_more_last_page():
+    with patch.object(main.backend, 'stream_json',
+                      return_value=iter(shelters(2))):
+        html = client.get('/piemonte/more?offset=60').get_data(as_text=True)
+    assert 'Rifugio 1<' in html
+    assert 'data-has-more="false"' in html
+
+
+def test_piemonte_more_while_the_dataset_is_prepared():
+    with patch.object(main.backend.session, 'get',
+                      return_value=unavailable_response()):
+        response = client.get(f'/piemonte/more?offset={PAGE_SIZE}')
+    html = response.get_data(as_text=True)
+    assert response.status_code == 503
+    assert DATASET_PREPARING_MESSAGE in html
+    # The button stays, to retry the same page
+    assert 'data-has-more="true"' in html
+    assert f'data-next-offset="{PAGE_SIZE}"' in html
+
+
+def test_other_backend_failures_are_not_masked():
+    response = MagicMock(status_code=500, headers={})
+    response.raise_for_status.side_effect = requests.HTTPError(
+        '500 Server Error', response=response)
+    app.testing = True
+    try:
+        with patch.object(main.backend.session, 'get',
+                          return_value=response):
+            with pytest.raises(requests.HTTPError):
+                client.get('/piemonte')
+    finally:
+        app.testing = False